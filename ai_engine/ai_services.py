@@ -6,7 +6,8 @@ from sklearn.cluster import KMeans
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import StandardScaler
 from .models import ProductRecommendation, PricingModel, CustomerSegment, MLModel
-from products.models import Product, UserBehavior
+from products.models import Product
+from products.behavior import behavior_counts
 from accounts.models import UserProfile
 from orders.models import Order, OrderItem
 import pickle
@@ -20,22 +21,23 @@ class RecommendationEngine:
     
     def prepare_data(self):
         """Prepare data for collaborative filtering"""
-        # Get user behavior data
-        behaviors = UserBehavior.objects.filter(behavior_type__in=['view', 'purchase'])
+        # Get user behavior data: daily rollups for history plus the raw tail
+        counts = behavior_counts(behavior_types=['view', 'purchase'])
         
-        if not behaviors.exists():
-            return None
-            
-        # Create user-item interaction matrix
-        data = []
-        for behavior in behaviors:
-            if behavior.product:
-                score = 3 if behavior.behavior_type == 'purchase' else 1
-                data.append({
-                    'user_id': behavior.user.id,
-                    'product_id': behavior.product.id,
-                    'score': score
-                })
+        # Score is the mean over events (3 per purchase, 1 per view), which is
+        # what pivot_table computed when it was fed one row per event
+        pairs = {}
+        for (user_id, product_id, behavior_type), count in counts.items():
+            if product_id is None:
+                continue
+            total, events = pairs.get((user_id, product_id), (0, 0))
+            score = 3 if behavior_type == 'purchase' else 1
+            pairs[(user_id, product_id)] = (total + score * count, events + count)
+        
+        data = [
+            {'user_id': user_id, 'product_id': product_id, 'score': total / events}
+            for (user_id, product_id), (total, events) in pairs.items()
+        ]
         
         if not data:
             return None
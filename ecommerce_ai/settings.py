@@ -65,6 +65,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'products.context_processors.cart',
             ],
         },
     },
@@ -77,6 +78,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so concurrent
+            # checkouts queue up (for up to `timeout` seconds) instead of
+            # failing with "database is locked" when upgrading a read lock.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file for tests too: the shared-cache in-memory test database
+        # fails concurrent writers at once instead of honouring `timeout`.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -142,6 +153,80 @@ LOGOUT_REDIRECT_URL = '/'
 STRIPE_PUBLISHABLE_KEY = config('STRIPE_PUBLISHABLE_KEY', default='pk_test_your_stripe_key')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY', default='sk_test_your_stripe_key')
 
+# Most ids/SKUs a single /api/products/batch/ request may resolve
+PRODUCT_API_BATCH_LIMIT = config('PRODUCT_API_BATCH_LIMIT', default=100, cast=int)
+
+# Write-behind product view counter (seconds between batched flushes)
+VIEW_COUNTER_FLUSH_SECONDS = config('VIEW_COUNTER_FLUSH_SECONDS', default=5.0, cast=float)
+
+# Cart store: user carts live in Cart/CartItem; anonymous carts live only
+# in this cache, for CART_CACHE_TIMEOUT seconds. Local memory by default;
+# set CART_CACHE_URL to a Redis URL when several processes serve the site
+# so they share anonymous carts.
+CART_CACHE_ALIAS = config('CART_CACHE_ALIAS', default='carts')
+CART_CACHE_URL = config('CART_CACHE_URL', default='')
+CART_CACHE_MAX_ENTRIES = config('CART_CACHE_MAX_ENTRIES', default=100000, cast=int)
+CART_CACHE_TIMEOUT = config('CART_CACHE_TIMEOUT', default=14 * 24 * 3600, cast=int)
+# Largest quantity one cart API operation may add or set
+CART_MAX_QUANTITY = config('CART_MAX_QUANTITY', default=99, cast=int)
+# Most operations a single /api/cart/batch/ request may apply
+CART_API_BATCH_LIMIT = config('CART_API_BATCH_LIMIT', default=50, cast=int)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CART_CACHE_URL,
+        'TIMEOUT': CART_CACHE_TIMEOUT,
+    } if CART_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'carts',
+        'TIMEOUT': CART_CACHE_TIMEOUT,
+        'OPTIONS': {'MAX_ENTRIES': CART_CACHE_MAX_ENTRIES},
+    },
+}
+
+# How long checkout holds stock for an unpaid order before the sweeper
+# (sweep_reservations) gives it back and cancels the order
+INVENTORY_HOLD_SECONDS = config('INVENTORY_HOLD_SECONDS', default=900, cast=int)
+
+# Payment queue: gateway ('stripe' or the in-process 'stub'), background
+# workers per process (0 charges synchronously), attempts per payment and
+# the first retry delay, doubled on each further attempt
+PAYMENT_GATEWAY = config('PAYMENT_GATEWAY', default='stripe')
+PAYMENT_WORKERS = config('PAYMENT_WORKERS', default=2, cast=int)
+PAYMENT_MAX_ATTEMPTS = config('PAYMENT_MAX_ATTEMPTS', default=3, cast=int)
+PAYMENT_RETRY_SECONDS = config('PAYMENT_RETRY_SECONDS', default=2.0, cast=float)
+PAYMENT_STUB_LATENCY = config('PAYMENT_STUB_LATENCY', default=0.0, cast=float)
+PAYMENT_STUB_FAILURE_RATE = config('PAYMENT_STUB_FAILURE_RATE', default=0.0, cast=float)
+
+# Buffered UserBehavior event pipeline
+BEHAVIOR_EVENT_BATCH_SIZE = config('BEHAVIOR_EVENT_BATCH_SIZE', default=500, cast=int)
+BEHAVIOR_EVENT_FLUSH_SECONDS = config('BEHAVIOR_EVENT_FLUSH_SECONDS', default=2.0, cast=float)
+BEHAVIOR_EVENT_QUEUE_SIZE = config('BEHAVIOR_EVENT_QUEUE_SIZE', default=50000, cast=int)
+BEHAVIOR_EVENT_MAX_ATTEMPTS = config('BEHAVIOR_EVENT_MAX_ATTEMPTS', default=3, cast=int)
+BEHAVIOR_EVENT_RETRY_SECONDS = config('BEHAVIOR_EVENT_RETRY_SECONDS', default=0.5, cast=float)
+# Raw events older than this are folded into daily rollups by compact_behavior
+BEHAVIOR_RAW_RETENTION_DAYS = config('BEHAVIOR_RAW_RETENTION_DAYS', default=30, cast=int)
+
+# Local working files (downloaded images, market price answers); not in git
+LOCAL_CACHE_DIR = config('LOCAL_CACHE_DIR', default=str(BASE_DIR / '.cache'))
+
+# Disk cache for downloaded remote product images (cache_product_images)
+IMAGE_CACHE_DIR = config('IMAGE_CACHE_DIR', default=os.path.join(LOCAL_CACHE_DIR, 'images'))
+
+# Gemini market-price lookups (update_prices_with_gemini)
+GEMINI_API_KEY = config('GEMINI_API_KEY', default='')
+GEMINI_API_URL = config(
+    'GEMINI_API_URL',
+    default='https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent',
+)
+MARKET_PRICE_REQUESTS_PER_SECOND = config('MARKET_PRICE_REQUESTS_PER_SECOND', default=0.5, cast=float)
+MARKET_PRICE_CACHE_TTL = config('MARKET_PRICE_CACHE_TTL', default=24 * 3600, cast=int)
+MARKET_PRICE_CACHE_FILE = config('MARKET_PRICE_CACHE_FILE', default=os.path.join(LOCAL_CACHE_DIR, 'market_prices.json'))
+
 # AI/ML settings
 AI_MODEL_PATH = BASE_DIR / 'ai_models'
 os.makedirs(AI_MODEL_PATH, exist_ok=True)
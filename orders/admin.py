@@ -1,27 +1,81 @@
-from django.contrib import admin
-from .models import Order, OrderItem, Payment, Shipping, OrderHistory
+from django.contrib import admin, messages
+from .history import refresh_item_summary
+from .lifecycle import UNCANCELLABLE_PAYMENT, bulk_transition
+from .models import Order, OrderItem, Payment, Shipping, OrderHistory, StockReservation, StockReservationLine
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     readonly_fields = ['total']
     extra = 0
 
+class OrderHistoryInline(admin.TabularInline):
+    model = OrderHistory
+    readonly_fields = ['status', 'comment', 'created_by', 'created_at']
+    extra = 0
+    can_delete = False
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['order_id', 'user', 'status', 'payment_status', 'total', 'created_at']
     list_filter = ['status', 'payment_status', 'created_at']
     search_fields = ['order_id', 'user__username']
-    readonly_fields = ['order_id', 'created_at', 'updated_at']
-    inlines = [OrderItemInline]
+    # Statuses only move through the lifecycle actions below
+    readonly_fields = ['order_id', 'status', 'payment_status', 'item_count', 'thumbnail',
+                       'created_at', 'updated_at', 'paid_at', 'shipped_at', 'delivered_at']
+    inlines = [OrderItemInline, OrderHistoryInline]
+    actions = ['mark_shipped', 'mark_delivered', 'mark_cancelled', 'mark_refunded']
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        refresh_item_summary(form.instance)
+    
+    def _transition(self, request, queryset, status, **kwargs):
+        moved, skipped = bulk_transition(queryset, status, user=request.user, comment='Changed in admin', **kwargs)
+        self.message_user(request, f'{len(moved)} orders marked {status}.', messages.SUCCESS)
+        if skipped:
+            self.message_user(request, f'{len(skipped)} orders could not be marked {status} from their current status.',
+                              messages.WARNING)
+        return skipped
+    
+    @admin.action(description='Mark selected orders shipped')
+    def mark_shipped(self, request, queryset):
+        self._transition(request, queryset, 'shipped')
+    
+    @admin.action(description='Mark selected orders delivered')
+    def mark_delivered(self, request, queryset):
+        self._transition(request, queryset, 'delivered')
+    
+    @admin.action(description='Cancel selected unpaid orders')
+    def mark_cancelled(self, request, queryset):
+        skipped = self._transition(request, queryset, 'cancelled')
+        paid = sum(1 for _, payment_status in skipped.values() if payment_status in UNCANCELLABLE_PAYMENT)
+        if paid:
+            self.message_user(request, f'{paid} of them are paid; refund those instead.', messages.WARNING)
+    
+    @admin.action(description='Mark selected orders refunded')
+    def mark_refunded(self, request, queryset):
+        self._transition(request, queryset, 'refunded', payment_status='refunded')
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
-    list_display = ['order', 'amount', 'method', 'status', 'created_at']
+    list_display = ['order', 'amount', 'method', 'status', 'attempts', 'created_at']
     list_filter = ['method', 'status', 'created_at']
-    search_fields = ['order__order_id', 'transaction_id']
+    search_fields = ['order__order_id', 'transaction_id', 'idempotency_key']
 
 @admin.register(Shipping)
 class ShippingAdmin(admin.ModelAdmin):
     list_display = ['order', 'tracking_number', 'carrier', 'estimated_delivery']
     list_filter = ['carrier', 'estimated_delivery']
-    search_fields = ['order__order_id', 'tracking_number']
\ No newline at end of file
+    search_fields = ['order__order_id', 'tracking_number']
+
+class StockReservationLineInline(admin.TabularInline):
+    model = StockReservationLine
+    extra = 0
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['reservation_id', 'user', 'order', 'status', 'expires_at', 'created_at']
+    list_filter = ['status', 'expires_at']
+    search_fields = ['reservation_id', 'order__order_id', 'user__username']
+    readonly_fields = ['reservation_id', 'created_at', 'updated_at']
+    inlines = [StockReservationLineInline]
@@ -0,0 +1,185 @@
+import queue
+import random
+import threading
+import time
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, transaction
+from django.db.models import Sum
+
+from products.facets import rebuild_facet_counts
+from products.models import Category, Product
+from . import inventory
+from .models import OrderItem, StockReservation, StockReservationLine, StockShard
+
+PREFIX = 'bench-checkout'
+
+
+class ContentionBenchmark:
+    """Many buyers competing for a few products, to measure checkout under contention
+
+    ``setup`` creates throwaway users and a small catalog with limited
+    stock; ``run`` replays seeded random carts from ``threads`` workers,
+    each with its own database connection, against an ``attempt(user_id,
+    quantities)`` callable and records outcomes and latencies. ``verify``
+    checks that every sold unit is backed by stock (no oversells) and that
+    ``sales_count`` matches what was sold, ``verify_inventory`` does the same
+    for stock holds; ``cleanup`` removes everything.
+    """
+
+    def __init__(self, users=40, products=10, stock=50, lines=3, max_quantity=3, seed=1, prefix=PREFIX):
+        self.users = users
+        self.products = products
+        self.stock = stock
+        self.lines = lines
+        self.max_quantity = max_quantity
+        self.seed = seed
+        self.prefix = prefix
+        self.user_ids = []
+        self.product_ids = []
+
+    def setup(self):
+        self.cleanup()
+        with transaction.atomic():
+            category = Category.objects.create(name='Checkout benchmark', slug=self.prefix)
+            User.objects.bulk_create([
+                User(username=f'{self.prefix}_{i}', password='!') for i in range(self.users)
+            ])
+            # bulk_create skips post_save, so the facet cube is rebuilt in cleanup().
+            Product.objects.bulk_create([
+                Product(name=f'Benchmark product {i}', sku=f'{self.prefix.upper()}-{i}', category=category,
+                        price=100 + i, stock=self.stock)
+                for i in range(self.products)
+            ])
+        self.user_ids = list(User.objects.filter(username__startswith=f'{self.prefix}_')
+                             .order_by('pk').values_list('pk', flat=True))
+        self.product_ids = list(Product.objects.filter(sku__startswith=f'{self.prefix.upper()}-')
+                                .order_by('pk').values_list('pk', flat=True))
+
+    def carts(self, attempts):
+        """``attempts`` seeded ``(user_id, {product_id: quantity})`` jobs"""
+        rng = random.Random(self.seed)
+        jobs = []
+        for _ in range(attempts):
+            chosen = rng.sample(self.product_ids, min(self.lines, len(self.product_ids)))
+            jobs.append((rng.choice(self.user_ids),
+                         {product_id: rng.randint(1, self.max_quantity) for product_id in chosen}))
+        return jobs
+
+    def run(self, attempt, attempts, threads=8, classify=None):
+        """Run ``attempts`` jobs on ``threads`` workers; returns a report dict
+
+        ``classify(exc)`` names an expected failure (e.g. ``'out_of_stock'``)
+        or returns ``None`` to count it as an error.
+        """
+        jobs = queue.Queue()
+        for job in self.carts(attempts):
+            jobs.put(job)
+        outcomes = Counter()
+        latencies = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        user_id, quantities = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    started = time.monotonic()
+                    try:
+                        attempt(user_id, quantities)
+                        outcome = 'ok'
+                    except OperationalError:
+                        outcome = 'db_error'
+                    except Exception as exc:
+                        outcome = (classify(exc) if classify else None) or 'error'
+                    with lock:
+                        outcomes[outcome] += 1
+                        latencies.append(time.monotonic() - started)
+            finally:
+                connection.close()
+
+        started = time.monotonic()
+        workers = [threading.Thread(target=worker, name=f'bench-{i}') for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        latencies.sort()
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+        return {
+            'attempts': attempts,
+            'threads': threads,
+            'outcomes': dict(outcomes),
+            'elapsed': elapsed,
+            'per_sec': attempts / elapsed if elapsed > 0 else 0.0,
+            'ok_per_sec': outcomes['ok'] / elapsed if elapsed > 0 else 0.0,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+        }
+
+    def verify(self):
+        """``{'sold', 'oversold', 'mismatched'}`` for the benchmark products"""
+        sold = dict(OrderItem.objects.filter(product_id__in=self.product_ids, order__reservation__status='confirmed')
+                    .values_list('product_id').annotate(units=Sum('quantity')))
+        oversold = mismatched = 0
+        for product_id, stock, sales_count in (Product.objects.filter(pk__in=self.product_ids)
+                                               .values_list('pk', 'stock', 'sales_count')):
+            units = sold.get(product_id, 0)
+            if stock < 0 or units > self.stock:
+                oversold += 1
+            if self.stock - stock != units or sales_count != units:
+                mismatched += 1
+        return {'sold': sum(sold.values()), 'oversold': oversold, 'mismatched': mismatched}
+
+    def verify_inventory(self, release=True):
+        """``{'held', 'sold', 'oversold', 'mismatched'}`` for stock holds on the benchmark products
+
+        A product is oversold if more units are held or sold than it ever
+        had, or a shard went negative; mismatched if shards plus live holds
+        do not add up to ``Product.stock``. With ``release`` every live hold
+        is then given back and the shards must return to the full stock.
+        """
+        def units(status):
+            return dict(StockReservationLine.objects.filter(product_id__in=self.product_ids, reservation__status=status)
+                        .values_list('product_id').annotate(units=Sum('quantity')).order_by())
+
+        held, sold = units(inventory.HELD), units(inventory.CONFIRMED)
+        oversold, mismatched = set(), set()
+        negative = set(StockShard.objects.filter(product_id__in=self.product_ids, available__lt=0)
+                       .values_list('product_id', flat=True))
+        shards = inventory.available(self.product_ids)
+        stocks = dict(Product.objects.filter(pk__in=self.product_ids).values_list('pk', 'stock'))
+        for product_id, stock in stocks.items():
+            if product_id in negative or held.get(product_id, 0) + sold.get(product_id, 0) > self.stock:
+                oversold.add(product_id)
+            if (shards.get(product_id, 0) + held.get(product_id, 0) != stock
+                    or self.stock - stock != sold.get(product_id, 0)):
+                mismatched.add(product_id)
+        if release:
+            for reservation in StockReservation.objects.filter(
+                    status=inventory.HELD, lines__product_id__in=self.product_ids).distinct():
+                inventory.release(reservation)
+            shards = inventory.available(self.product_ids)
+            mismatched.update(pk for pk, stock in stocks.items() if shards.get(pk, 0) != stock)
+        return {
+            'held': sum(held.values()), 'sold': sum(sold.values()),
+            'oversold': len(oversold), 'mismatched': len(mismatched),
+        }
+
+    def cleanup(self):
+        with transaction.atomic():
+            StockReservation.objects.filter(user__username__startswith=f'{self.prefix}_').delete()
+            # Orders (and their items) go with the users.
+            User.objects.filter(username__startswith=f'{self.prefix}_').delete()
+            Product.objects.filter(sku__startswith=f'{self.prefix.upper()}-').delete()
+            Category.objects.filter(slug=self.prefix).delete()
+        rebuild_facet_counts()
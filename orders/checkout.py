@@ -0,0 +1,59 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from products.carts import unit_price_expression
+from products.models import Product
+from . import inventory, risk
+from .history import product_thumbnail
+from .inventory import CheckoutError, OutOfStock, ReservationExpired  # noqa: F401 (re-exported)
+from .models import Order, OrderItem, StockReservation
+
+
+def place_order(user, quantities, shipping_address, billing_address='', phone_number='', hold_seconds=None):
+    """Turn ``{product_id: quantity}`` into a pending ``Order`` backed by a stock hold
+
+    One transaction prices the lines from the current product rows, places
+    a time-limited hold on the stock (``orders.inventory.hold``, which
+    raises ``OutOfStock`` and rolls everything back if any product is
+    short), creates the order with its risk score (``orders.risk``) and
+    bulk-inserts its items. Stock and ``sales_count`` only change when
+    payment confirms the hold; if it is never paid the sweeper releases
+    the units and cancels the order.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        raise CheckoutError('The cart is empty')
+
+    with transaction.atomic():
+        products = list(
+            Product.objects.filter(pk__in=quantities, is_active=True)
+            .annotate(unit_price=unit_price_expression())
+            .order_by('pk')
+        )
+        if len(products) != len(quantities):
+            found = {product.pk for product in products}
+            raise OutOfStock({product_id: 0 for product_id in quantities if product_id not in found})
+        reservation = inventory.hold(user, quantities, hold_seconds)
+
+        subtotal = sum((product.unit_price * quantities[product.pk] for product in products), Decimal('0.00'))
+        billing_address = billing_address or shipping_address
+        order = Order.objects.create(
+            user=user,
+            shipping_address=shipping_address,
+            billing_address=billing_address,
+            phone_number=phone_number,
+            subtotal=subtotal,
+            total=subtotal,
+            item_count=len(products),
+            thumbnail=product_thumbnail(products[0]),
+            risk_score=risk.score_new_order(user, subtotal, shipping_address, billing_address, timezone.now()),
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=quantities[product.pk],
+                      price=product.unit_price, total=product.unit_price * quantities[product.pk])
+            for product in products
+        ])
+        StockReservation.objects.filter(pk=reservation.pk).update(order=order)
+    return order
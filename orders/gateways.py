@@ -0,0 +1,141 @@
+import abc
+import random
+import threading
+import time
+import uuid
+
+import stripe
+from django.conf import settings
+
+
+class GatewayError(Exception):
+    """A transient failure (timeout, rate limit, 5xx); the charge may be retried"""
+
+
+class PaymentDeclined(Exception):
+    """The gateway refused the charge for good; retrying will not help"""
+
+
+class PaymentGateway(abc.ABC):
+    """What the payment queue needs from a payment provider
+
+    ``charge`` must be idempotent on ``idempotency_key``: calling it again
+    with the same key returns the original charge instead of making a new
+    one, which is what makes retries safe. Both methods return the
+    gateway's transaction id and raise ``GatewayError`` or
+    ``PaymentDeclined``.
+    """
+
+    name = ''
+
+    @abc.abstractmethod
+    def charge(self, amount, currency, idempotency_key, metadata=None):
+        """Charge ``amount`` and return the transaction id"""
+
+    @abc.abstractmethod
+    def refund(self, transaction_id, idempotency_key):
+        """Refund a charge in full and return the refund id"""
+
+
+class StripeGateway(PaymentGateway):
+    name = 'stripe'
+
+    def __init__(self, api_key=None, timeout=None):
+        self.api_key = api_key or settings.STRIPE_SECRET_KEY
+        self.timeout = timeout
+
+    def _call(self, method, **kwargs):
+        try:
+            return method(api_key=self.api_key, **kwargs)
+        except (stripe.error.APIConnectionError, stripe.error.RateLimitError, stripe.error.APIError) as exc:
+            raise GatewayError(str(exc)) from exc
+        except stripe.error.CardError as exc:
+            raise PaymentDeclined(exc.user_message or str(exc)) from exc
+        except stripe.error.StripeError as exc:
+            # Bad keys or requests will fail the same way next time
+            raise PaymentDeclined(str(exc)) from exc
+
+    def charge(self, amount, currency, idempotency_key, metadata=None):
+        intent = self._call(
+            stripe.PaymentIntent.create,
+            amount=int(amount * 100),  # Convert to cents
+            currency=currency,
+            metadata=metadata or {},
+            idempotency_key=idempotency_key,
+        )
+        return intent.id
+
+    def refund(self, transaction_id, idempotency_key):
+        return self._call(stripe.Refund.create, payment_intent=transaction_id,
+                          idempotency_key=idempotency_key).id
+
+
+class StubGateway(PaymentGateway):
+    """In-process stand-in for tests and load runs; never talks to the network
+
+    Each call sleeps ``latency`` seconds, then fails transiently with
+    probability ``failure_rate``. Amounts in ``decline_amounts`` are always
+    declined. Charges are remembered by idempotency key like a real
+    gateway would, and ``charges`` counts real (non-replayed) charges.
+    """
+
+    name = 'stub'
+
+    def __init__(self, latency=0.0, failure_rate=0.0, decline_amounts=(), seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.decline_amounts = set(decline_amounts)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._results = {}
+        self.charges = 0
+        self.refunds = 0
+
+    def _call(self, idempotency_key, succeed):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._lock:
+            if idempotency_key in self._results:
+                return self._results[idempotency_key]
+            if self._random.random() < self.failure_rate:
+                raise GatewayError('Stub gateway timed out')
+            self._results[idempotency_key] = result = succeed()
+            return result
+
+    def charge(self, amount, currency, idempotency_key, metadata=None):
+        if amount in self.decline_amounts:
+            raise PaymentDeclined('Your card was declined.')
+
+        def succeed():
+            self.charges += 1
+            return f'stub_pi_{uuid.uuid4().hex[:16]}'
+        return self._call(idempotency_key, succeed)
+
+    def refund(self, transaction_id, idempotency_key):
+        def succeed():
+            self.refunds += 1
+            return f'stub_re_{uuid.uuid4().hex[:16]}'
+        return self._call(idempotency_key, succeed)
+
+
+GATEWAYS = {gateway.name: gateway for gateway in (StripeGateway, StubGateway)}
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Return the process-wide gateway picked by ``PAYMENT_GATEWAY``"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                name = getattr(settings, 'PAYMENT_GATEWAY', 'stripe')
+                if name == 'stub':
+                    _gateway = StubGateway(
+                        latency=getattr(settings, 'PAYMENT_STUB_LATENCY', 0.0),
+                        failure_rate=getattr(settings, 'PAYMENT_STUB_FAILURE_RATE', 0.0),
+                    )
+                else:
+                    _gateway = GATEWAYS[name]()
+    return _gateway
@@ -0,0 +1,40 @@
+from django.db.models import Prefetch
+
+from products import listing
+from .models import Order, OrderItem
+
+PAGE_SIZE = 10
+
+
+def product_thumbnail(product):
+    """The image an order shows in the history list: external URL first, then the upload"""
+    if product.image_url:
+        return product.image_url
+    return product.image.url if product.image else ''
+
+
+def refresh_item_summary(order):
+    """Recompute ``item_count``/``thumbnail`` after an order's lines were edited"""
+    items = list(order.items.select_related('product').order_by('pk'))
+    order.item_count = len(items)
+    order.thumbnail = product_thumbnail(items[0].product) if items else ''
+    Order.objects.filter(pk=order.pk).update(item_count=order.item_count, thumbnail=order.thumbnail)
+
+
+def items_prefetch():
+    """``order.items`` with their products, in one extra query"""
+    return Prefetch(
+        'items',
+        queryset=OrderItem.objects.select_related('product').order_by('pk'),
+    )
+
+
+def order_page(user, cursor=None, page_size=PAGE_SIZE):
+    """``(orders, next_cursor)`` for a user's order history, newest first
+
+    Pages seek on ``(created_at, id)`` through the ``(user, created_at)``
+    index, so the hundredth page costs the same as the first. The list
+    renders ``item_count`` and ``thumbnail``, so the items are not loaded.
+    """
+    queryset = Order.objects.filter(user=user)
+    return listing.seek(queryset, 'created_at', descending=True, cursor=cursor, page_size=page_size)
@@ -0,0 +1,311 @@
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from products import facets
+from products.models import Product
+from . import lifecycle
+from .models import Order, StockReservation, StockReservationLine, StockShard
+
+HELD, CONFIRMED, RELEASED, EXPIRED = 'held', 'confirmed', 'released', 'expired'
+# Extra time a hold gets once payment starts, so it cannot lapse mid-charge
+PAYMENT_GRACE = timedelta(minutes=2)
+
+
+class CheckoutError(Exception):
+    """The order could not be placed; nothing was written"""
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, shortages):
+        # {product_id: units still available}
+        self.shortages = shortages
+        super().__init__(f'Not enough stock for products {sorted(shortages)}')
+
+
+class ReservationExpired(CheckoutError):
+    """The stock hold behind an order lapsed before it was paid"""
+
+
+def hold_duration(seconds=None):
+    if seconds is None:
+        seconds = getattr(settings, 'INVENTORY_HOLD_SECONDS', 900)
+    return timedelta(seconds=seconds)
+
+
+def held_quantities(product_ids):
+    """``{product_id: units}`` in live (held) reservations"""
+    return dict(
+        StockReservationLine.objects.filter(product_id__in=product_ids, reservation__status=HELD)
+        .values_list('product_id').annotate(units=Sum('quantity')).order_by()
+    )
+
+
+def ensure_shards(product_ids):
+    """Create a single shard for products that have none; returns ``{product_id: shard count}``
+
+    A new shard starts with the product's stock minus whatever is already
+    held, so shards can be created lazily at any time.
+    """
+    counts = dict(
+        StockShard.objects.filter(product_id__in=product_ids)
+        .values_list('product_id').annotate(shards=Count('pk')).order_by()
+    )
+    missing = [product_id for product_id in product_ids if product_id not in counts]
+    if missing:
+        held = held_quantities(missing)
+        StockShard.objects.bulk_create(
+            [StockShard(product_id=pk, shard=0, available=max(0, stock - held.get(pk, 0)))
+             for pk, stock in Product.objects.filter(pk__in=missing).values_list('pk', 'stock')],
+            ignore_conflicts=True,
+        )
+        counts.update(
+            StockShard.objects.filter(product_id__in=missing)
+            .values_list('product_id').annotate(shards=Count('pk')).order_by()
+        )
+    return counts
+
+
+def available(product_ids):
+    """``{product_id: units that can still be held}``"""
+    return dict(
+        StockShard.objects.filter(product_id__in=product_ids)
+        .values_list('product_id').annotate(units=Sum('available')).order_by()
+    )
+
+
+def _take(product_id, quantity, shard_count, retries=3):
+    """Take ``quantity`` units from a product's shards; returns ``[(shard, units)]`` or ``None``
+
+    The fast path is one guarded ``UPDATE`` on a randomly picked shard, so
+    concurrent holds on a hot product mostly touch different rows. Only
+    when that shard runs short are the others drained, fullest first.
+    """
+    start = random.randrange(shard_count)
+    if StockShard.objects.filter(product_id=product_id, shard=start, available__gte=quantity).update(
+            available=F('available') - quantity):
+        return [(start, quantity)]
+    taken, remaining = [], quantity
+    for _ in range(retries):
+        rows = list(StockShard.objects.filter(product_id=product_id, available__gt=0)
+                    .order_by('-available').values_list('shard', 'available'))
+        if sum(units for _, units in rows) < remaining:
+            break
+        for shard, units in rows:
+            units = min(units, remaining)
+            if StockShard.objects.filter(product_id=product_id, shard=shard, available__gte=units).update(
+                    available=F('available') - units):
+                taken.append((shard, units))
+                remaining -= units
+                if not remaining:
+                    return taken
+    # Not enough: hand back what was taken so the shortage report is exact.
+    for shard, units in taken:
+        StockShard.objects.filter(product_id=product_id, shard=shard).update(available=F('available') + units)
+    return None
+
+
+def hold(user, quantities, seconds=None):
+    """Reserve ``{product_id: quantity}`` for a while; returns the ``StockReservation``
+
+    All or nothing: if any product is short the transaction rolls back and
+    ``OutOfStock`` says what is left. Before giving up, holds on those
+    products that have already expired are released and the hold is tried
+    once more, so a lagging sweeper never blocks a sale.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    product_ids = sorted(quantities)
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                counts = ensure_shards(product_ids)
+                lines, shortages = [], {}
+                for product_id in product_ids:  # a fixed order, so holds never deadlock
+                    taken = _take(product_id, quantities[product_id], counts[product_id]) \
+                        if product_id in counts else None
+                    if taken is None:
+                        shortages[product_id] = 0
+                    else:
+                        lines.extend(StockReservationLine(product_id=product_id, shard=shard, quantity=units)
+                                     for shard, units in taken)
+                if shortages:
+                    left = available(shortages)
+                    raise OutOfStock({pk: left.get(pk, 0) for pk in shortages})
+                reservation = StockReservation.objects.create(
+                    user=user, expires_at=timezone.now() + hold_duration(seconds),
+                )
+                for line in lines:
+                    line.reservation = reservation
+                StockReservationLine.objects.bulk_create(lines)
+                return reservation
+        except OutOfStock as exc:
+            if attempt or not release_expired(product_ids=list(exc.shortages)):
+                raise
+
+
+def _restore(reservation_ids):
+    """Put the units of these reservations back into the shards they came from"""
+    rows = (StockReservationLine.objects.filter(reservation_id__in=reservation_ids)
+            .values_list('product_id', 'shard').annotate(units=Sum('quantity')).order_by('product_id', 'shard'))
+    for product_id, shard, units in rows:
+        if not StockShard.objects.filter(product_id=product_id, shard=shard).update(available=F('available') + units):
+            # The shard was dropped by reshard(); any other shard will do.
+            StockShard.objects.filter(product_id=product_id, shard=0).update(available=F('available') + units)
+
+
+def release(reservation, status=RELEASED):
+    """Give a held reservation's stock back; returns False if it was no longer held"""
+    with transaction.atomic():
+        if not StockReservation.objects.filter(pk=reservation.pk, status=HELD).update(
+                status=status, updated_at=timezone.now()):
+            return False
+        _restore([reservation.pk])
+    reservation.status = status
+    return True
+
+
+def release_orders(order_ids, status=RELEASED):
+    """Give back the stock still held for these orders, e.g. when they are cancelled"""
+    with transaction.atomic():
+        ids = list(StockReservation.objects.select_for_update().filter(order_id__in=order_ids, status=HELD)
+                   .values_list('pk', flat=True))
+        if ids:
+            StockReservation.objects.filter(pk__in=ids).update(status=status, updated_at=timezone.now())
+            _restore(ids)
+    return len(ids)
+
+
+def release_expired(now=None, product_ids=None, batch_size=500):
+    """The sweeper: expire overdue holds, return their stock and cancel their unpaid orders
+
+    Reservations are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED``
+    where the database supports it, so several sweepers (and a concurrent
+    ``confirm``) never process the same hold twice. Returns how many holds
+    were released.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            overdue = StockReservation.objects.filter(status=HELD, expires_at__lte=now)
+            if product_ids is not None:
+                overdue = overdue.filter(pk__in=StockReservationLine.objects.filter(
+                    product_id__in=product_ids).values('reservation_id'))
+            ids = list(overdue.select_for_update(skip_locked=True).order_by('expires_at')
+                       .values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return released
+            StockReservation.objects.filter(pk__in=ids).update(status=EXPIRED, updated_at=now)
+            _restore(ids)
+            lifecycle.bulk_transition(
+                Order.objects.filter(reservation__pk__in=ids, status='pending').exclude(payment_status='paid'),
+                'cancelled', comment='Stock reservation expired',
+            )
+        released += len(ids)
+        if len(ids) < batch_size:
+            return released
+
+
+def _take_stock(quantities, now):
+    """Guarded ``stock - q`` / ``sales_count + q`` for sold units; raises OutOfStock"""
+    products = list(Product.objects.filter(pk__in=quantities).order_by('pk'))
+    by_quantity = {}
+    for product in products:
+        by_quantity.setdefault(quantities[product.pk], []).append(product.pk)
+    for quantity, product_ids in by_quantity.items():
+        taken = Product.objects.filter(pk__in=product_ids, stock__gte=quantity).update(
+            stock=F('stock') - quantity,
+            sales_count=F('sales_count') + quantity,
+            updated_at=now,
+        )
+        if taken != len(product_ids):
+            # Stock was lowered under a live hold (e.g. by hand without a resync).
+            left = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'stock'))
+            raise OutOfStock({pk: stock for pk, stock in left.items() if stock < quantity})
+    # Queryset updates skip post_save; move products that just sold out to
+    # their new facet cell by hand.
+    for product in products:
+        if product.stock == quantities[product.pk]:
+            product.stock = 0
+            facets.record_product_change(product, created=False)
+
+
+def confirm(reservation):
+    """Turn a live hold into a sale: stock goes down and sales_count up for good"""
+    now = timezone.now()
+    with transaction.atomic():
+        if not StockReservation.objects.filter(pk=reservation.pk, status=HELD).update(
+                status=CONFIRMED, updated_at=now):
+            raise ReservationExpired('This reservation is no longer held')
+        quantities = dict(reservation.lines.values_list('product_id').annotate(units=Sum('quantity')).order_by())
+        _take_stock(quantities, now)
+    reservation.status = CONFIRMED
+    return reservation
+
+
+def ensure_order_held(order):
+    """Return a live hold for an unpaid order, extended to cover the payment
+
+    Orders placed before reservations existed get a hold now. An order
+    whose hold has lapsed is cancelled and ``ReservationExpired`` raised;
+    the customer has to check out again.
+    """
+    if order.status != 'pending' or order.payment_status == 'paid':
+        raise CheckoutError('This order is no longer awaiting payment.')
+    reservation = StockReservation.objects.filter(order=order).first()
+    if reservation is None:
+        quantities = dict(order.items.values_list('product_id').annotate(units=Sum('quantity')).order_by())
+        with transaction.atomic():
+            reservation = hold(order.user, quantities)
+            StockReservation.objects.filter(pk=reservation.pk).update(order=order)
+        return reservation
+    if reservation.status == CONFIRMED:
+        return reservation
+    now = timezone.now()
+    if reservation.status == HELD and reservation.expires_at > now:
+        reservation.expires_at = max(reservation.expires_at, now + PAYMENT_GRACE)
+        StockReservation.objects.filter(pk=reservation.pk, status=HELD).update(
+            expires_at=reservation.expires_at, updated_at=now,
+        )
+        return reservation
+    if reservation.status == HELD:
+        release(reservation, status=EXPIRED)
+    lifecycle.bulk_transition([order.pk], 'cancelled', comment='Stock reservation expired')
+    raise ReservationExpired('Your reservation expired before payment; please check out again.')
+
+
+def reshard(product_ids, shards):
+    """Spread each product's unheld stock evenly over ``shards`` counter rows
+
+    Also the way to resync shards after stock changed outside checkout:
+    the total is recomputed from ``Product.stock`` minus live holds.
+    """
+    for product_id in product_ids:
+        with transaction.atomic():
+            list(StockShard.objects.select_for_update().filter(product_id=product_id))
+            stock = Product.objects.filter(pk=product_id).values_list('stock', flat=True).first()
+            if stock is None:
+                continue
+            count = shards or max(1, StockShard.objects.filter(product_id=product_id).count())
+            total = max(0, stock - held_quantities([product_id]).get(product_id, 0))
+            StockShard.objects.filter(product_id=product_id, shard__gte=count).delete()
+            base, extra = divmod(total, count)
+            StockShard.objects.bulk_create(
+                [StockShard(product_id=product_id, shard=shard, available=base + (shard < extra))
+                 for shard in range(count)],
+                update_conflicts=True,
+                unique_fields=['product', 'shard'],
+                update_fields=['available'],
+            )
+
+
+def resync(product_ids):
+    """Recompute existing shards after ``Product.stock`` was changed directly"""
+    sharded = list(StockShard.objects.filter(product_id__in=product_ids)
+                   .values_list('product_id', flat=True).distinct())
+    reshard(sharded, shards=None)
+    return len(sharded)
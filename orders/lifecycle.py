@@ -0,0 +1,131 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderHistory
+
+# Allowed moves of Order.status and Order.payment_status. Anything not
+# listed (including staying put) is refused.
+TRANSITIONS = {
+    'pending': ('processing', 'cancelled'),
+    'processing': ('shipped', 'cancelled', 'refunded'),
+    'shipped': ('delivered', 'refunded'),
+    'delivered': ('refunded',),
+    'cancelled': (),
+    'refunded': (),
+}
+PAYMENT_TRANSITIONS = {
+    'pending': ('paid', 'failed'),
+    'failed': ('pending', 'paid'),
+    'paid': ('refunded',),
+    'refunded': (),
+}
+# A paid order has had its stock taken for good and money collected, which
+# cancelling would give back neither of; it has to be refunded instead.
+UNCANCELLABLE_PAYMENT = ('paid',)
+# Timestamp columns stamped in the same UPDATE as the status they belong to
+TIMESTAMPS = {'shipped': 'shipped_at', 'delivered': 'delivered_at'}
+PAYMENT_TIMESTAMPS = {'paid': 'paid_at'}
+
+
+class InvalidTransition(Exception):
+    def __init__(self, order, status=None, payment_status=None):
+        self.order = order
+        parts = []
+        if status:
+            parts.append(f'status {order.status!r} -> {status!r}')
+        if payment_status:
+            parts.append(f'payment {order.payment_status!r} -> {payment_status!r}')
+        super().__init__(f'Order {order.order_id} cannot move: {", ".join(parts)}')
+
+
+def can_transition(current, target, transitions=TRANSITIONS):
+    return target is None or target in transitions.get(current, ())
+
+
+def _sources(target, transitions):
+    return [current for current, targets in transitions.items() if target in targets]
+
+
+def bulk_transition(orders, status=None, payment_status=None, comment='', user=None, batch_size=1000, **fields):
+    """Move many orders at once; returns ``(moved_ids, skipped)``
+
+    ``orders`` is a queryset, or a list of orders or primary keys. Orders
+    whose current state does not allow the move are left alone and come
+    back in ``skipped`` as ``{pk: (status, payment_status)}``. Each batch
+    is one transaction: a locking read of the current states, a single
+    ``UPDATE`` that sets the new status, its timestamp and ``fields`` for
+    every valid order, and one ``bulk_create`` of ``OrderHistory`` rows.
+    Cancelling also gives back any stock still held for the orders, and
+    skips paid orders, which must be refunded instead.
+    """
+    if status is None and payment_status is None:
+        raise ValueError('Nothing to transition to')
+    if status is not None and status not in TRANSITIONS:
+        raise ValueError(f'Unknown order status {status!r}')
+    if payment_status is not None and payment_status not in PAYMENT_TRANSITIONS:
+        raise ValueError(f'Unknown payment status {payment_status!r}')
+
+    if hasattr(orders, 'values_list'):
+        order_ids = list(orders.order_by('pk').values_list('pk', flat=True))
+    else:
+        order_ids = sorted(getattr(order, 'pk', order) for order in orders)
+
+    guard = {}
+    if status is not None:
+        guard['status__in'] = _sources(status, TRANSITIONS)
+    if payment_status is not None:
+        guard['payment_status__in'] = _sources(payment_status, PAYMENT_TRANSITIONS)
+    if not comment:
+        comment = f'Payment {payment_status}' if payment_status else ''
+
+    moved, skipped = [], {}
+    for start in range(0, len(order_ids), batch_size):
+        chunk = order_ids[start:start + batch_size]
+        with transaction.atomic():
+            now = timezone.now()
+            valid = []
+            for pk, current, current_payment in (Order.objects.select_for_update().filter(pk__in=chunk)
+                                                 .order_by('pk').values_list('pk', 'status', 'payment_status')):
+                if (can_transition(current, status)
+                        and can_transition(current_payment, payment_status, PAYMENT_TRANSITIONS)
+                        and not (status == 'cancelled' and current_payment in UNCANCELLABLE_PAYMENT)):
+                    valid.append((pk, current))
+                else:
+                    skipped[pk] = (current, current_payment)
+            if not valid:
+                continue
+            values = dict(fields, updated_at=now)
+            if status is not None:
+                values['status'] = status
+                if status in TIMESTAMPS:
+                    values[TIMESTAMPS[status]] = now
+            if payment_status is not None:
+                values['payment_status'] = payment_status
+                if payment_status in PAYMENT_TIMESTAMPS:
+                    values[PAYMENT_TIMESTAMPS[payment_status]] = now
+            valid_ids = [pk for pk, _ in valid]
+            Order.objects.filter(pk__in=valid_ids, **guard).update(**values)
+            OrderHistory.objects.bulk_create([
+                OrderHistory(order_id=pk, status=status or current, comment=comment, created_by=user)
+                for pk, current in valid
+            ], batch_size=batch_size)
+            if status == 'cancelled':
+                from .inventory import release_orders
+                release_orders(valid_ids)
+            moved.extend(valid_ids)
+    return moved, skipped
+
+
+def transition(order, status=None, payment_status=None, comment='', user=None, **fields):
+    """Move one order; raises ``InvalidTransition`` if its state does not allow it
+
+    The instance is updated in place and returned.
+    """
+    moved, skipped = bulk_transition([order.pk], status, payment_status, comment, user, **fields)
+    if not moved:
+        if order.pk in skipped:
+            order.status, order.payment_status = skipped[order.pk]
+        raise InvalidTransition(order, status, payment_status)
+    order.refresh_from_db(fields=['status', 'payment_status', 'updated_at', 'paid_at', 'shipped_at',
+                                  'delivered_at', *fields])
+    return order
@@ -0,0 +1,61 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from orders.benchmark import ContentionBenchmark
+from orders import inventory
+from orders.checkout import OutOfStock, place_order
+
+class Command(BaseCommand):
+    help = 'Measure checkout throughput with many concurrent buyers competing for limited stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=400, help='Checkouts to attempt in total')
+        parser.add_argument('--users', type=int, default=40)
+        parser.add_argument('--products', type=int, default=10, help='Fewer products means more contention')
+        parser.add_argument('--stock', type=int, default=100, help='Starting stock per product')
+        parser.add_argument('--lines', type=int, default=3, help='Products per cart')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', help='Leave the benchmark users, products and orders in place')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['attempts'] < 1:
+            raise CommandError('--threads and --attempts must be at least 1')
+        bench = ContentionBenchmark(
+            users=options['users'], products=options['products'], stock=options['stock'],
+            lines=options['lines'], seed=options['seed'],
+        )
+        self.stdout.write('Creating benchmark users and products...')
+        bench.setup()
+        users = {user.pk: user for user in User.objects.filter(pk__in=bench.user_ids)}
+
+        def attempt(user_id, quantities):
+            # Place the order (stock hold) and pay for it straight away.
+            order = place_order(users[user_id], quantities, shipping_address='Benchmark', phone_number='0')
+            inventory.confirm(order.reservation)
+
+        try:
+            self.stdout.write(
+                f'Running {options["attempts"]} checkouts on {options["threads"]} threads '
+                f'against {options["products"]} products...'
+            )
+            report = bench.run(
+                attempt, options['attempts'], threads=options['threads'],
+                classify=lambda exc: 'out_of_stock' if isinstance(exc, OutOfStock) else None,
+            )
+            check = bench.verify()
+        finally:
+            if not options['keep']:
+                bench.cleanup()
+
+        self.stdout.write(f'Outcomes: {report["outcomes"]}')
+        self.stdout.write(
+            f'{report["per_sec"]:,.1f} checkouts/sec ({report["ok_per_sec"]:,.1f} orders/sec), '
+            f'latency p50 {report["p50_ms"]:.1f}ms, p95 {report["p95_ms"]:.1f}ms, p99 {report["p99_ms"]:.1f}ms'
+        )
+        self.stdout.write(
+            f'Units sold: {check["sold"]}, oversold products: {check["oversold"]}, '
+            f'stock/sales_count mismatches: {check["mismatched"]}'
+        )
+        if check['oversold'] or check['mismatched']:
+            raise CommandError('Stock accounting is inconsistent')
+        self.stdout.write(self.style.SUCCESS('Successfully benchmarked checkout!'))
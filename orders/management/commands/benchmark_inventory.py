@@ -0,0 +1,67 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from orders import inventory
+from orders.benchmark import ContentionBenchmark
+
+class Command(BaseCommand):
+    help = 'Measure stock holds per second on a few hot products, with and without sharded counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=1000, help='Holds to attempt in total')
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--products', type=int, default=1, help='Hot products every buyer competes for')
+        parser.add_argument('--stock', type=int, default=1000, help='Starting stock per product')
+        parser.add_argument('--lines', type=int, default=1, help='Products per hold')
+        parser.add_argument('--shards', type=int, default=8, help='Stock counters per product (1 = unsharded)')
+        parser.add_argument('--abandon', type=float, default=0.2,
+                            help='Fraction of holds released again straight away, like abandoned checkouts')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', help='Leave the benchmark users, products and holds in place')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['attempts'] < 1 or options['shards'] < 1:
+            raise CommandError('--threads, --attempts and --shards must be at least 1')
+        bench = ContentionBenchmark(
+            users=options['users'], products=options['products'], stock=options['stock'],
+            lines=options['lines'], seed=options['seed'], prefix='bench-inventory',
+        )
+        self.stdout.write('Creating benchmark users and products...')
+        bench.setup()
+        inventory.reshard(bench.product_ids, options['shards'])
+        users = {user.pk: user for user in User.objects.filter(pk__in=bench.user_ids)}
+        rng = random.Random(options['seed'])
+
+        def attempt(user_id, quantities):
+            reservation = inventory.hold(users[user_id], quantities)
+            if rng.random() < options['abandon']:
+                inventory.release(reservation)
+
+        try:
+            self.stdout.write(
+                f'Running {options["attempts"]} holds on {options["threads"]} threads against '
+                f'{options["products"]} products with {options["shards"]} shards each...'
+            )
+            report = bench.run(
+                attempt, options['attempts'], threads=options['threads'],
+                classify=lambda exc: 'out_of_stock' if isinstance(exc, inventory.OutOfStock) else None,
+            )
+            check = bench.verify_inventory()
+        finally:
+            if not options['keep']:
+                bench.cleanup()
+
+        self.stdout.write(f'Outcomes: {report["outcomes"]}')
+        self.stdout.write(
+            f'{report["per_sec"]:,.1f} attempts/sec ({report["ok_per_sec"]:,.1f} holds/sec), '
+            f'latency p50 {report["p50_ms"]:.1f}ms, p95 {report["p95_ms"]:.1f}ms, p99 {report["p99_ms"]:.1f}ms'
+        )
+        self.stdout.write(
+            f'Units held: {check["held"]}, oversold products: {check["oversold"]}, '
+            f'shard/stock mismatches: {check["mismatched"]}'
+        )
+        if check['oversold'] or check['mismatched']:
+            raise CommandError('Stock accounting is inconsistent')
+        self.stdout.write(self.style.SUCCESS('Successfully benchmarked stock holds!'))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from orders.payments import get_payment_queue
+
+class Command(BaseCommand):
+    help = 'Run queued and retrying payments left in the database (e.g. after a restart)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep processing every N seconds instead of running once')
+
+    def handle(self, *args, **options):
+        queue = get_payment_queue()
+        interval = options['interval']
+        while True:
+            processed = queue.drain()
+            if interval <= 0:
+                break
+            if processed:
+                self.stdout.write(f'Processed {processed} payments')
+            time.sleep(interval)
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully processed {processed} payments!')
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from orders.inventory import reshard, resync
+from orders.models import StockShard
+from products.models import Product
+
+class Command(BaseCommand):
+    help = 'Split the reservable stock of hot products over several counter rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, default=8, help='Counter rows per product (1 merges them back)')
+        parser.add_argument('--sku', action='append', default=[], help='Product SKU to shard (repeatable)')
+        parser.add_argument('--top', type=int, default=0, help='Shard the K best-selling products')
+        parser.add_argument('--resync', action='store_true',
+                            help='Only recompute existing shards from Product.stock')
+
+    def handle(self, *args, **options):
+        if options['resync']:
+            count = resync(list(StockShard.objects.values_list('product_id', flat=True).distinct()))
+            self.stdout.write(self.style.SUCCESS(f'Successfully resynced {count} sharded products!'))
+            return
+        if options['shards'] < 1:
+            raise CommandError('--shards must be at least 1')
+        product_ids = list(Product.objects.filter(sku__in=options['sku']).values_list('pk', flat=True))
+        if options['top']:
+            product_ids += Product.objects.filter(is_active=True).order_by('-sales_count') \
+                .values_list('pk', flat=True)[:options['top']]
+        product_ids = sorted(set(product_ids))
+        if not product_ids:
+            raise CommandError('Nothing to shard; pass --sku or --top')
+        self.stdout.write(f'Sharding {len(product_ids)} products into {options["shards"]} counters...')
+        reshard(product_ids, options['shards'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully sharded {len(product_ids)} products!')
+        )
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from orders.inventory import release_expired
+
+class Command(BaseCommand):
+    help = 'Release expired stock holds and cancel the unpaid orders behind them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep sweeping every N seconds instead of running once')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            released = release_expired(batch_size=options['batch_size'])
+            if interval <= 0:
+                break
+            if released:
+                self.stdout.write(f'Released {released} expired holds')
+            time.sleep(interval)
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully released {released} expired holds!')
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from orders.lifecycle import PAYMENT_TRANSITIONS, TRANSITIONS, bulk_transition
+from orders.models import Order
+
+class Command(BaseCommand):
+    help = 'Move many orders to a new status at once (e.g. mark a day of shipments shipped)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', choices=sorted(TRANSITIONS), help='New order status')
+        parser.add_argument('--payment', choices=sorted(PAYMENT_TRANSITIONS), help='New payment status')
+        parser.add_argument('--order-id', action='append', default=[], help='Order id to move (repeatable)')
+        parser.add_argument('--from-status', help='Move every order currently in this status')
+        parser.add_argument('--comment', default='')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not options['to'] and not options['payment']:
+            raise CommandError('Pass --to and/or --payment')
+        orders = Order.objects.all()
+        if options['order_id']:
+            orders = orders.filter(order_id__in=options['order_id'])
+        elif options['from_status']:
+            orders = orders.filter(status=options['from_status'])
+        else:
+            raise CommandError('Pass --order-id or --from-status')
+        moved, skipped = bulk_transition(
+            orders, options['to'], options['payment'],
+            comment=options['comment'], batch_size=options['batch_size'],
+        )
+        if skipped:
+            self.stdout.write(f'Skipped {len(skipped)} orders whose status does not allow the move')
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully moved {len(moved)} orders!')
+        )
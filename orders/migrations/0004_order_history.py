@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_item_summaries(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    order_ids = list(Order.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(order_ids), 1000):
+        chunk = order_ids[start:start + 1000]
+        summaries = {pk: [0, ''] for pk in chunk}
+        for order_id, image_url, image in (OrderItem.objects.filter(order_id__in=chunk).order_by('pk')
+                                           .values_list('order_id', 'product__image_url', 'product__image')):
+            summary = summaries[order_id]
+            if not summary[0]:
+                summary[1] = image_url or (settings.MEDIA_URL + image if image else '')
+            summary[0] += 1
+        Order.objects.bulk_update(
+            [Order(pk=pk, item_count=count, thumbnail=thumbnail) for pk, (count, thumbnail) in summaries.items()],
+            ['item_count', 'thumbnail'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_payment_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='thumbnail',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at'], name='orders_orde_user_id_37fed6_idx'),
+        ),
+        migrations.RunPython(fill_item_summaries, migrations.RunPython.noop),
+    ]
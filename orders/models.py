@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from products.models import Product
 import uuid
@@ -40,6 +42,11 @@ class Order(models.Model):
     payment_method = models.CharField(max_length=50, blank=True)
     payment_id = models.CharField(max_length=100, blank=True)
     
+    # Denormalized for the order history list: number of lines and the
+    # first product's image (an external URL or a MEDIA_URL path)
+    item_count = models.PositiveIntegerField(default=0)
+    thumbnail = models.CharField(max_length=500, blank=True)
+    
     # AI/ML related fields
     predicted_delivery_date = models.DateField(null=True, blank=True)
     risk_score = models.FloatField(default=0.0)
@@ -51,6 +58,12 @@ class Order(models.Model):
     shipped_at = models.DateTimeField(null=True, blank=True)
     delivered_at = models.DateTimeField(null=True, blank=True)
     
+    class Meta:
+        indexes = [
+            # Order history pages seek on (created_at, id) within one user.
+            models.Index(fields=['user', 'created_at']),
+        ]
+    
     def __str__(self):
         return f"Order {self.order_id} - {self.user.username}"
     
@@ -80,12 +93,36 @@ class Payment(models.Model):
         ('cash', 'Cash on Delivery'),
     ]
     
+    # Lifecycle of a queued charge (see orders.payments)
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('retrying', 'Retrying'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
     order = models.OneToOneField(Order, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     method = models.CharField(max_length=20, choices=PAYMENT_METHODS)
     transaction_id = models.CharField(max_length=100, blank=True)
-    status = models.CharField(max_length=20, default='pending')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    # Sent with every gateway call so a retried charge is never made twice;
+    # derived from the order id plus a counter bumped when a failed payment
+    # is submitted again.
+    idempotency_key = models.CharField(max_length=80, unique=True, null=True, blank=True)
+    submission = models.PositiveSmallIntegerField(default=1)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # process_payments picks up due and stuck jobs by status.
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
     
     def __str__(self):
         return f"Payment {self.transaction_id} - {self.order.order_id}"
@@ -110,3 +147,64 @@ class OrderHistory(models.Model):
     
     def __str__(self):
         return f"{self.order.order_id} - {self.status} - {self.created_at}"
+
+class StockShard(models.Model):
+    """One slice of a product's reservable stock (see orders.inventory)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shards')
+    shard = models.PositiveSmallIntegerField(default=0)
+    available = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['product', 'shard']
+
+    def __str__(self):
+        return f"{self.product_id}#{self.shard}: {self.available}"
+
+class StockReservation(models.Model):
+    STATUS_CHOICES = [
+        ('held', 'Held'),
+        ('confirmed', 'Confirmed'),
+        ('released', 'Released'),
+        ('expired', 'Expired'),
+    ]
+
+    reservation_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # SET_NULL so deleting an order never strands held stock; the sweeper
+    # still finds and releases the hold.
+    order = models.OneToOneField(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='reservation')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='held')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # The sweeper scans held reservations by deadline.
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"Reservation {self.reservation_id} - {self.status}"
+
+class StockReservationLine(models.Model):
+    reservation = models.ForeignKey(StockReservation, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} from shard {self.shard}"
+
+@receiver(post_save, sender=Product)
+def resync_stock_shards(sender, instance, created, update_fields=None, **kwargs):
+    """Keep sharded stock in line with a Product.stock saved through the ORM (e.g. the admin)
+
+    Bulk writers skip this signal and call ``inventory.resync`` themselves
+    (``CatalogImporter.write_chunk``, used by import_catalog and the
+    products.txt sync).
+    """
+    if created or (update_fields is not None and 'stock' not in update_fields):
+        return
+    from .inventory import resync
+    resync([instance.pk])
@@ -0,0 +1,272 @@
+import atexit
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from accounts.models import UserProfile
+from . import inventory, lifecycle
+from .gateways import GatewayError, PaymentDeclined, get_gateway
+from .models import Payment
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = ('queued', 'processing', 'retrying')
+
+
+def idempotency_key(order, submission=1):
+    """Gateway idempotency key for one submission of an order's payment"""
+    key = f'order-{order.order_id}'
+    return key if submission == 1 else f'{key}-{submission}'
+
+
+class PaymentQueue:
+    """Charges orders on background workers instead of in the request
+
+    ``submit`` records the job on the order's ``Payment`` row (status
+    ``queued``) and returns straight away; the page then polls the status.
+    Worker threads claim a job with a conditional ``UPDATE`` so it is
+    processed once even if it was queued twice, keep the stock hold alive,
+    call the gateway with the payment's idempotency key and, on success,
+    confirm the hold and mark the order paid in one transaction.
+
+    Transient gateway errors are retried with exponential backoff up to
+    ``max_attempts``; declines fail at once. Because the job state lives in
+    the database, ``drain`` (the ``process_payments`` command) picks up
+    whatever a stopped process left behind, and replaying a charge that
+    already went through is harmless thanks to the idempotency key.
+
+    With ``workers <= 0`` payments are processed synchronously.
+    """
+
+    def __init__(self, gateway=None, workers=2, max_attempts=3, retry_backoff=2.0, stale_after=300):
+        self._gateway = gateway
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.stale_after = stale_after
+        self._heap = []
+        self._sequence = itertools.count()
+        self._ready = threading.Condition()
+        self._threads = []
+        self._thread_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {'submitted': 0, 'succeeded': 0, 'retried': 0, 'failed': 0}
+
+    @property
+    def gateway(self):
+        return self._gateway or get_gateway()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._stats_lock, self._ready:
+            return dict(self._stats, queued=len(self._heap))
+
+    def submit(self, order, method='stripe'):
+        """Queue a charge for ``order``; returns its ``Payment``
+
+        Submitting an order whose payment is already queued, running or
+        done changes nothing. A failed payment is queued again under a new
+        idempotency key, so the gateway treats it as a fresh charge.
+
+        ``method`` is what the customer paid with, as recorded on the
+        payment and the order (one of ``Payment.PAYMENT_METHODS``); the
+        charge itself always goes through the configured gateway.
+        """
+        with transaction.atomic():
+            payment = Payment.objects.select_for_update().filter(order=order).first()
+            if payment is None:
+                payment = Payment.objects.create(
+                    order=order, amount=order.total, method=method, idempotency_key=idempotency_key(order),
+                )
+            elif payment.status not in ACTIVE and payment.status != 'succeeded':
+                payment.submission += 1
+                payment.idempotency_key = idempotency_key(order, payment.submission)
+                payment.amount = order.total
+                payment.method = method
+                payment.status = 'queued'
+                payment.attempts = 0
+                payment.next_attempt_at = None
+                payment.last_error = ''
+                payment.save()
+                lifecycle.bulk_transition([order.pk], payment_status='pending', comment='Payment resubmitted')
+            if payment.status == 'queued':
+                self._count('submitted')
+                transaction.on_commit(lambda: self.enqueue(payment.pk))
+        return payment
+
+    def enqueue(self, payment_id, delay=0.0):
+        if self.workers <= 0:
+            while payment_id is not None:
+                if delay > 0:
+                    time.sleep(delay)
+                delay = self.process(payment_id)
+                if delay is None:
+                    payment_id = None
+            return
+        self._ensure_threads()
+        with self._ready:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), payment_id))
+            self._ready.notify()
+
+    def process(self, payment_id):
+        """Make one attempt at a queued payment; returns the retry delay or ``None`` when done"""
+        now = timezone.now()
+        if not Payment.objects.filter(pk=payment_id, status__in=['queued', 'retrying']).filter(
+                Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)).update(
+                status='processing', attempts=F('attempts') + 1, updated_at=now):
+            return None  # done, being processed elsewhere, or not due yet
+        payment = Payment.objects.select_related('order').get(pk=payment_id)
+        order = payment.order
+        try:
+            reservation = inventory.ensure_order_held(order)
+        except inventory.CheckoutError as exc:
+            self._fail(payment, str(exc))
+            return None
+
+        try:
+            transaction_id = self.gateway.charge(
+                order.total, 'usd', payment.idempotency_key, metadata={'order_id': order.order_id},
+            )
+        except GatewayError as exc:
+            if payment.attempts >= self.max_attempts:
+                self._fail(payment, f'Gave up after {payment.attempts} attempts: {exc}')
+                return None
+            delay = self.retry_backoff * 2 ** (payment.attempts - 1)
+            Payment.objects.filter(pk=payment.pk, status='processing').update(
+                status='retrying', next_attempt_at=now + timedelta(seconds=delay),
+                last_error=str(exc), updated_at=timezone.now(),
+            )
+            self._count('retried')
+            return delay
+        except PaymentDeclined as exc:
+            self._fail(payment, str(exc))
+            return None
+
+        try:
+            with transaction.atomic():
+                if reservation.status == inventory.HELD:
+                    inventory.confirm(reservation)
+                lifecycle.transition(
+                    order, 'processing', payment_status='paid', comment=f'Paid via {payment.method}',
+                    payment_id=transaction_id, payment_method=payment.method,
+                )
+                Payment.objects.filter(pk=payment.pk).update(
+                    status='succeeded', transaction_id=transaction_id, next_attempt_at=None,
+                    last_error='', updated_at=timezone.now(),
+                )
+                profile = UserProfile.objects.select_for_update().filter(user_id=order.user_id).first()
+                if profile is not None:
+                    profile.update_purchase_stats(order.total)
+        except (inventory.CheckoutError, lifecycle.InvalidTransition) as exc:
+            # The hold lapsed (or the order was cancelled) while the card was
+            # charged; give the money back rather than ship nothing.
+            try:
+                self.gateway.refund(transaction_id, f'{payment.idempotency_key}-refund')
+            except (GatewayError, PaymentDeclined):
+                logger.exception('Refunding %s for order %s failed', transaction_id, order.order_id)
+            self._fail(payment, f'{exc} The charge was refunded.', transaction_id=transaction_id)
+            return None
+        self._count('succeeded')
+        return None
+
+    def _fail(self, payment, error, transaction_id=''):
+        now = timezone.now()
+        with transaction.atomic():
+            Payment.objects.filter(pk=payment.pk).update(
+                status='failed', last_error=error, transaction_id=transaction_id,
+                next_attempt_at=None, updated_at=now,
+            )
+            lifecycle.bulk_transition([payment.order_id], payment_status='failed', comment=error)
+        self._count('failed')
+
+    def drain(self):
+        """Synchronously run every due job in the database; returns how many were attempted
+
+        Jobs stuck in ``processing`` for longer than ``stale_after`` seconds
+        (their worker died) are retried first.
+        """
+        now = timezone.now()
+        Payment.objects.filter(status='processing', updated_at__lt=now - timedelta(seconds=self.stale_after)).update(
+            status='retrying', next_attempt_at=now, updated_at=now,
+        )
+        due = list(Payment.objects.filter(status__in=['queued', 'retrying'])
+                   .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+                   .order_by('created_at').values_list('pk', flat=True))
+        for payment_id in due:
+            self.process(payment_id)
+        return len(due)
+
+    def _ensure_threads(self):
+        if self._threads:
+            return
+        with self._thread_lock:
+            if not self._threads:
+                self._threads = [
+                    threading.Thread(target=self._run, name=f'payments-{i}', daemon=True)
+                    for i in range(self.workers)
+                ]
+                for thread in self._threads:
+                    thread.start()
+                atexit.register(self.stop)
+
+    def _next_job(self):
+        with self._ready:
+            while not self._stopped.is_set():
+                wait = self._heap[0][0] - time.monotonic() if self._heap else 1.0
+                if self._heap and wait <= 0:
+                    return heapq.heappop(self._heap)[2]
+                self._ready.wait(min(wait, 1.0))
+            return None
+
+    def _run(self):
+        while True:
+            payment_id = self._next_job()
+            if payment_id is None:
+                return
+            try:
+                delay = self.process(payment_id)
+            except Exception:
+                delay = None
+                logger.exception('Processing payment %s failed', payment_id)
+            finally:
+                connection.close()
+            if delay is not None:
+                self.enqueue(payment_id, delay)
+
+    def stop(self, timeout=5.0):
+        """Stop the workers; unfinished jobs stay queued in the database for ``drain``"""
+        self._stopped.set()
+        with self._ready:
+            self._ready.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+_payments = None
+_payments_lock = threading.Lock()
+
+
+def get_payment_queue():
+    """Return the process-wide payment queue"""
+    global _payments
+    if _payments is None:
+        with _payments_lock:
+            if _payments is None:
+                _payments = PaymentQueue(
+                    workers=getattr(settings, 'PAYMENT_WORKERS', 2),
+                    max_attempts=getattr(settings, 'PAYMENT_MAX_ATTEMPTS', 3),
+                    retry_backoff=getattr(settings, 'PAYMENT_RETRY_SECONDS', 2.0),
+                )
+    return _payments
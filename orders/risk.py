@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+
+from .models import Order
+
+FEATURES = ('velocity', 'amount_ratio', 'address_mismatch', 'account_age_days', 'no_history')
+
+# Logistic weights on the transformed features; hand-tuned until there is
+# labelled fraud to fit them on. A brand-new account with no history sits
+# around 0.2, a repeat customer's usual order around 0.02.
+BIAS = -4.0
+WEIGHTS = {
+    'velocity': 0.9,          # per log(1 + orders in the window)
+    'amount_ratio': 1.0,      # per doubling above the user's average order
+    'address_mismatch': 1.5,
+    'new_account': 2.0,       # decays with account age (one-week scale)
+    'no_history': 0.5,
+}
+VELOCITY_WINDOW = timedelta(hours=24)
+NEW_ACCOUNT_DAYS = 7.0
+
+# Order columns the batch scorer reads
+COLUMNS = ('pk', 'user_id', 'created_at', 'total', 'shipping_address', 'billing_address',
+           'user__date_joined', 'user__userprofile__average_order_value')
+
+
+def normalize_address(address):
+    return ' '.join((address or '').lower().replace(',', ' ').split())
+
+
+def _seconds(moments):
+    return np.fromiter((moment.timestamp() for moment in moments), dtype=np.float64, count=len(moments))
+
+
+class RiskScorer:
+    """Vectorized fraud-risk scores for batches of orders, in [0, 1]
+
+    Each order gets five features: how many orders its user placed in the
+    ``velocity_window`` before it, its total relative to the user's
+    ``average_order_value``, whether shipping and billing addresses
+    differ, how old the account was, and whether the user has no purchase
+    history at all. A logistic model over those gives the score.
+
+    Everything after the database reads is NumPy over the whole batch, so
+    one order (at checkout) and a chunk of thousands (in a backfill) take
+    the same code path; velocity is found with two ``searchsorted`` calls
+    over the users' sorted order times rather than a query per order.
+    """
+
+    def __init__(self, weights=None, bias=BIAS, velocity_window=VELOCITY_WINDOW):
+        self.weights = dict(WEIGHTS, **(weights or {}))
+        self.bias = bias
+        self.window = velocity_window.total_seconds()
+
+    def velocity(self, user_ids, times):
+        """Orders each user placed in the window strictly before each time"""
+        if not len(user_ids):
+            return np.zeros(0)
+        start = times.min() - self.window
+        rows = list(Order.objects.filter(
+            user_id__in=set(user_ids.tolist()),
+            created_at__gte=datetime.fromtimestamp(start, dt_timezone.utc),
+            created_at__lt=datetime.fromtimestamp(times.max(), dt_timezone.utc),
+        ).values_list('user_id', 'created_at'))
+        if not rows:
+            return np.zeros(len(user_ids))
+        history_users = np.fromiter((user_id for user_id, _ in rows), dtype=np.int64, count=len(rows))
+        history_times = _seconds([created_at for _, created_at in rows])
+        # One sorted key per (user, time): users are spaced further apart
+        # than the whole time range, so a window never spills into the next.
+        _, ranks = np.unique(np.concatenate((history_users, user_ids)), return_inverse=True)
+        span = times.max() - start + self.window + 1.0
+        history_keys = np.sort(ranks[:len(rows)] * span + (history_times - start))
+        keys = ranks[len(rows):] * span + (times - start)
+        return (np.searchsorted(history_keys, keys, side='left')
+                - np.searchsorted(history_keys, keys - self.window, side='left')).astype(np.float64)
+
+    def features(self, rows):
+        """``(len(rows), len(FEATURES))`` array for rows shaped like ``COLUMNS``"""
+        count = len(rows)
+        if not count:
+            return np.zeros((0, len(FEATURES)))
+        _, user_ids, created, totals, shipping, billing, joined, averages = zip(*rows)
+        user_ids = np.fromiter(user_ids, dtype=np.int64, count=count)
+        times = _seconds(created)
+        totals = np.fromiter((float(total) for total in totals), dtype=np.float64, count=count)
+        averages = np.fromiter((float(average or 0) for average in averages), dtype=np.float64, count=count)
+        no_history = averages <= 0
+        ratio = np.divide(totals, averages, out=np.ones(count), where=~no_history)
+        mismatch = np.fromiter(
+            (bool(bill) and normalize_address(ship) != normalize_address(bill) for ship, bill in zip(shipping, billing)),
+            dtype=np.float64, count=count,
+        )
+        age_days = np.maximum(times - _seconds(joined), 0.0) / 86400.0
+        return np.column_stack((self.velocity(user_ids, times), ratio, mismatch, age_days, no_history))
+
+    def score_features(self, features):
+        velocity, ratio, mismatch, age_days, no_history = features.T
+        logit = (self.bias
+                 + self.weights['velocity'] * np.log1p(velocity)
+                 + self.weights['amount_ratio'] * np.maximum(np.log2(np.maximum(ratio, 1e-9)), 0.0)
+                 + self.weights['address_mismatch'] * mismatch
+                 + self.weights['new_account'] * np.exp(-age_days / NEW_ACCOUNT_DAYS)
+                 + self.weights['no_history'] * no_history)
+        return 1.0 / (1.0 + np.exp(-logit))
+
+    def score_rows(self, rows):
+        return self.score_features(self.features(rows))
+
+    def score_new_order(self, user, total, shipping_address, billing_address, at):
+        """Score an order that is about to be created (used inline by checkout)"""
+        average = user.userprofile.average_order_value if hasattr(user, 'userprofile') else 0
+        row = (None, user.pk, at, total, shipping_address, billing_address, user.date_joined, average)
+        return round(float(self.score_rows([row])[0]), 6)
+
+    def backfill(self, queryset=None, chunk_size=5000, progress=None):
+        """Score every order in ``queryset`` in primary-key chunks; returns how many were scored
+
+        Each chunk is one read (orders joined to user and profile), one read
+        of the users' recent order times and one ``bulk_update``.
+        """
+        queryset = (queryset if queryset is not None else Order.objects.all()).order_by('pk')
+        last_pk, scored = 0, 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values_list(*COLUMNS)[:chunk_size])
+            if not rows:
+                return scored
+            scores = self.score_rows(rows)
+            Order.objects.bulk_update(
+                [Order(pk=row[0], risk_score=round(float(score), 6)) for row, score in zip(rows, scores)],
+                ['risk_score'], batch_size=1000,
+            )
+            scored += len(rows)
+            last_pk = rows[-1][0]
+            if progress:
+                progress(scored)
+
+
+def score_new_order(user, total, shipping_address, billing_address, at):
+    return RiskScorer().score_new_order(user, total, shipping_address, billing_address, at)
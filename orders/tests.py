@@ -1,3 +1,423 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from products.catalog_io import CatalogImporter
+from products.models import Category, Product
+from . import inventory, lifecycle, payments, risk
+from .benchmark import ContentionBenchmark
+from .checkout import OutOfStock, place_order
+from .gateways import PaymentGateway, StubGateway
+from .models import Order, OrderHistory, Payment, StockShard
+from .payments import PaymentQueue
+
+
+def raw_cursor(value, pk):
+    raw = json.dumps([value, pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='secret')
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        self.products = [
+            Product.objects.create(name=f'Product {i}', sku=f'SKU{i}', category=category, price=Decimal('10.00'),
+                                   stock=100, image_url=f'https://example.com/{i}.jpg')
+            for i in range(3)
+        ]
+        now = timezone.now()
+        for i in range(12):
+            order = place_order(self.user, {product.pk: 1 for product in self.products[:1 + i % 3]},
+                                shipping_address='1 Main Street')
+            # Pairs of orders share a timestamp, so the id tie-breaker matters.
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(minutes=i // 2))
+        self.client.force_login(self.user)
+
+    def test_summary_columns(self):
+        order = Order.objects.order_by('pk')[2]
+        self.assertEqual(order.item_count, 3)
+        self.assertEqual(order.thumbnail, 'https://example.com/0.jpg')
+
+    def test_pages_without_loading_items(self):
+        seen, url = [], '/orders/orders/'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse([q for q in queries.captured_queries if 'orders_orderitem' in q['sql']])
+            seen += [order.order_id for order in response.context['orders']]
+            cursor = response.context['next_cursor']
+            url = f'/orders/orders/?after={cursor}' if cursor else None
+        self.assertEqual(seen, list(Order.objects.order_by('-created_at', '-id').values_list('order_id', flat=True)))
+
+    def test_bad_cursor_shows_first_page(self):
+        first = self.client.get('/orders/orders/').context['orders']
+        for cursor in (raw_cursor('abc', 1), raw_cursor({'a': 1}, 1), raw_cursor([2024], 1), '%%%'):
+            response = self.client.get('/orders/orders/', {'after': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['orders'], first)
+
+
+class InventoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret')
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        self.product = Product.objects.create(name='Phone', sku='SKU0', category=category,
+                                              price=Decimal('10.00'), stock=10)
+
+    def test_holds_span_shards_and_release(self):
+        inventory.reshard([self.product.pk], 4)
+        holds = [inventory.hold(self.user, {self.product.pk: 1}) for _ in range(7)]
+        inventory.hold(self.user, {self.product.pk: 3})
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 0})
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.hold(self.user, {self.product.pk: 1})
+        for reservation in holds:
+            inventory.release(reservation)
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 7})
+
+    def test_saving_stock_resyncs_shards(self):
+        inventory.reshard([self.product.pk], 2)
+        inventory.hold(self.user, {self.product.pk: 4})
+        self.product.stock = 20
+        self.product.save()
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 16})
+
+    def test_catalog_import_resyncs_shards(self):
+        inventory.reshard([self.product.pk], 2)
+        CatalogImporter().run([(1, {'sku': 'SKU0', 'name': 'Phone', 'price': '10', 'stock': '25'})])
+        self.assertEqual(sum(StockShard.objects.filter(product=self.product).values_list('available', flat=True)), 25)
+        reservation = inventory.hold(self.user, {self.product.pk: 20})
+        self.assertIsNotNone(reservation)
+
+
+class PaymentFixture:
+    def make_order(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='secret')
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        self.product = Product.objects.create(name='Phone', sku='SKU0', category=category,
+                                              price=Decimal('10.00'), stock=5)
+        self.order = place_order(self.user, {self.product.pk: 2}, shipping_address='1 Main Street')
+
+
+class PaymentQueueTests(PaymentFixture, TestCase):
+    def setUp(self):
+        self.make_order()
+
+    def submit(self, queue):
+        with self.captureOnCommitCallbacks(execute=True):
+            payment = queue.submit(self.order)
+        payment.refresh_from_db()
+        self.order.refresh_from_db()
+        return payment
+
+    def test_charges_once(self):
+        gateway = StubGateway(failure_rate=0.0)
+        queue = PaymentQueue(gateway=gateway, workers=0)
+        payment = self.submit(queue)
+        self.assertEqual(payment.status, 'succeeded')
+        self.assertEqual(payment.idempotency_key, f'order-{self.order.order_id}')
+        self.assertEqual((self.order.status, self.order.payment_status), ('processing', 'paid'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+        # Submitting again, or replaying the job, does not charge twice.
+        self.submit(queue)
+        Payment.objects.update(status='retrying')
+        queue.process(payment.pk)
+        self.assertEqual(gateway.charges, 1)
+
+    def test_gives_up_after_max_attempts_then_resubmits_under_a_new_key(self):
+        gateway = StubGateway(failure_rate=1.0)
+        queue = PaymentQueue(gateway=gateway, workers=0, max_attempts=3, retry_backoff=0.01)
+        payment = self.submit(queue)
+        self.assertEqual((payment.status, payment.attempts), ('failed', 3))
+        self.assertEqual(self.order.payment_status, 'failed')
+
+        gateway.failure_rate = 0.0
+        payment = self.submit(queue)
+        self.assertEqual((payment.status, payment.submission), ('succeeded', 2))
+        self.assertEqual(payment.idempotency_key, f'order-{self.order.order_id}-2')
+
+    def test_decline_fails_at_once_and_keeps_the_hold(self):
+        queue = PaymentQueue(gateway=StubGateway(decline_amounts={self.order.total}), workers=0)
+        payment = self.submit(queue)
+        self.assertEqual((payment.status, payment.attempts), ('failed', 1))
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 3})
+
+    def test_payment_views(self):
+        payments._payments = PaymentQueue(gateway=StubGateway(failure_rate=0.0), workers=0)
+        self.addCleanup(setattr, payments, '_payments', None)
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/orders/payment/{self.order.order_id}/')
+        self.assertRedirects(response, f'/orders/payment/{self.order.order_id}/status/',
+                             fetch_redirect_response=False)
+        response = self.client.get(f'/orders/payment/{self.order.order_id}/status/', {'format': 'json'})
+        self.assertEqual(response.json()['status'], 'succeeded')
+
+    def test_gateways_must_implement_charge_and_refund(self):
+        class Incomplete(PaymentGateway):
+            def charge(self, amount, currency, idempotency_key, metadata=None):
+                return 'ch_1'
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_drain_processes_queued_jobs(self):
+        Payment.objects.create(order=self.order, amount=self.order.total, method='stripe',
+                               idempotency_key=f'order-{self.order.order_id}')
+        self.assertEqual(PaymentQueue(gateway=StubGateway(failure_rate=0.0), workers=0).drain(), 1)
+        self.assertEqual(Payment.objects.get().status, 'succeeded')
+
+
+class PaymentWorkerTests(PaymentFixture, TransactionTestCase):
+    def setUp(self):
+        self.make_order()
+
+    def test_workers_retry_in_the_background(self):
+        gateway = StubGateway(latency=0.05, failure_rate=0.5, seed=3)
+        queue = PaymentQueue(gateway=gateway, workers=2, max_attempts=10, retry_backoff=0.01)
+        self.addCleanup(queue.stop)
+        started = time.monotonic()
+        payment = queue.submit(self.order)
+        self.assertLess(time.monotonic() - started, 0.05)
+        for _ in range(200):
+            payment.refresh_from_db()
+            if payment.status in ('succeeded', 'failed'):
+                break
+            time.sleep(0.05)
+        self.assertEqual(payment.status, 'succeeded')
+        self.assertEqual(gateway.charges, 1)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        self.bench = ContentionBenchmark(users=6, products=2, stock=10, lines=2, seed=3)
+        self.bench.setup()
+        self.addCleanup(self.bench.cleanup)
+        self.users = {user.pk: user for user in User.objects.filter(pk__in=self.bench.user_ids)}
+
+    def run_checkouts(self, attempt):
+        return self.bench.run(
+            attempt, 40, threads=6,
+            classify=lambda exc: 'out_of_stock' if isinstance(exc, OutOfStock) else None,
+        )
+
+    def test_concurrent_checkouts_never_oversell(self):
+        def attempt(user_id, quantities):
+            order = place_order(self.users[user_id], quantities, shipping_address='Benchmark')
+            inventory.confirm(order.reservation)
+
+        report = self.run_checkouts(attempt)
+        # Writers queue on the IMMEDIATE lock instead of failing.
+        self.assertEqual(set(report['outcomes']), {'ok', 'out_of_stock'})
+        check = self.bench.verify()
+        self.assertEqual((check['oversold'], check['mismatched']), (0, 0))
+        self.assertGreater(check['sold'], 0)
+
+    def test_concurrent_holds_never_oversell(self):
+        def attempt(user_id, quantities):
+            place_order(self.users[user_id], quantities, shipping_address='Benchmark')
+
+        report = self.run_checkouts(attempt)
+        self.assertEqual(set(report['outcomes']), {'ok', 'out_of_stock'})
+        check = self.bench.verify_inventory()
+        self.assertEqual((check['oversold'], check['mismatched'], check['sold']), (0, 0, 0))
+        self.assertGreater(check['held'], 0)
+
+    def test_transactions_take_the_write_lock_at_begin(self):
+        # Each side notes the time just before its transaction commits.
+        entered, finished = threading.Event(), []
+
+        def holder():
+            try:
+                with transaction.atomic():
+                    # Only a read, which a DEFERRED transaction would not lock.
+                    Product.objects.count()
+                    entered.set()
+                    time.sleep(0.3)
+                    finished.append(('holder', time.monotonic()))
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=holder)
+        thread.start()
+        entered.wait(5)
+        with transaction.atomic():
+            finished.append(('waiter', time.monotonic()))
+        thread.join()
+        self.assertEqual([name for name, _ in sorted(finished, key=lambda entry: entry[1])], ['holder', 'waiter'])
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('benchmark_checkout', '--threads', '4', '--attempts', '20', '--users', '4',
+                     '--products', '2', '--stock', '5', stdout=out)
+        self.assertIn('oversold products: 0, stock/sales_count mismatches: 0', out.getvalue())
+        self.assertFalse(Product.objects.filter(sku__startswith='BENCH-CHECKOUT-').exists())
+
+
+class RiskScorerTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        self.scorer = risk.RiskScorer()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        User.objects.filter(pk__in=[self.alice.pk, self.bob.pk]).update(date_joined=self.now - timedelta(days=400))
+
+    def order(self, user, hours_ago=0, total='100.00', shipping='1 Main Street', billing=''):
+        order = Order.objects.create(user=user, shipping_address=shipping, billing_address=billing,
+                                     subtotal=Decimal(total), total=Decimal(total))
+        Order.objects.filter(pk=order.pk).update(created_at=self.now - timedelta(hours=hours_ago))
+        return order
+
+    def rows(self, orders):
+        return list(Order.objects.filter(pk__in=[order.pk for order in orders]).order_by('pk')
+                    .values_list(*risk.COLUMNS))
+
+    def test_velocity_counts_orders_in_the_window_before_each_time(self):
+        for hours_ago in (30, 24, 20, 2):
+            self.order(self.alice, hours_ago)
+        self.order(self.bob, 1)
+        carol = User.objects.create_user('carol')
+        queries = [(self.alice, 0), (self.bob, 0), (self.alice, 19), (carol, 0), (self.alice, 2), (self.bob, 1)]
+        user_ids = np.array([user.pk for user, _ in queries], dtype=np.int64)
+        times = np.array([(self.now - timedelta(hours=hours)).timestamp() for _, hours in queries])
+        # The window includes its start and excludes the order's own time.
+        with self.assertNumQueries(1):
+            velocity = self.scorer.velocity(user_ids, times)
+        self.assertEqual(velocity.tolist(), [3, 1, 3, 0, 2, 0])
+
+    def test_amount_ratio_and_history(self):
+        profile = self.alice.userprofile
+        profile.average_order_value = Decimal('100.00')
+        profile.save()
+        usual, large = self.order(self.alice, total='100.00'), self.order(self.alice, total='400.00')
+        new = self.order(self.bob, total='400.00')
+        features = self.scorer.features(self.rows([usual, large, new]))
+        columns = dict(zip(risk.FEATURES, features.T))
+        self.assertEqual(columns['amount_ratio'].tolist(), [1.0, 4.0, 1.0])
+        self.assertEqual(columns['no_history'].tolist(), [0.0, 0.0, 1.0])
+        scores = self.scorer.score_features(features)
+        logits = np.log(scores / (1 - scores))
+        # Two doublings above the average, at one point each.
+        self.assertAlmostEqual(logits[1] - logits[0], 2.0, places=3)
+        self.assertAlmostEqual(logits[2] - logits[0], self.scorer.weights['no_history'], delta=0.05)
+
+    def test_address_mismatch_ignores_formatting(self):
+        same = self.order(self.alice, shipping='1 Main Street, Pune', billing='1 main street  pune')
+        blank = self.order(self.alice, shipping='1 Main Street', billing='')
+        other = self.order(self.alice, shipping='1 Main Street', billing='9 Side Road')
+        features = self.scorer.features(self.rows([same, blank, other]))
+        self.assertEqual(features[:, risk.FEATURES.index('address_mismatch')].tolist(), [0.0, 0.0, 1.0])
+
+    def test_score_new_order(self):
+        newcomer = User.objects.create_user('newcomer')
+        score = risk.score_new_order(newcomer, Decimal('500.00'), '1 Main Street', '', timezone.now())
+        # A brand-new account with no history sits around 0.2.
+        self.assertAlmostEqual(score, 0.18, delta=0.01)
+        self.assertEqual(score, round(score, 6))
+        alice = User.objects.select_related('userprofile').get(pk=self.alice.pk)
+        alice.userprofile.average_order_value = Decimal('500.00')
+        regular = risk.score_new_order(alice, Decimal('500.00'), '1 Main Street', '', self.now)
+        # A repeat customer's usual order sits around 0.02.
+        self.assertAlmostEqual(regular, 0.018, delta=0.005)
+
+    def test_backfill_matches_one_batch(self):
+        orders = [self.order(user, hours) for user, hours in
+                  ((self.alice, 30), (self.bob, 5), (self.alice, 3), (self.alice, 1), (self.bob, 0))]
+        expected = self.scorer.score_rows(self.rows(orders))
+        progress = []
+        # Per chunk: the orders, their users' recent orders and one bulk
+        # update; then the read that finds nothing left.
+        with self.assertNumQueries(3 * 3 + 1):
+            scored = self.scorer.backfill(chunk_size=2, progress=progress.append)
+        self.assertEqual(scored, 5)
+        self.assertEqual(progress, [2, 4, 5])
+        stored = list(Order.objects.order_by('pk').values_list('risk_score', flat=True))
+        self.assertEqual(stored, [round(float(value), 6) for value in expected])
+        self.assertGreater(min(stored), 0)
+
+
+class LifecycleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='secret')
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        self.product = Product.objects.create(name='Phone', sku='SKU0', category=category,
+                                              price=Decimal('10.00'), stock=5)
+        self.order = place_order(self.user, {self.product.pk: 2}, shipping_address='1 Main Street')
+
+    def test_valid_moves_stamp_times_and_record_history(self):
+        lifecycle.transition(self.order, 'processing', payment_status='paid', payment_id='ch_1')
+        self.assertEqual((self.order.status, self.order.payment_status, self.order.payment_id),
+                         ('processing', 'paid', 'ch_1'))
+        self.assertIsNotNone(self.order.paid_at)
+        lifecycle.transition(self.order, 'shipped')
+        lifecycle.transition(self.order, 'delivered')
+        self.assertIsNotNone(self.order.shipped_at)
+        self.assertIsNotNone(self.order.delivered_at)
+        self.assertEqual(list(self.order.history.order_by('pk').values_list('status', flat=True)),
+                         ['processing', 'shipped', 'delivered'])
+
+    def test_invalid_moves_are_refused(self):
+        for status, payment_status in (('shipped', None), ('delivered', None), ('pending', None), (None, 'refunded')):
+            with self.assertRaises(lifecycle.InvalidTransition):
+                lifecycle.transition(self.order, status, payment_status=payment_status)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.payment_status), ('pending', 'pending'))
+        self.assertFalse(self.order.history.exists())
+        with self.assertRaises(ValueError):
+            lifecycle.bulk_transition([self.order], 'lost')
+
+    def test_cancelling_releases_the_hold(self):
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 3})
+        lifecycle.transition(self.order, 'cancelled')
+        self.assertEqual(inventory.available([self.product.pk]), {self.product.pk: 5})
+        with self.assertRaises(lifecycle.InvalidTransition):
+            lifecycle.transition(self.order, 'processing')
+
+    def test_paid_orders_cannot_be_cancelled(self):
+        lifecycle.transition(self.order, 'processing', payment_status='paid')
+        with self.assertRaises(lifecycle.InvalidTransition):
+            lifecycle.transition(self.order, 'cancelled')
+
+        admin_user = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(admin_user)
+        response = self.client.post('/admin/orders/order/', {
+            'action': 'mark_cancelled', '_selected_action': [self.order.pk],
+        }, follow=True)
+        self.assertContains(response, 'refund those instead')
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.payment_status), ('processing', 'paid'))
+
+    def test_bulk_transition_skips_orders_in_the_wrong_state(self):
+        Order.objects.bulk_create([
+            Order(user=self.user, order_id=f'BULK-{i}', status='processing' if i % 4 else 'pending',
+                  payment_status='paid', shipping_address='1 Main Street', billing_address='1 Main Street',
+                  phone_number='1', subtotal=1, total=1)
+            for i in range(40)
+        ])
+        moved, skipped = lifecycle.bulk_transition(Order.objects.filter(order_id__startswith='BULK-'), 'shipped',
+                                                   user=self.user, batch_size=15)
+        self.assertEqual((len(moved), len(skipped)), (30, 10))
+        self.assertTrue(all(state == ('pending', 'paid') for state in skipped.values()))
+        self.assertEqual(Order.objects.filter(status='shipped', shipped_at__isnull=False).count(), 30)
+        self.assertEqual(OrderHistory.objects.filter(status='shipped', created_by=self.user).count(), 30)
+
+        call_command('transition_orders', '--to', 'delivered', '--from-status', 'shipped', stdout=io.StringIO())
+        self.assertEqual(Order.objects.filter(status='delivered', delivered_at__isnull=False).count(), 30)
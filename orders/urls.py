@@ -8,6 +8,7 @@ urlpatterns = [
     path('order/<str:order_id>/', views.order_detail, name='order_detail'),
     path('orders/', views.order_list, name='order_list'),
     path('payment/<str:order_id>/', views.payment_view, name='payment'),
+    path('payment/<str:order_id>/status/', views.payment_status, name='payment_status'),
     path('payment/success/<str:order_id>/', views.payment_success, name='payment_success'),
     path('payment/cancel/', views.payment_cancel, name='payment_cancel'),
 ]
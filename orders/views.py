@@ -2,86 +2,119 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.conf import settings
-from products.models import Cart
-from .models import Order, OrderItem, Payment
-import stripe
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from django.http import JsonResponse
+from django.urls import reverse
+from products.cart_store import get_cart_store
+from products.carts import get_cart_summary, invalidate_cart_summary
+from products.models import Product
+from . import history, inventory
+from .checkout import CheckoutError, OutOfStock, place_order
+from .models import Order, Payment
+from .payments import ACTIVE, get_payment_queue
 
 @login_required
 def checkout(request):
-    cart = get_object_or_404(Cart, user=request.user)
+    store = get_cart_store()
+    cart_key = store.user_key(request.user.pk)
     
     if request.method == 'POST':
-        # Create order
-        order = Order.objects.create(
-            user=request.user,
-            shipping_address=request.POST.get('shipping_address'),
-            billing_address=request.POST.get('billing_address'),
-            phone_number=request.POST.get('phone_number'),
-            subtotal=cart.total_price,
-            total=cart.total_price,
-        )
-        
-        # Create order items
-        for item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price=item.product.get_discounted_price()
+        quantities = store.items(cart_key)
+        try:
+            order = place_order(
+                request.user,
+                quantities,
+                shipping_address=request.POST.get('shipping_address', ''),
+                billing_address=request.POST.get('billing_address', ''),
+                phone_number=request.POST.get('phone_number', ''),
             )
+        except OutOfStock as exc:
+            names = dict(Product.objects.filter(pk__in=exc.shortages).values_list('pk', 'name'))
+            for product_id, available in exc.shortages.items():
+                messages.error(request, f'Only {available} left of {names.get(product_id, "a product")}.')
+            return redirect('products:cart_view')
+        except CheckoutError as exc:
+            messages.error(request, str(exc))
+            return redirect('products:cart_view')
         
-        # Clear cart
-        cart.items.all().delete()
+        # Take the ordered units out of the cart; anything added meanwhile stays.
+        store.apply(cart_key, [('add', product_id, -quantity) for product_id, quantity in quantities.items()])
+        invalidate_cart_summary(request)
         
         return redirect('orders:payment', order_id=order.order_id)
     
-    return render(request, 'orders/checkout.html', {'cart': cart})
+    return render(request, 'orders/checkout.html', {'summary': get_cart_summary(request)})
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, order_id=order_id, user=request.user)
+    order = get_object_or_404(
+        Order.objects.prefetch_related(history.items_prefetch()), order_id=order_id, user=request.user,
+    )
     return render(request, 'orders/order_detail.html', {'order': order})
 
 @login_required
 def order_list(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'orders/order_list.html', {'orders': orders})
+    orders, next_cursor = history.order_page(request.user, request.GET.get('after'))
+    return render(request, 'orders/order_list.html', {
+        'orders': orders,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('after'),
+    })
 
 @login_required
 def payment_view(request, order_id):
     order = get_object_or_404(Order, order_id=order_id, user=request.user)
+    payment = Payment.objects.filter(order=order).first()
+    if payment is not None and (payment.status in ACTIVE or payment.status == 'succeeded'):
+        return redirect('orders:payment_status', order_id=order.order_id)
     
     if request.method == 'POST':
         try:
-            # Create Stripe payment intent
-            intent = stripe.PaymentIntent.create(
-                amount=int(order.total * 100),  # Convert to cents
-                currency='usd',
-                metadata={'order_id': order.order_id}
-            )
-            
-            order.payment_id = intent.id
-            order.payment_status = 'paid'
-            order.status = 'processing'
-            order.save()
-            
-            # Update user profile stats
-            request.user.userprofile.update_purchase_stats(order.total)
-            
-            return redirect('orders:payment_success', order_id=order.order_id)
-            
-        except stripe.error.CardError as e:
-            messages.error(request, f'Payment failed: {e.user_message}')
-        except Exception as e:
-            messages.error(request, 'Payment processing error occurred.')
+            # Keep the stock held (and the hold alive) while the card is charged
+            inventory.ensure_order_held(order)
+        except CheckoutError as exc:
+            messages.error(request, str(exc))
+            return redirect('orders:order_detail', order_id=order.order_id)
+        
+        # The charge runs on the payment queue; the status page polls for the outcome.
+        # This page only takes cards, and cards are billed through Stripe, so
+        # that is the method recorded; PAYMENT_GATEWAY picks who is called.
+        get_payment_queue().submit(order, method='stripe')
+        return redirect('orders:payment_status', order_id=order.order_id)
+    
+    if payment is not None and payment.status == 'failed':
+        messages.error(request, f'Payment failed: {payment.last_error}')
     
     return render(request, 'orders/payment.html', {
         'order': order,
         'stripe_public_key': settings.STRIPE_PUBLISHABLE_KEY
     })
 
+@login_required
+def payment_status(request, order_id):
+    """Where a submitted payment stands; JSON with ``?format=json`` for polling"""
+    order = get_object_or_404(Order, order_id=order_id, user=request.user)
+    payment = Payment.objects.filter(order=order).first()
+    if payment is None:
+        return redirect('orders:payment', order_id=order.order_id)
+    
+    if payment.status == 'succeeded':
+        next_url = reverse('orders:payment_success', args=[order.order_id])
+    elif payment.status == 'failed':
+        next_url = reverse('orders:payment', args=[order.order_id])
+    else:
+        next_url = ''
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'order_id': order.order_id,
+            'status': payment.status,
+            'attempts': payment.attempts,
+            'error': payment.last_error if payment.status == 'failed' else '',
+            'next_url': next_url,
+        })
+    if next_url:
+        return redirect(next_url)
+    return render(request, 'orders/payment_status.html', {'order': order, 'payment': payment})
+
 @login_required
 def payment_success(request, order_id):
     order = get_object_or_404(Order, order_id=order_id, user=request.user)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Product, ProductImage, ProductReview, Cart, CartItem, UserBehavior
+from .models import Category, Product, ProductImage, ProductReview, Cart, CartItem, UserBehavior, UserBehaviorDaily
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -37,4 +37,10 @@ class CartAdmin(admin.ModelAdmin):
 class UserBehaviorAdmin(admin.ModelAdmin):
     list_display = ['user', 'product', 'behavior_type', 'timestamp']
     list_filter = ['behavior_type', 'timestamp']
+    search_fields = ['user__username', 'product__name']
+
+@admin.register(UserBehaviorDaily)
+class UserBehaviorDailyAdmin(admin.ModelAdmin):
+    list_display = ['user', 'product', 'behavior_type', 'day', 'count']
+    list_filter = ['behavior_type', 'day']
     search_fields = ['user__username', 'product__name']
\ No newline at end of file
@@ -5,6 +5,7 @@ from . import api_views
 router = DefaultRouter()
 router.register(r'products', api_views.ProductViewSet)
 router.register(r'categories', api_views.CategoryViewSet)
+router.register(r'cart', api_views.CartViewSet, basename='cart')
 
 urlpatterns = [
     path('', include(router.urls)),
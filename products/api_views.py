@@ -1,16 +1,241 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import viewsets
-from rest_framework.decorators import api_view
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS, AllowAny
 from rest_framework.response import Response
-from .models import Product, Category
-from .serializers import ProductSerializer, CategorySerializer
+from .cart_store import get_cart_store
+from .carts import get_cart_summary, invalidate_cart_summary
+from .events import track_behavior
+from .models import Category, Product, ProductImage
+from .pagination import CategoryCursorPagination, ProductCursorPagination
+from .serializers import (
+    CartOperationSerializer, CartSummarySerializer, CategorySerializer, ProductListSerializer,
+    ProductSerializer,
+)
+
+class ConditionalListMixin:
+    """ETag support derived from the rows a response would serialize
+
+    Before rendering, the view reads only the values its serializer uses,
+    for only the rows being served (one page for ``list``, one object for
+    ``retrieve``), and hashes them into the ETag. A client polling with
+    ``If-None-Match`` then gets a 304 before anything is serialized.
+    Hashing values rather than ``Max(updated_at)`` also catches writes that
+    leave ``updated_at`` alone, such as the view counter flush, category
+    renames and new images. ``Last-Modified`` is still sent, but only the
+    ETag decides a 304.
+    """
+    list_fingerprint_fields = ()
+    detail_fingerprint_fields = ()
+    modified_field = 'updated_at'
+
+    def _conditional(self, request, rows, render, *extra):
+        digest = hashlib.md5('|'.join([
+            request.get_full_path(), request.accepted_renderer.format or '', *extra,
+        ]).encode())
+        for row in rows:
+            digest.update(repr(row).encode())
+        etag = '"%s"' % digest.hexdigest()
+        not_modified = get_conditional_response(request._request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = render()
+        response['ETag'] = etag
+        stamps = [row[self.modified_field] for row in rows if row.get(self.modified_field)]
+        if stamps:
+            response['Last-Modified'] = http_date(int(max(stamps).timestamp()))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        rows = self.filter_queryset(self.get_queryset()).prefetch_related(None).values(*self.list_fingerprint_fields)
+        extra = []
+        paginator = self.pagination_class() if self.pagination_class is not None else None
+        page = paginator.paginate_queryset(rows, request, view=self) if paginator is not None else None
+        if page is not None:
+            rows = page
+            extra = [str(getattr(paginator, 'has_next', '')), str(getattr(paginator, 'has_previous', ''))]
+        render = lambda: super(ConditionalListMixin, self).list(request, *args, **kwargs)
+        return self._conditional(request, list(rows), render, *extra)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup]})
+        rows = queryset.prefetch_related(None).order_by().values(*self.detail_fingerprint_fields)
+        if any(field.startswith('images__') for field in self.detail_fingerprint_fields):
+            rows = rows.order_by('images__pk')
+        render = lambda: super(ConditionalListMixin, self).retrieve(request, *args, **kwargs)
+        return self._conditional(request, list(rows), render)
+
+def _batch_values(request, key):
+    """Read a list from a JSON body or a comma-separated query parameter"""
+    if request.method == 'POST':
+        if not isinstance(request.data, dict):
+            raise ValidationError('Expected a JSON object.')
+        values = request.data.get(key) or []
+        if isinstance(values, str):
+            values = values.split(',')
+        if not isinstance(values, list):
+            raise ValidationError({key: 'Expected a list.'})
+    else:
+        values = request.query_params.get(key, '').split(',')
+    return [str(value).strip() for value in values if str(value).strip()]
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.filter(is_active=True)
+class ProductViewSet(ConditionalListMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.filter(is_active=True).order_by('-created_at', '-id')
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+    # Every column the serializers read, so the ETag moves whenever their
+    # output would (see ConditionalListMixin).
+    list_fingerprint_fields = [
+        name for name in ProductListSerializer.Meta.fields if name not in ('category_name', 'category_slug')
+    ] + ['category__name', 'category__slug']
+    detail_fingerprint_fields = (
+        [field.attname for field in Product._meta.concrete_fields]
+        + [f'category__{field.attname}' for field in Category._meta.concrete_fields]
+        + [f'images__{field.attname}' for field in ProductImage._meta.concrete_fields]
+    )
+
+    def get_queryset(self):
+        queryset = super().get_queryset().select_related('category')
+        if self.action in ('list', 'batch'):
+            # The flat list serializer never touches images or descriptions.
+            return queryset.defer('description')
+        return queryset.prefetch_related('images')
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'batch'):
+            return ProductListSerializer
+        return ProductSerializer
+
+    @action(detail=False, methods=['get', 'post'])
+    def batch(self, request):
+        """Resolve many ids and/or SKUs with a single query
+
+        ``GET ?ids=1,2&skus=A,B`` or ``POST {"ids": [...], "skus": [...]}``.
+        Results keep the requested order (ids first, then SKUs); anything not
+        found is listed under ``missing``.
+        """
+        raw_ids = _batch_values(request, 'ids')
+        skus = list(dict.fromkeys(_batch_values(request, 'skus')))
+        try:
+            ids = list(dict.fromkeys(int(value) for value in raw_ids))
+        except ValueError:
+            raise ValidationError({'ids': 'Ids must be integers.'})
+        limit = getattr(settings, 'PRODUCT_API_BATCH_LIMIT', 100)
+        if not ids and not skus:
+            raise ValidationError({'detail': 'Pass ids and/or skus.'})
+        if len(ids) + len(skus) > limit:
+            raise ValidationError({'detail': f'At most {limit} ids and skus per request.'})
+
+        found = list(self.get_queryset().order_by().filter(Q(pk__in=ids) | Q(sku__in=skus)))
+        by_id = {product.pk: product for product in found}
+        by_sku = {product.sku: product for product in found}
+        ordered = list(dict.fromkeys(
+            [by_id[pk] for pk in ids if pk in by_id] + [by_sku[sku] for sku in skus if sku in by_sku]
+        ))
+        serializer = self.get_serializer(ordered, many=True)
+        return Response({
+            'results': serializer.data,
+            'missing': {
+                'ids': [pk for pk in ids if pk not in by_id],
+                'skus': [sku for sku in skus if sku not in by_sku],
+            },
+        })
 
 class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    pagination_class = CategoryCursorPagination
+
+class CartViewSet(viewsets.ViewSet):
+    """The visitor's cart as JSON; every change answers with the new summary
+
+    ``GET /api/cart/`` returns the summary. ``add``, ``set`` and ``remove``
+    take ``{"product_id": .., "quantity": ..}``; ``batch`` takes
+    ``{"operations": [{"op": "add"|"set"|"remove", ...}, ...]}`` and applies
+    them all in one atomic step on the cart store.
+    """
+    permission_classes = [AllowAny]
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # SessionAuthentication only checks CSRF for logged-in users, but
+        # anonymous carts are bound to the session cookie as well.
+        if request.method not in SAFE_METHODS and not request.user.is_authenticated:
+            SessionAuthentication().enforce_csrf(request)
+
+    def _summary(self, request):
+        return Response(CartSummarySerializer(get_cart_summary(request), context={'request': request}).data)
+
+    def _apply(self, request, operations):
+        limit = getattr(settings, 'CART_API_BATCH_LIMIT', 50)
+        if not operations:
+            raise ValidationError({'operations': 'Pass at least one operation.'})
+        if len(operations) > limit:
+            raise ValidationError({'operations': f'At most {limit} operations per request.'})
+        # Lines may always be removed, but only products on sale can be added.
+        product_ids = {operation['product_id'] for operation in operations
+                       if operation['op'] != 'remove' and operation['quantity'] > 0}
+        existing = set(Product.objects.filter(pk__in=product_ids, is_active=True).values_list('pk', flat=True))
+        unknown = sorted(product_ids - existing)
+        if unknown:
+            raise ValidationError({'product_id': f'Unknown or unavailable products: {unknown}'})
+
+        store = get_cart_store()
+        results = store.apply(
+            store.key_for(request, create=True),
+            [(operation['op'], operation['product_id'], operation['quantity']) for operation in operations],
+        )
+        for operation, (previous, quantity) in zip(operations, results):
+            if quantity > previous:
+                track_behavior(request, 'cart_add', Product(pk=operation['product_id']))
+            elif previous and not quantity:
+                track_behavior(request, 'cart_remove', Product(pk=operation['product_id']))
+        invalidate_cart_summary(request)
+        return self._summary(request)
+
+    @staticmethod
+    def _body(request):
+        if not isinstance(request.data, dict):
+            raise ValidationError('Expected a JSON object.')
+        return request.data.dict() if isinstance(request.data, QueryDict) else request.data
+
+    def _single(self, request, op):
+        serializer = CartOperationSerializer(data={**self._body(request), 'op': op})
+        serializer.is_valid(raise_exception=True)
+        return self._apply(request, [serializer.validated_data])
+
+    def list(self, request):
+        return self._summary(request)
+
+    @action(detail=False, methods=['post'])
+    def add(self, request):
+        return self._single(request, 'add')
+
+    @action(detail=False, methods=['post'], url_path='set')
+    def set_quantity(self, request):
+        return self._single(request, 'set')
+
+    @action(detail=False, methods=['post'])
+    def remove(self, request):
+        return self._single(request, 'remove')
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        operations = self._body(request).get('operations')
+        if not isinstance(operations, list):
+            raise ValidationError({'operations': 'Expected a list.'})
+        serializer = CartOperationSerializer(data=operations, many=True)
+        serializer.is_valid(raise_exception=True)
+        return self._apply(request, serializer.validated_data)
 
 @api_view(['GET'])
 def get_recommendations(request, user_id):
@@ -21,5 +246,3 @@ def get_recommendations(request, user_id):
         'recommendations': [],
         'message': 'AI recommendations will be implemented'
     })
-
-
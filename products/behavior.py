@@ -0,0 +1,109 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Sum
+from django.utils import timezone
+
+GROUP_FIELDS = ('user_id', 'product_id', 'behavior_type')
+
+
+def day_bounds(day):
+    """Return the aware ``[start, end)`` datetimes covering ``day``"""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def retention_cutoff(retain_days=None):
+    """First day whose raw events are kept; older ones get compacted"""
+    if retain_days is None:
+        retain_days = getattr(settings, 'BEHAVIOR_RAW_RETENTION_DAYS', 30)
+    return timezone.localdate() - timedelta(days=retain_days)
+
+
+def compact_day(day):
+    """Fold one day of raw ``UserBehavior`` rows into daily rollups
+
+    The day's events are grouped in SQL, merged into any rollups that already
+    exist for that day (late events), and the raw rows are deleted in the
+    same transaction, so every event is counted exactly once across the two
+    tables. Returns the number of raw rows compacted.
+    """
+    from .models import UserBehavior, UserBehaviorDaily
+
+    start, end = day_bounds(day)
+    with transaction.atomic():
+        raw = UserBehavior.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        grouped = raw.values(*GROUP_FIELDS).annotate(total=Count('id')).order_by()
+        totals = {tuple(row[f] for f in GROUP_FIELDS): row['total'] for row in grouped}
+        if not totals:
+            return 0
+
+        existing = {
+            (rollup.user_id, rollup.product_id, rollup.behavior_type): rollup
+            for rollup in UserBehaviorDaily.objects.filter(day=day)
+        }
+        created, updated = [], []
+        for key, total in totals.items():
+            rollup = existing.get(key)
+            if rollup is None:
+                user_id, product_id, behavior_type = key
+                created.append(UserBehaviorDaily(day=day, user_id=user_id, product_id=product_id,
+                                                 behavior_type=behavior_type, count=total))
+            else:
+                rollup.count += total
+                updated.append(rollup)
+        UserBehaviorDaily.objects.bulk_create(created, batch_size=1000)
+        UserBehaviorDaily.objects.bulk_update(updated, ['count'], batch_size=1000)
+        compacted = sum(totals.values())
+        raw.delete()
+    return compacted
+
+
+def compact_behavior(before=None):
+    """Compact every day of raw events older than ``before``
+
+    Compacted days have no raw rows left, so each run resumes at the oldest
+    uncompacted event, which is normally the day after the last compacted one.
+    It then seeks from one day with events to the next on the ``timestamp``
+    index rather than walking the calendar, so gaps and past runs cost nothing.
+    Yields ``(day, rows)`` as each day is done so callers can report progress.
+    """
+    from .models import UserBehavior
+
+    before = before or retention_cutoff()
+    pending = UserBehavior.objects.filter(timestamp__lt=day_bounds(before)[0])
+    while True:
+        first = pending.aggregate(first=Min('timestamp'))['first']
+        if first is None:
+            return
+        day = timezone.localdate(first)
+        yield day, compact_day(day)
+        pending = pending.filter(timestamp__gte=day_bounds(day)[1])
+
+
+def behavior_counts(behavior_types=None, since=None):
+    """Return ``{(user_id, product_id, behavior_type): count}``
+
+    History comes from the daily rollups and only the not-yet-compacted tail
+    is aggregated from raw rows; both are GROUP BY queries, so the cost
+    depends on the number of distinct (user, product, type) triples rather
+    than on the number of events.
+    """
+    from .models import UserBehavior, UserBehaviorDaily
+
+    rollups = UserBehaviorDaily.objects.all()
+    raw = UserBehavior.objects.all()
+    if behavior_types is not None:
+        rollups = rollups.filter(behavior_type__in=behavior_types)
+        raw = raw.filter(behavior_type__in=behavior_types)
+    if since is not None:
+        rollups = rollups.filter(day__gte=since)
+        raw = raw.filter(timestamp__gte=day_bounds(since)[0])
+
+    counts = {}
+    for queryset, total in ((rollups, Sum('count')), (raw, Count('id'))):
+        for row in queryset.values(*GROUP_FIELDS).annotate(total=total).order_by():
+            key = tuple(row[f] for f in GROUP_FIELDS)
+            counts[key] = counts.get(key, 0) + row['total']
+    return counts
@@ -0,0 +1,242 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.utils import timezone
+
+SESSION_KEY = 'cart_token'
+
+
+class CartStore:
+    """Shopping carts: user carts in ``Cart``/``CartItem``, anonymous carts in the cache
+
+    Carts are addressed by key, ``cart:u:<user id>`` for users or
+    ``cart:s:<token>`` for anonymous visitors (the token lives in the
+    session, so it survives the session key rotation at login).
+
+    A user's cart lives only in the database. Each change is one
+    ``INSERT ... ON CONFLICT (cart, product) DO UPDATE`` that adds to (or
+    sets) the line's quantity in SQL, so concurrent requests never lose each
+    other's updates and nothing is read or locked first. A line that drops
+    to zero is deleted.
+
+    An anonymous cart is one cache entry, ``{'items': {product_id:
+    quantity}}``. Django's cache API has no compare-and-set, so its
+    read-modify-writes run under a short lock taken with ``cache.add``.
+    ``merge`` folds it into the user's cart at login.
+    """
+
+    def __init__(self, cache_alias='carts', timeout=14 * 24 * 3600, lock_timeout=10, lock_wait=5.0,
+                 prefix='cart'):
+        self.cache = caches[cache_alias]
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+        self.prefix = prefix
+
+    # Keys
+
+    def user_key(self, user_id):
+        return f'{self.prefix}:u:{user_id}'
+
+    def anonymous_key(self, token):
+        return f'{self.prefix}:s:{token}'
+
+    def _user_id(self, key):
+        kind, _, ident = key[len(self.prefix) + 1:].partition(':')
+        return int(ident) if kind == 'u' else None
+
+    def key_for(self, request, create=False):
+        """Cart key of the request's user or session, or ``None`` if there is none yet"""
+        if request.user.is_authenticated:
+            return self.user_key(request.user.pk)
+        token = request.session.get(SESSION_KEY)
+        if token is None:
+            if not create:
+                return None
+            token = request.session[SESSION_KEY] = uuid.uuid4().hex
+        return self.anonymous_key(token)
+
+    # Reading
+
+    def items(self, key):
+        """``{product_id: quantity}`` in the order lines were added"""
+        if key is None:
+            return {}
+        user_id = self._user_id(key)
+        if user_id is None:
+            entry = self.cache.get(key)
+            return dict(entry['items']) if entry else {}
+        from .models import CartItem
+        items = {}
+        for product_id, quantity in (CartItem.objects.filter(cart__user_id=user_id)
+                                     .order_by('added_at', 'pk').values_list('product_id', 'quantity')):
+            items[product_id] = items.get(product_id, 0) + quantity
+        return items
+
+    # Anonymous carts
+
+    @contextmanager
+    def _locked(self, key):
+        lock_key, token = f'{key}:lock', uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_wait
+        while not self.cache.add(lock_key, token, self.lock_timeout):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Cart {key} is locked')
+            time.sleep(0.005)
+        try:
+            yield
+        finally:
+            if self.cache.get(lock_key) == token:
+                self.cache.delete(lock_key)
+
+    @staticmethod
+    def _apply(items, op, product_id, quantity):
+        previous = items.get(product_id, 0)
+        if op == 'add':
+            quantity = previous + quantity
+        elif op == 'remove':
+            quantity = 0
+        elif op != 'set':
+            raise ValueError(f'Unknown cart operation: {op}')
+        if quantity > 0:
+            items[product_id] = quantity
+        else:
+            items.pop(product_id, None)
+        return previous, max(quantity, 0)
+
+    def _apply_anonymous(self, key, operations):
+        with self._locked(key):
+            entry = self.cache.get(key)
+            items = dict(entry['items']) if entry else {}
+            results = [self._apply(items, *operation) for operation in operations]
+            self.cache.set(key, {'items': items}, self.timeout)
+        return results
+
+    # User carts
+
+    @staticmethod
+    def _tables():
+        from .models import Cart, CartItem
+        quote = connection.ops.quote_name
+        return quote(Cart._meta.db_table), quote(CartItem._meta.db_table)
+
+    def _upsert(self, user_id, product_id, quantity, increment):
+        """Add ``quantity`` to (or set it as) the line's quantity; returns ``(cart_id, quantity)``"""
+        from .models import Cart, CartItem
+
+        carts, lines = self._tables()
+        new_quantity = f'{lines}.quantity + EXCLUDED.quantity' if increment else 'EXCLUDED.quantity'
+        added_at = CartItem._meta.get_field('added_at').get_db_prep_value(timezone.now(), connection)
+        sql = (
+            f'INSERT INTO {lines} (cart_id, product_id, quantity, added_at) '
+            f'SELECT id, %s, %s, %s FROM {carts} WHERE user_id = %s ORDER BY id LIMIT 1 '
+            f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {new_quantity} '
+            f'RETURNING cart_id, quantity'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [product_id, quantity, added_at, user_id])
+            row = cursor.fetchone()
+            if row is None:
+                # First line for this user: create the cart and try again.
+                Cart.objects.create(user_id=user_id)
+                cursor.execute(sql, [product_id, quantity, added_at, user_id])
+                row = cursor.fetchone()
+        return row
+
+    def _delete(self, user_id, product_id):
+        """Drop a line from every cart of the user; returns the quantity it had"""
+        carts, lines = self._tables()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {lines} WHERE product_id = %s '
+                f'AND cart_id IN (SELECT id FROM {carts} WHERE user_id = %s) RETURNING quantity',
+                [product_id, user_id],
+            )
+            return sum(quantity for quantity, in cursor.fetchall())
+
+    def _apply_user(self, user_id, op, product_id, quantity):
+        from .models import CartItem
+
+        if op == 'remove' or (op == 'set' and quantity <= 0):
+            return self._delete(user_id, product_id), 0
+        if op == 'add':
+            cart_id, new = self._upsert(user_id, product_id, quantity, increment=True)
+            previous = new - quantity
+        elif op == 'set':
+            previous = sum(CartItem.objects.filter(cart__user_id=user_id, product_id=product_id)
+                           .values_list('quantity', flat=True))
+            cart_id, new = self._upsert(user_id, product_id, quantity, increment=False)
+        else:
+            raise ValueError(f'Unknown cart operation: {op}')
+        if new <= 0:
+            CartItem.objects.filter(cart_id=cart_id, product_id=product_id, quantity__lte=0).delete()
+        return max(previous, 0), max(new, 0)
+
+    # Writing
+
+    def apply(self, key, operations):
+        """Apply ``(op, product_id, quantity)`` operations as one atomic change
+
+        ``op`` is ``'add'``, ``'set'`` or ``'remove'``. Returns ``(previous,
+        new)`` quantities, one pair per operation.
+        """
+        user_id = self._user_id(key)
+        if user_id is None:
+            return self._apply_anonymous(key, operations)
+        if len(operations) == 1:
+            # A single upsert is atomic on its own.
+            return [self._apply_user(user_id, *operations[0])]
+        with transaction.atomic():
+            return [self._apply_user(user_id, *operation) for operation in operations]
+
+    def add(self, key, product_id, quantity=1):
+        """Add ``quantity`` units of a product; returns the line's new quantity"""
+        return self.apply(key, [('add', product_id, quantity)])[0][1]
+
+    def set(self, key, product_id, quantity):
+        """Set a line's quantity; zero or less removes it"""
+        return self.apply(key, [('set', product_id, quantity)])[0][1]
+
+    def remove(self, key, product_id):
+        """Drop a line; returns the quantity it had"""
+        return self.apply(key, [('remove', product_id, 0)])[0][0]
+
+    def merge(self, anonymous_key, user_id):
+        """Fold an anonymous cart into a user's cart; returns lines merged"""
+        with self._locked(anonymous_key):
+            entry = self.cache.get(anonymous_key)
+            items = entry['items'] if entry else {}
+            if items:
+                self.apply(self.user_key(user_id),
+                           [('add', product_id, quantity) for product_id, quantity in items.items()])
+            self.cache.delete(anonymous_key)
+        return len(items)
+
+    def merge_session(self, request, user):
+        """Merge the session's anonymous cart, if any, into ``user``'s cart"""
+        token = request.session.pop(SESSION_KEY, None)
+        if token is None:
+            return 0
+        return self.merge(self.anonymous_key(token), user.pk)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_cart_store():
+    """Return the process-wide cart store"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CartStore(
+                    cache_alias=getattr(settings, 'CART_CACHE_ALIAS', 'carts'),
+                    timeout=getattr(settings, 'CART_CACHE_TIMEOUT', 14 * 24 * 3600),
+                )
+    return _store
@@ -0,0 +1,111 @@
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, Q, When
+
+
+def unit_price_expression(prefix=''):
+    """``Product.get_discounted_price`` as an SQL expression over ``<prefix>price`` fields"""
+    price = F(f'{prefix}price')
+    recommended = F(f'{prefix}ai_recommended_price')
+    return Case(
+        When(Q(**{f'{prefix}ai_recommended_price__gt': 0}) & Q(**{f'{prefix}ai_recommended_price__lt': price}),
+             then=recommended),
+        default=price,
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+class CartSummary:
+    """Line items of a cart, each with its product, plus totals
+
+    ``items`` are ``CartItem`` instances carrying ``unit_price`` and
+    ``line_total``; the totals are summed from the same rows, so building a
+    summary costs exactly one query.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.subtotal = sum((item.line_total for item in items), Decimal('0.00'))
+        self.item_count = sum(item.quantity for item in items)
+        self.line_count = len(items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return self.line_count
+
+
+def cart_items(cart_filter):
+    """Annotated line items for carts matching ``cart_filter`` (a Q on CartItem)"""
+    from .models import CartItem
+    return (CartItem.objects.filter(cart_filter)
+            .select_related('product', 'product__category')
+            .annotate(unit_price=unit_price_expression('product__'))
+            .annotate(line_total=F('unit_price') * F('quantity'))
+            .order_by('added_at', 'pk'))
+
+
+def summarize_cart(cart):
+    """Build a ``CartSummary`` for a persisted ``Cart`` (one query)"""
+    if cart is None or cart.pk is None:
+        return CartSummary([])
+    return CartSummary(list(cart_items(Q(cart=cart))))
+
+
+def summarize_quantities(quantities):
+    """Build a ``CartSummary`` from ``{product_id: quantity}`` (one query)
+
+    Lines keep the order of ``quantities``; products that no longer exist
+    are left out. The ``CartItem`` instances are not saved.
+    """
+    from .models import CartItem, Product
+    if not quantities:
+        return CartSummary([])
+    products = (Product.objects.filter(pk__in=list(quantities))
+                .select_related('category')
+                .annotate(unit_price=unit_price_expression()))
+    by_id = {product.pk: product for product in products}
+    items = []
+    for product_id, quantity in quantities.items():
+        product = by_id.get(product_id)
+        if product is None:
+            continue
+        item = CartItem(product=product, quantity=quantity)
+        item.unit_price = product.unit_price
+        item.line_total = product.unit_price * quantity
+        items.append(item)
+    return CartSummary(items)
+
+
+def get_cart_summary(request):
+    """The current visitor's cart summary, computed at most once per request"""
+    summary = getattr(request, '_cart_summary', None)
+    if summary is None:
+        from .cart_store import get_cart_store
+        store = get_cart_store()
+        summary = summarize_quantities(store.items(store.key_for(request)))
+        request._cart_summary = summary
+    return summary
+
+
+def invalidate_cart_summary(request):
+    """Forget the memoized summary after the cart changed in this request"""
+    request.__dict__.pop('_cart_summary', None)
+
+
+def cart_item_count(request):
+    """Units in the current visitor's cart, for the navbar badge
+
+    Reuses the request's summary when one was already built; otherwise the
+    count comes straight from the cart store without touching the database.
+    """
+    summary = getattr(request, '_cart_summary', None)
+    if summary is not None:
+        return summary.item_count
+    from .cart_store import get_cart_store
+    store = get_cart_store()
+    return sum(store.items(store.key_for(request)).values())
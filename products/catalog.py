@@ -0,0 +1,150 @@
+import csv
+import os
+import threading
+import time
+from bisect import bisect_right
+
+from django.conf import settings
+
+
+class TxtCatalog:
+    """In-process, loaded-once view of products.txt
+
+    Rows are held as parallel tuples (name, price, image URL) together with a
+    single lowercase blob of all names, so page renders and searches never
+    re-read the CSV. The file is re-stat'ed at most once per
+    ``recheck_interval`` seconds and reloaded only when its inode, size or
+    mtime changes.
+    """
+
+    def __init__(self, path, recheck_interval=2.0):
+        self.path = path
+        self.recheck_interval = recheck_interval
+        self._lock = threading.Lock()
+        # A missing file has signature None too, so "never checked" is
+        # tracked by the check time alone and a missing file is throttled.
+        self._signature = None
+        self._checked_at = None
+        self._reset()
+
+    def _reset(self):
+        self._data = ((), (), (), '', ())
+
+    @property
+    def names(self):
+        self._refresh()
+        return self._data[0]
+
+    @property
+    def prices(self):
+        self._refresh()
+        return self._data[1]
+
+    @property
+    def image_urls(self):
+        self._refresh()
+        return self._data[2]
+
+    def __len__(self):
+        self._refresh()
+        return len(self._data[0])
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _is_fresh(self, now):
+        return self._checked_at is not None and now - self._checked_at < self.recheck_interval
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._is_fresh(now):
+            return
+        with self._lock:
+            if self._is_fresh(now):
+                return
+            signature = self._stat_signature()
+            if signature != self._signature:
+                self._load()
+                self._signature = signature
+            self._checked_at = now
+
+    def _load(self):
+        names, prices, image_urls = [], [], []
+        try:
+            with open(self.path, encoding='utf-8-sig') as f:
+                for row in csv.DictReader(f):
+                    names.append((row.get('Item Name') or '').strip())
+                    prices.append((row.get('Price (INR)') or '').strip())
+                    image_urls.append((row.get('Image URL') or '').strip())
+        except (OSError, csv.Error, UnicodeDecodeError):
+            self._reset()
+            return
+
+        # One newline-joined lowercase blob plus the start offset of every
+        # name lets a substring search run as repeated str.find() calls.
+        lowered = [name.lower() for name in names]
+        offsets = []
+        position = 0
+        for name in lowered:
+            offsets.append(position)
+            position += len(name) + 1
+
+        # Swap the whole snapshot in one assignment so concurrent readers
+        # never see arrays from two different loads.
+        self._data = (
+            tuple(names), tuple(prices), tuple(image_urls),
+            '\n'.join(lowered), tuple(offsets),
+        )
+
+    @staticmethod
+    def _row(data, index):
+        return {
+            'name': data[0][index],
+            'price': data[1][index],
+            'image_url': data[2][index],
+        }
+
+    def all(self):
+        """Return every row as a template-friendly dict"""
+        self._refresh()
+        data = self._data
+        return [self._row(data, i) for i in range(len(data[0]))]
+
+    def search(self, query):
+        """Return rows whose name contains ``query`` (case-insensitive)"""
+        self._refresh()
+        needle = query.lower()
+        if not needle or '\n' in needle:
+            return []
+        data = self._data
+        blob, offsets = data[3], data[4]
+        matches = []
+        start = blob.find(needle)
+        while start != -1:
+            index = bisect_right(offsets, start) - 1
+            matches.append(self._row(data, index))
+            # Skip to the next name so a row is reported at most once.
+            next_start = offsets[index + 1] if index + 1 < len(offsets) else len(blob)
+            start = blob.find(needle, next_start)
+        return matches
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Return the process-wide products.txt catalog"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = TxtCatalog(
+                    os.path.join(settings.BASE_DIR, 'products.txt'),
+                    recheck_interval=getattr(settings, 'PRODUCTS_TXT_RECHECK_SECONDS', 2.0),
+                )
+    return _catalog
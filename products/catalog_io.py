@@ -0,0 +1,302 @@
+import csv
+import hashlib
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils.text import slugify
+
+# Columns understood by import/export, in export order. ``category`` is a
+# category slug; products.txt's own headers are accepted as aliases.
+COLUMNS = ('sku', 'name', 'description', 'price', 'original_price', 'stock',
+           'category', 'image_url', 'is_active')
+ALIASES = {
+    'item name': 'name',
+    'price (inr)': 'price',
+    'image url': 'image_url',
+}
+DEFAULT_CATEGORY = 'uncategorized'
+DERIVED_SKU_PREFIX = 'TXT-'
+CHUNK_SIZE = 2000
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'jsonl' if str(path).lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def derived_sku(name):
+    """Stable SKU for rows that do not carry one (e.g. products.txt)"""
+    return DERIVED_SKU_PREFIX + hashlib.sha1(name.strip().lower().encode()).hexdigest()[:12].upper()
+
+
+def _normalize_key(key):
+    key = (key or '').strip().lower()
+    return ALIASES.get(key, key)
+
+
+def iter_rows(path, fmt=None):
+    """Yield ``(line_number, row_dict)`` from a CSV or JSONL file, streaming"""
+    fmt = detect_format(path, fmt)
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if fmt == 'jsonl':
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        data = json.loads(line)
+                    except ValueError as exc:
+                        yield number, RowError(f'invalid JSON: {exc}')
+                        continue
+                    if not isinstance(data, dict):
+                        yield number, RowError(f'expected a JSON object, got {type(data).__name__}')
+                        continue
+                    yield number, {_normalize_key(k): v for k, v in data.items()}
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, {_normalize_key(k): v for k, v in row.items() if k is not None}
+
+
+def _decimal(value, column, required=False):
+    if value is None or str(value).strip() == '':
+        if required:
+            raise RowError(f'{column} is required')
+        return None
+    try:
+        number = Decimal(str(value).replace(',', '').replace('₹', '').strip())
+    except InvalidOperation:
+        raise RowError(f'{column} is not a number: {value!r}')
+    if not number.is_finite():
+        raise RowError(f'{column} is not a finite number: {value!r}')
+    # Check against the column here, so one bad row does not fail the
+    # whole chunk's bulk write.
+    from .models import Product
+    field = Product._meta.get_field(column)
+    try:
+        number = number.quantize(Decimal(1).scaleb(-field.decimal_places))
+    except InvalidOperation:
+        number = None
+    if number is None or abs(number) >= Decimal(10) ** (field.max_digits - field.decimal_places):
+        raise RowError(f'{column} is out of range: {value!r}')
+    return number
+
+
+def _text(value, column):
+    from .models import Product
+    limit = Product._meta.get_field(column).max_length
+    if len(value) > limit:
+        raise RowError(f'{column} is longer than {limit} characters: {value[:limit]!r}...')
+    return value
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'n', '')
+
+
+def clean_row(row):
+    """Turn a raw row into Product field values; raises ``RowError``"""
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise RowError('name is required')
+    values = {
+        'sku': _text(str(row.get('sku') or '').strip() or derived_sku(name), 'sku'),
+        'name': name[:200],
+        'price': _decimal(row.get('price'), 'price', required=True),
+    }
+    if 'description' in row:
+        values['description'] = str(row['description'] or '')
+    if 'original_price' in row:
+        values['original_price'] = _decimal(row['original_price'], 'original_price')
+    if 'stock' in row:
+        try:
+            values['stock'] = int(str(row['stock'] or 0).strip() or 0)
+        except ValueError:
+            raise RowError(f'stock is not an integer: {row["stock"]!r}')
+    if 'image_url' in row:
+        values['image_url'] = _text(str(row['image_url'] or '').strip(), 'image_url') or None
+    if 'is_active' in row:
+        values['is_active'] = _bool(row['is_active'])
+    category = slugify(str(row.get('category') or ''))
+    if category:
+        values['category'] = category
+    return values
+
+
+class Checkpoint:
+    """Rows already committed for one source file, stored next to it as JSON"""
+
+    def __init__(self, path, source):
+        self.path = path
+        st = os.stat(source)
+        self.signature = {'source': os.path.abspath(source), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+    def load(self):
+        """Rows to skip, or 0 when there is no matching checkpoint"""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if {key: data.get(key) for key in self.signature} != self.signature:
+            return 0
+        return int(data.get('rows', 0))
+
+    def save(self, rows):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict(self.signature, rows=rows), f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class CatalogImporter:
+    """Upsert products from a row stream, keyed by SKU, one chunk at a time
+
+    Each chunk is written with ``INSERT ... ON CONFLICT (sku) DO UPDATE``
+    inside its own transaction, after which the checkpoint records how many source
+    rows are done, so an interrupted import resumes at the next chunk. Only
+    the columns present in the file are overwritten on existing products.
+    """
+
+    def __init__(self, default_category=DEFAULT_CATEGORY, chunk_size=CHUNK_SIZE):
+        self.default_category = default_category
+        self.chunk_size = chunk_size
+        self._category_ids = {}
+        self.stats = {'rows': 0, 'upserted': 0, 'skipped': 0}
+        self.errors = []
+
+    def _categories(self, slugs):
+        """Map slugs to ids, creating missing categories"""
+        from .models import Category
+        missing = set(slugs) - set(self._category_ids)
+        if missing:
+            for category in Category.objects.filter(slug__in=missing).only('id', 'slug'):
+                self._category_ids[category.slug] = category.pk
+            for slug in sorted(missing - set(self._category_ids)):
+                # save() maintains the materialized path, so no bulk_create here.
+                category = Category(slug=slug, name=slug.replace('-', ' ').title())
+                category.save()
+                self._category_ids[slug] = category.pk
+        return self._category_ids
+
+    def write_chunk(self, rows):
+        from .models import Product
+        by_sku = {}
+        for values in rows:
+            by_sku[values['sku']] = values  # last row for a SKU wins
+        category_ids = self._categories(
+            {values.get('category', self.default_category) for values in by_sku.values()}
+        )
+
+        # Rows are grouped by the columns they carry so a missing column never
+        # overwrites an existing product's value with the model default.
+        groups = {}
+        for values in by_sku.values():
+            groups.setdefault(frozenset(values), []).append(values)
+        with transaction.atomic():
+            for columns, group in groups.items():
+                update_fields = {column for column in columns if column != 'sku'} | {'updated_at'}
+                products = []
+                for values in group:
+                    values = dict(values)
+                    slug = values.pop('category', self.default_category)
+                    products.append(Product(category_id=category_ids[slug], **values))
+                Product.objects.bulk_create(
+                    products,
+                    update_conflicts=True,
+                    unique_fields=['sku'],
+                    update_fields=sorted(update_fields),
+                )
+            # The upsert bypasses post_save, which keeps checkout's stock
+            # shards in line with Product.stock; resync them here instead.
+            stock_skus = [values['sku'] for values in by_sku.values() if 'stock' in values]
+            if stock_skus:
+                from orders.inventory import resync
+                resync(Product.objects.filter(sku__in=stock_skus).values('pk'))
+        return len(by_sku)
+
+    def run(self, rows, skip=0, on_chunk=None):
+        """Import ``(line_number, row)`` pairs, skipping the first ``skip``
+
+        ``on_chunk(rows_done)`` is called after each committed chunk.
+        """
+        chunk = []
+        done = 0
+        for line_number, row in rows:
+            done += 1
+            if done <= skip:
+                continue
+            self.stats['rows'] += 1
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                chunk.append(clean_row(row))
+            except RowError as exc:
+                self.stats['skipped'] += 1
+                self.errors.append((line_number, str(exc)))
+            if len(chunk) >= self.chunk_size:
+                self.stats['upserted'] += self.write_chunk(chunk)
+                chunk = []
+                if on_chunk:
+                    on_chunk(done)
+        if chunk:
+            self.stats['upserted'] += self.write_chunk(chunk)
+        if on_chunk:
+            on_chunk(done)
+        return self.stats
+
+
+def export_rows(queryset=None, chunk_size=CHUNK_SIZE):
+    """Yield product rows as dicts in ``COLUMNS`` order, streaming from the DB"""
+    from .models import Product
+    if queryset is None:
+        queryset = Product.objects.all()
+    fields = ('sku', 'name', 'description', 'price', 'original_price', 'stock',
+              'category__slug', 'image_url', 'is_active')
+    for values in queryset.order_by('pk').values_list(*fields).iterator(chunk_size=chunk_size):
+        yield dict(zip(COLUMNS, values))
+
+
+def write_rows(rows, f, fmt='csv'):
+    """Write exported rows to an open text file; returns the row count"""
+    count = 0
+    if fmt == 'jsonl':
+        for row in rows:
+            f.write(json.dumps(row, default=str, ensure_ascii=False))
+            f.write('\n')
+            count += 1
+    else:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(['' if row[column] is None else row[column] for column in COLUMNS])
+            count += 1
+    return count
+
+
+class Throughput:
+    """rows/sec since construction"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def rate(self, rows):
+        elapsed = self.elapsed()
+        return rows / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .carts import cart_item_count
+
+
+def cart(request):
+    """``cart_count`` for the navbar badge, queried only if a template uses it"""
+    return {'cart_count': SimpleLazyObject(lambda: cart_item_count(request))}
@@ -0,0 +1,139 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """Write-behind product view counter
+
+    ``increment`` only bumps an in-process dict (sharded by product id so
+    concurrent requests rarely contend on the same lock). A background thread
+    periodically drains the shards and applies the totals as a handful of
+    ``UPDATE ... SET views_count = views_count + n`` statements, grouped by
+    ``n``, and adds the same numbers to today's ``ProductAnalytics.views``.
+    Because the flush only ever adds deltas, several processes can run their
+    own counters against the same database without losing updates. Pending
+    counts are flushed once more at interpreter exit.
+
+    With ``flush_interval <= 0`` every increment is written immediately,
+    which keeps tests and one-off scripts deterministic.
+    """
+
+    def __init__(self, flush_interval=5.0, shards=16):
+        self.flush_interval = flush_interval
+        self._shards = [(threading.Lock(), {}) for _ in range(shards)]
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def increment(self, product_id, n=1):
+        lock, counts = self._shards[product_id % len(self._shards)]
+        with lock:
+            counts[product_id] = counts.get(product_id, 0) + n
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_thread()
+
+    def pending(self, product_id):
+        """Views counted in this process but not yet written"""
+        lock, counts = self._shards[product_id % len(self._shards)]
+        with lock:
+            return counts.get(product_id, 0)
+
+    def _drain(self):
+        drained = {}
+        for lock, counts in self._shards:
+            with lock:
+                snapshot = dict(counts)
+                counts.clear()
+            for product_id, n in snapshot.items():
+                drained[product_id] = drained.get(product_id, 0) + n
+        return drained
+
+    def _restore(self, drained):
+        for product_id, n in drained.items():
+            lock, counts = self._shards[product_id % len(self._shards)]
+            with lock:
+                counts[product_id] = counts.get(product_id, 0) + n
+
+    def flush(self):
+        """Write every pending count; returns the number of views flushed"""
+        from .models import Product
+        from analytics.models import ProductAnalytics
+
+        with self._flush_lock:
+            drained = self._drain()
+            if not drained:
+                return 0
+            today = timezone.localdate()
+            try:
+                # Products deleted since they were viewed have nothing to update.
+                existing = set(Product.objects.filter(pk__in=drained).values_list('pk', flat=True))
+                drained = {pk: n for pk, n in drained.items() if pk in existing}
+                by_delta = {}
+                for product_id, n in drained.items():
+                    by_delta.setdefault(n, []).append(product_id)
+                with transaction.atomic():
+                    ProductAnalytics.objects.bulk_create(
+                        [ProductAnalytics(product_id=pk, date=today) for pk in drained],
+                        ignore_conflicts=True,
+                    )
+                    for n, product_ids in by_delta.items():
+                        # QuerySet.update() leaves updated_at alone, which is
+                        # exactly what a view should do.
+                        Product.objects.filter(pk__in=product_ids).update(views_count=F('views_count') + n)
+                        ProductAnalytics.objects.filter(product_id__in=product_ids, date=today).update(
+                            views=F('views') + n
+                        )
+            except Exception:
+                self._restore(drained)
+                raise
+            return sum(drained.values())
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='view-counter-flush', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing product view counts failed; will retry')
+            finally:
+                connection.close()
+
+    def stop(self):
+        """Stop the flusher thread and write whatever is still pending"""
+        self._stopped.set()
+        self.flush()
+
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+def get_view_counter():
+    """Return the process-wide product view counter"""
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                _counter = ViewCounter(
+                    flush_interval=getattr(settings, 'VIEW_COUNTER_FLUSH_SECONDS', 5.0),
+                )
+    return _counter
@@ -0,0 +1,247 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Put on the queue by ``stop`` to wake a writer waiting for more events.
+_WAKE = object()
+
+
+class BehaviorEventQueue:
+    """Buffered, bulk-inserted ``UserBehavior`` pipeline
+
+    Request handlers call ``record`` which only puts a small tuple on a
+    bounded queue. A background thread drains the queue and writes events
+    with ``bulk_create`` whenever ``batch_size`` events are waiting or
+    ``flush_interval`` seconds have passed since the first one arrived.
+
+    When the queue is full the producer waits at most ``put_timeout``
+    seconds and then drops the event, so a slow database can never stall
+    page rendering; drops are counted in ``stats()``. Whatever is still
+    queued is written at interpreter exit.
+
+    A write that fails because the database is unreachable or locked is
+    retried up to ``max_attempts`` times with exponential backoff starting
+    at ``retry_backoff`` seconds; if it still fails the batch goes back on
+    the queue as far as there is room, to be written with a later batch.
+    Any other error (a bad row) fails the batch at once. Lost events are
+    counted as ``failed``.
+
+    With ``flush_interval <= 0`` every event is written synchronously.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=2.0, max_queue=50000, put_timeout=0.0,
+                 max_attempts=3, retry_backoff=0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'retried': 0, 'requeued': 0}
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, queued=self._queue.qsize())
+
+    def record(self, user_id, behavior_type, product_id=None, session_id='', metadata=None):
+        """Queue one event; returns False if it had to be dropped"""
+        event = (user_id, product_id, behavior_type, timezone.now(), session_id, metadata or {})
+        if self.flush_interval <= 0:
+            self._count('enqueued')
+            self._write([event])
+            return True
+        self._ensure_thread()
+        try:
+            if self.put_timeout > 0:
+                self._queue.put(event, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(event)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+
+    def _insert(self, events):
+        from .models import Product, UserBehavior
+
+        # A product deleted while its event was queued would fail the whole
+        # batch on the foreign key; keep the event, drop the link.
+        product_ids = {event[1] for event in events if event[1] is not None}
+        if product_ids:
+            product_ids = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        UserBehavior.objects.bulk_create([
+            UserBehavior(
+                user_id=user_id,
+                product_id=product_id if product_id in product_ids else None,
+                behavior_type=behavior_type,
+                timestamp=timestamp,
+                session_id=session_id,
+                metadata=metadata,
+            )
+            for user_id, product_id, behavior_type, timestamp, session_id, metadata in events
+        ], batch_size=self.batch_size)
+
+    def _write(self, events):
+        """Insert a batch, retrying transient database errors; returns True if written"""
+        with self._write_lock:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    self._insert(events)
+                except (OperationalError, InterfaceError):
+                    logger.warning('Writing %d behavior events failed (attempt %d of %d)',
+                                   len(events), attempt, self.max_attempts, exc_info=True)
+                    if not connection.in_atomic_block:
+                        # Let the next attempt reconnect if the connection broke.
+                        connection.close_if_unusable_or_obsolete()
+                    if attempt < self.max_attempts:
+                        self._count('retried')
+                        self._stopped.wait(self.retry_backoff * 2 ** (attempt - 1))
+                except Exception:
+                    logger.exception('Writing %d behavior events failed', len(events))
+                    break
+                else:
+                    self._count('written', len(events))
+                    return True
+            else:
+                # Only the background writer drains the queue, and not once stopped.
+                if self.flush_interval > 0 and not self._stopped.is_set():
+                    self._requeue(events)
+                    return False
+            self._count('failed', len(events))
+            return False
+
+    def _requeue(self, events):
+        """Put a failed batch back on the queue; what does not fit is lost"""
+        requeued = 0
+        for event in events:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                break
+            requeued += 1
+        self._count('requeued', requeued)
+        if requeued < len(events):
+            self._count('failed', len(events) - requeued)
+            logger.error('Dropped %d behavior events; the queue is full', len(events) - requeued)
+
+    def _take_batch(self, timeout):
+        """Block for the first event, then collect until full or timed out"""
+        try:
+            event = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        if event is _WAKE:
+            return []
+        batch = [event]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopped.is_set():
+                break
+            try:
+                event = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if event is _WAKE:
+                break
+            batch.append(event)
+        return batch
+
+    def _drain_all(self):
+        batch = []
+        while True:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+            if event is not _WAKE:
+                batch.append(event)
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='behavior-events', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._take_batch(timeout=self.flush_interval)
+            if batch:
+                try:
+                    self._write(batch)
+                finally:
+                    connection.close()
+
+    def flush(self):
+        """Synchronously write everything queued so far"""
+        batch = self._drain_all()
+        for start in range(0, len(batch), self.batch_size):
+            self._write(batch[start:start + self.batch_size])
+        return len(batch)
+
+    def stop(self, timeout=5.0):
+        """Stop the background writer and flush what is left"""
+        self._stopped.set()
+        if self._thread is not None:
+            try:
+                self._queue.put_nowait(_WAKE)
+            except queue.Full:
+                pass  # a full queue never leaves the writer waiting
+            self._thread.join(timeout)
+        self.flush()
+
+
+_events = None
+_events_lock = threading.Lock()
+
+
+def get_event_queue():
+    """Return the process-wide behavior event queue"""
+    global _events
+    if _events is None:
+        with _events_lock:
+            if _events is None:
+                _events = BehaviorEventQueue(
+                    batch_size=getattr(settings, 'BEHAVIOR_EVENT_BATCH_SIZE', 500),
+                    flush_interval=getattr(settings, 'BEHAVIOR_EVENT_FLUSH_SECONDS', 2.0),
+                    max_queue=getattr(settings, 'BEHAVIOR_EVENT_QUEUE_SIZE', 50000),
+                    max_attempts=getattr(settings, 'BEHAVIOR_EVENT_MAX_ATTEMPTS', 3),
+                    retry_backoff=getattr(settings, 'BEHAVIOR_EVENT_RETRY_SECONDS', 0.5),
+                )
+    return _events
+
+
+def track_behavior(request, behavior_type, product=None, metadata=None):
+    """Record a behavior event for the request's user, if logged in"""
+    if not request.user.is_authenticated:
+        return
+    session_id = request.session.session_key or str(uuid.uuid4())
+    get_event_queue().record(
+        request.user.pk,
+        behavior_type,
+        product_id=product.pk if product is not None else None,
+        session_id=session_id,
+        metadata=metadata,
+    )
@@ -0,0 +1,282 @@
+from decimal import Decimal
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+# (label, lower bound inclusive, upper bound exclusive) in INR
+PRICE_BANDS = (
+    ('Under ₹1,000', None, Decimal('1000')),
+    ('₹1,000 - ₹5,000', Decimal('1000'), Decimal('5000')),
+    ('₹5,000 - ₹20,000', Decimal('5000'), Decimal('20000')),
+    ('₹20,000 - ₹50,000', Decimal('20000'), Decimal('50000')),
+    ('Over ₹50,000', Decimal('50000'), None),
+)
+
+# Rating facets are "N stars & up"; products are stored by whole-star floor.
+RATING_FILTERS = (4, 3, 2, 1)
+
+FACET_FIELDS = ('category_id', 'price', 'rating_average', 'stock', 'is_active')
+
+
+def price_band(price):
+    for band, (_, low, high) in enumerate(PRICE_BANDS):
+        if (low is None or price >= low) and (high is None or price < high):
+            return band
+    return len(PRICE_BANDS) - 1
+
+
+def rating_bucket(rating):
+    return max(0, min(5, int(rating or 0)))
+
+
+def facet_cell(product):
+    """Return the facet cube cell a product is counted in, or ``None``"""
+    if not product.is_active:
+        return None
+    return (product.category_id, price_band(Decimal(product.price)),
+            rating_bucket(product.rating_average), product.stock > 0)
+
+
+def _cell_filter(cell):
+    category_id, band, bucket, in_stock = cell
+    return dict(category_id=category_id, price_band=band, rating_bucket=bucket, in_stock=in_stock)
+
+
+def _adjust(cell, delta):
+    from .models import ProductFacetCount
+    updated = ProductFacetCount.objects.filter(**_cell_filter(cell)).update(count=F('count') + delta)
+    if not updated:
+        ProductFacetCount.objects.bulk_create(
+            [ProductFacetCount(**_cell_filter(cell), count=0)], ignore_conflicts=True
+        )
+        ProductFacetCount.objects.filter(**_cell_filter(cell)).update(count=F('count') + delta)
+
+
+def remember_facet_cell(product):
+    """Note the cell a product is stored in before it is saved or deleted (pre hook)
+
+    The stored row's facet columns are read with one single-row query, only
+    when a product is written; loading products costs nothing extra. After a
+    save the instance knows its new cell, so saving it again reads nothing.
+    """
+    if hasattr(product, '_facet_cell') or product.pk is None:
+        return
+    from .models import Product
+    row = Product.objects.filter(pk=product.pk).values(*FACET_FIELDS).first()
+    product._facet_cell = facet_cell(SimpleNamespace(**row)) if row else None
+
+
+def record_product_change(product, created):
+    """Move a saved product between facet cells (post_save hook)"""
+    new_cell = facet_cell(product)
+    old_cell = None if created else getattr(product, '_facet_cell', None)
+    if old_cell != new_cell:
+        with transaction.atomic():
+            if old_cell is not None:
+                _adjust(old_cell, -1)
+            if new_cell is not None:
+                _adjust(new_cell, 1)
+    product._facet_cell = new_cell
+
+
+def record_product_delete(product):
+    """Remove a deleted product from its facet cell (post_delete hook)"""
+    if getattr(product, '_facet_cell', None) is not None:
+        _adjust(product._facet_cell, -1)
+
+
+def rebuild_facet_counts():
+    """Recompute the whole facet cube with one GROUP BY over active products"""
+    from .models import Product, ProductFacetCount
+    band_whens = []
+    for band, (_, low, high) in enumerate(PRICE_BANDS[:-1]):
+        band_whens.append(When(price__lt=high, then=Value(band)))
+    bucket_whens = [When(rating_average__gte=stars, then=Value(stars)) for stars in (5, 4, 3, 2, 1)]
+    rows = (Product.objects.filter(is_active=True)
+            .annotate(
+                band=Case(*band_whens, default=Value(len(PRICE_BANDS) - 1), output_field=IntegerField()),
+                bucket=Case(*bucket_whens, default=Value(0), output_field=IntegerField()),
+                has_stock=Case(When(stock__gt=0, then=Value(1)), default=Value(0), output_field=IntegerField()),
+            )
+            .values('category_id', 'band', 'bucket', 'has_stock')
+            .annotate(total=Count('id'))
+            .order_by())
+    cells = [
+        ProductFacetCount(category_id=row['category_id'], price_band=row['band'],
+                          rating_bucket=row['bucket'], in_stock=bool(row['has_stock']),
+                          count=row['total'])
+        for row in rows
+    ]
+    with transaction.atomic():
+        ProductFacetCount.objects.all().delete()
+        ProductFacetCount.objects.bulk_create(cells, batch_size=1000)
+
+
+class CategoryTree:
+    """Every category, loaded with one query, with subtree lookups"""
+
+    def __init__(self, rows):
+        self.rows = {row['id']: row for row in rows}
+        self.slugs = {row['slug']: row for row in self.rows.values()}
+        self.children = {}
+        for row in self.rows.values():
+            self.children.setdefault(row['parent_id'], []).append(row)
+        self._subtrees = {}
+
+    @classmethod
+    def load(cls):
+        from .models import Category
+        return cls(Category.objects.order_by('name').values('id', 'name', 'slug', 'parent_id'))
+
+    @classmethod
+    def from_categories(cls, categories):
+        """Build the tree from already-fetched ``Category`` instances"""
+        return cls({'id': c.id, 'name': c.name, 'slug': c.slug, 'parent_id': c.parent_id}
+                   for c in categories)
+
+    def by_slug(self, slug):
+        return self.slugs.get(slug)
+
+    def subtree_ids(self, pk):
+        """Return ``pk`` and the ids of all of its descendants"""
+        if pk not in self._subtrees:
+            ids, stack = set(), [pk]
+            while stack:
+                current = stack.pop()
+                if current not in ids:
+                    ids.add(current)
+                    stack.extend(row['id'] for row in self.children.get(current, ()))
+            self._subtrees[pk] = ids
+        return self._subtrees[pk]
+
+    def roots_and_children(self, selected):
+        """Categories to offer next: the roots, or the selection and its children"""
+        if selected is None:
+            return self.children.get(None, [])
+        return [selected] + self.children.get(selected['id'], [])
+
+
+class FacetFilters:
+    """Facet selections parsed from a request's query string"""
+
+    def __init__(self, params, categories):
+        self.categories = categories
+        self.category = categories.by_slug(params.get('category', ''))
+        self.price_band = self._choice(params.get('price'), range(len(PRICE_BANDS)))
+        self.min_rating = self._choice(params.get('rating'), RATING_FILTERS)
+        self.in_stock = params.get('in_stock') == '1'
+
+    @staticmethod
+    def _choice(raw, allowed):
+        try:
+            value = int(raw)
+        except (TypeError, ValueError):
+            return None
+        return value if value in allowed else None
+
+    def params(self, **overrides):
+        """Return the active selections as query parameters"""
+        params = {
+            'category': self.category['slug'] if self.category else None,
+            'price': self.price_band,
+            'rating': self.min_rating,
+            'in_stock': 1 if self.in_stock else None,
+        }
+        params.update(overrides)
+        return {key: value for key, value in params.items() if value is not None}
+
+    def query(self, **overrides):
+        return urlencode(self.params(**overrides))
+
+    def apply(self, queryset):
+        if self.category is not None:
+            queryset = queryset.filter(category_id__in=self.categories.subtree_ids(self.category['id']))
+        if self.price_band is not None:
+            _, low, high = PRICE_BANDS[self.price_band]
+            if low is not None:
+                queryset = queryset.filter(price__gte=low)
+            if high is not None:
+                queryset = queryset.filter(price__lt=high)
+        if self.min_rating is not None:
+            queryset = queryset.filter(rating_average__gte=self.min_rating)
+        if self.in_stock:
+            queryset = queryset.filter(stock__gt=0)
+        return queryset
+
+    def _matches(self, cell, skip):
+        category_id, band, bucket, in_stock = cell
+        if skip != 'category' and self.category is not None \
+                and category_id not in self.categories.subtree_ids(self.category['id']):
+            return False
+        if skip != 'price' and self.price_band is not None and band != self.price_band:
+            return False
+        if skip != 'rating' and self.min_rating is not None and bucket < self.min_rating:
+            return False
+        if skip != 'in_stock' and self.in_stock and not in_stock:
+            return False
+        return True
+
+    def counts(self):
+        """Return facet counts for the current selection
+
+        Counts come from the precomputed cube (one small query, independent of
+        catalog size). Each facet is counted with every *other* active filter
+        applied, so the numbers show what selecting that option would return.
+        """
+        from .models import ProductFacetCount
+        cells = list(ProductFacetCount.objects.filter(count__gt=0).values_list(
+            'category_id', 'price_band', 'rating_bucket', 'in_stock', 'count'))
+
+        direct = {}
+        for *cell, count in cells:
+            if self._matches(cell, 'category'):
+                direct[cell[0]] = direct.get(cell[0], 0) + count
+        category_counts = []
+        for category in self.categories.roots_and_children(self.category):
+            total = sum(direct.get(pk, 0) for pk in self.categories.subtree_ids(category['id']))
+            if total:
+                selected = self.category is not None and category['id'] == self.category['id']
+                category_counts.append(dict(
+                    category, count=total, selected=selected,
+                    query=self.query(category=None if selected else category['slug']),
+                ))
+
+        price_counts = [0] * len(PRICE_BANDS)
+        rating_counts = dict.fromkeys(RATING_FILTERS, 0)
+        in_stock_count = 0
+        total = 0
+        for *cell, count in cells:
+            _, band, bucket, in_stock = cell
+            if self._matches(cell, 'price'):
+                price_counts[band] += count
+            if self._matches(cell, 'rating'):
+                for stars in RATING_FILTERS:
+                    if bucket >= stars:
+                        rating_counts[stars] += count
+            if self._matches(cell, 'in_stock') and in_stock:
+                in_stock_count += count
+            if self._matches(cell, None):
+                total += count
+
+        # Every option links to the current selection with that option
+        # toggled, so picking a selected option again clears it.
+        return {
+            'total': total,
+            'categories': category_counts,
+            'prices': [
+                {'label': label, 'count': price_counts[band], 'selected': band == self.price_band,
+                 'query': self.query(price=None if band == self.price_band else band)}
+                for band, (label, _, _) in enumerate(PRICE_BANDS) if price_counts[band]
+            ],
+            'ratings': [
+                {'stars': stars, 'count': rating_counts[stars], 'selected': stars == self.min_rating,
+                 'query': self.query(rating=None if stars == self.min_rating else stars)}
+                for stars in RATING_FILTERS if rating_counts[stars]
+            ],
+            'in_stock': {
+                'count': in_stock_count, 'selected': self.in_stock,
+                'query': self.query(in_stock=None if self.in_stock else 1),
+            },
+        }
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+import requests
+
+
+@dataclass
+class FetchResult:
+    url: str
+    status: str  # fetched, not_modified, fresh, invalid or error
+    http_status: int = None
+    path: str = None
+    size: int = 0
+    error: str = ''
+    elapsed: float = 0.0
+
+
+class ImageFetcher:
+    """Download image URLs concurrently into a disk cache keyed by URL hash
+
+    A bounded thread pool does the work and a semaphore per host caps how
+    many requests hit any one server at a time; URLs are queued round-robin
+    across hosts so one slow host does not tie up every worker. Cached
+    entries keep the response's ETag and Last-Modified and are revalidated
+    with a conditional GET, so unchanged images cost a 304 and no body.
+    Entries younger than ``max_age`` seconds are not re-requested at all.
+    """
+
+    def __init__(self, cache_dir, max_workers=8, per_host=2, timeout=10.0, max_age=0,
+                 max_bytes=10 * 1024 * 1024, user_agent='ecommerce-image-fetcher/1.0'):
+        self.cache_dir = str(cache_dir)
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.user_agent = user_agent
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+        self._local = threading.local()
+
+    def cache_paths(self, url):
+        """``(body path, metadata path)`` for a URL"""
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        base = os.path.join(self.cache_dir, digest[:2], digest)
+        return base + '.body', base + '.json'
+
+    def cached_metadata(self, url):
+        body, meta = self.cache_paths(url)
+        try:
+            with open(meta) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data if os.path.exists(body) else None
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            # requests.Session is not thread-safe; each worker keeps its own
+            # so connections are still reused across that worker's requests.
+            session = self._local.session = requests.Session()
+            session.headers['User-Agent'] = self.user_agent
+        return session
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    @staticmethod
+    def _write_atomic(path, chunks):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        size = 0
+        try:
+            with open(tmp, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return size
+
+    def _limited(self, response):
+        size = 0
+        for chunk in response.iter_content(64 * 1024):
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise ValueError(f'larger than {self.max_bytes} bytes')
+            yield chunk
+
+    def fetch(self, url):
+        """Fetch one URL into the cache; never raises"""
+        started = time.monotonic()
+        body_path, meta_path = self.cache_paths(url)
+        cached = self.cached_metadata(url)
+
+        def result(status, **kwargs):
+            return FetchResult(url, status, elapsed=time.monotonic() - started, **kwargs)
+
+        if cached and self.max_age and time.time() - cached.get('fetched_at', 0) < self.max_age:
+            return result('fresh', path=body_path, size=cached.get('size', 0))
+
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        try:
+            with self._host_slot(url):
+                with self._session().get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                    if response.status_code == 304 and cached:
+                        cached['fetched_at'] = time.time()
+                        self._write_atomic(meta_path, [json.dumps(cached).encode()])
+                        return result('not_modified', http_status=304, path=body_path, size=cached.get('size', 0))
+                    if response.status_code != 200:
+                        return result('error', http_status=response.status_code, error=response.reason or '')
+                    content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+                    if not content_type.startswith('image/'):
+                        return result('invalid', http_status=200, error=f'content type {content_type or "missing"}')
+                    size = self._write_atomic(body_path, self._limited(response))
+                    metadata = {
+                        'url': url,
+                        'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified'),
+                        'content_type': content_type,
+                        'size': size,
+                        'fetched_at': time.time(),
+                    }
+                    self._write_atomic(meta_path, [json.dumps(metadata).encode()])
+                    return result('fetched', http_status=200, path=body_path, size=size)
+        except (requests.RequestException, OSError, ValueError) as exc:
+            return result('error', error=str(exc))
+
+    @staticmethod
+    def interleave(urls):
+        """Order URLs round-robin by host, dropping duplicates"""
+        by_host = OrderedDict()
+        for url in dict.fromkeys(urls):
+            by_host.setdefault(urlsplit(url).netloc.lower(), []).append(url)
+        queues = list(by_host.values())
+        ordered = []
+        for index in range(max(map(len, queues), default=0)):
+            ordered.extend(queue[index] for queue in queues if index < len(queue))
+        return ordered
+
+    def fetch_all(self, urls, on_result=None):
+        """Fetch every URL; results come back in the interleaved request order"""
+        ordered = self.interleave(url for url in urls if url)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='image-fetch') as pool:
+            results = []
+            for fetch_result in pool.map(self.fetch, ordered):
+                results.append(fetch_result)
+                if on_result:
+                    on_result(fetch_result)
+        return results
+
+
+def summarize(results, elapsed):
+    """Totals for a fetch run, ready for a report"""
+    statuses = Counter(result.status for result in results)
+    hosts = Counter(urlsplit(result.url).netloc for result in results)
+    downloaded = sum(result.size for result in results if result.status == 'fetched')
+    return {
+        'urls': len(results),
+        'statuses': dict(statuses),
+        'hosts': dict(hosts),
+        'downloaded_bytes': downloaded,
+        'elapsed': elapsed,
+        'urls_per_sec': len(results) / elapsed if elapsed > 0 else 0.0,
+        'failures': [result for result in results if result.status in ('error', 'invalid')],
+    }
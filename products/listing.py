@@ -0,0 +1,110 @@
+import base64
+import json
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.db.models.functions import Substr
+
+# Sort key -> (label, field, descending). ``id`` is always appended as the
+# tie-breaker so every ordering is total and keyset pagination is stable.
+SORT_OPTIONS = {
+    'newest': ('Newest', 'created_at', True),
+    'price_asc': ('Price: Low to High', 'price', False),
+    'price_desc': ('Price: High to Low', 'price', True),
+    'popular': ('Most Popular', 'popularity_score', True),
+    'bestselling': ('Best Selling', 'sales_count', True),
+}
+DEFAULT_SORT = 'newest'
+PAGE_SIZE = 24
+
+# Everything the product card template renders; ``description`` is replaced
+# by a short ``summary`` so long texts never leave the database.
+CARD_FIELDS = (
+    'id', 'name', 'price', 'ai_recommended_price', 'image', 'image_url',
+    'stock', 'views_count', 'sales_count', 'rating_average', 'created_at',
+    'popularity_score', 'image_meta',
+)
+SUMMARY_LENGTH = 200
+
+
+def card_queryset(queryset):
+    """Restrict a product queryset to the columns the card template uses"""
+    return queryset.only(*CARD_FIELDS).annotate(summary=Substr('description', 1, SUMMARY_LENGTH))
+
+
+def encode_cursor(value, pk):
+    if isinstance(value, Decimal):
+        value = str(value)
+    elif hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    raw = json.dumps([value, pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(value, pk)`` or ``None`` for a missing or malformed cursor"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        return value, int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def keyset_page(queryset, sort=DEFAULT_SORT, cursor=None, page_size=PAGE_SIZE):
+    """Return ``(items, next_cursor)`` for the page after ``cursor``
+
+    Instead of OFFSET, the page is located by seeking past the last
+    ``(sort value, id)`` pair of the previous page, so every page costs the
+    same indexed range scan no matter how deep the visitor goes.
+    """
+    if sort not in SORT_OPTIONS:
+        sort = DEFAULT_SORT
+    _, field, descending = SORT_OPTIONS[sort]
+    return seek(queryset, field, descending, cursor, page_size)
+
+
+def _cursor_position(queryset, field, cursor):
+    """Decoded cursor with its value coerced to ``field``, or ``None`` if it does not fit"""
+    position = decode_cursor(cursor)
+    if position is None:
+        return None
+    value, pk = position
+    try:
+        value = queryset.model._meta.get_field(field).to_python(value)
+    except (ValidationError, TypeError, ValueError):
+        return None
+    return None if value is None else (value, pk)
+
+
+def seek(queryset, field, descending=False, cursor=None, page_size=PAGE_SIZE):
+    """``keyset_page`` for any ``(field, id)`` ordering
+
+    A cursor whose value does not fit ``field`` is treated as missing, so a
+    tampered link starts over at the first page instead of erroring.
+    """
+    prefix = '-' if descending else ''
+    queryset = queryset.order_by(prefix + field, prefix + 'id')
+
+    position = _cursor_position(queryset, field, cursor)
+    if position is not None:
+        value, pk = position
+        op = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': pk})
+        )
+
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return items, next_cursor
+
+
+def sort_choices():
+    return [(key, label) for key, (label, _, _) in SORT_OPTIONS.items()]
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from products.catalog import get_catalog
+from products.image_fetcher import ImageFetcher, summarize
+from products.catalog_io import Throughput
+from products.models import Product
+
+class Command(BaseCommand):
+    help = 'Download and validate remote product image URLs concurrently into a local cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=['db', 'txt', 'all'], default='all',
+                            help='Product.image_url, products.txt, or both')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent downloads')
+        parser.add_argument('--per-host', type=int, default=2, help='Concurrent downloads per host')
+        parser.add_argument('--timeout', type=float, default=10.0, help='Per-request timeout in seconds')
+        parser.add_argument('--max-age', type=int, default=0,
+                            help='Skip URLs fetched within this many seconds (default: always revalidate)')
+        parser.add_argument('--cache-dir', help='Default: IMAGE_CACHE_DIR')
+
+    def handle(self, *args, **options):
+        urls = []
+        if options['source'] in ('db', 'all'):
+            urls.extend(Product.objects.filter(is_active=True).exclude(image_url__isnull=True)
+                        .exclude(image_url='').values_list('image_url', flat=True))
+        if options['source'] in ('txt', 'all'):
+            urls.extend(url for url in get_catalog().image_urls if url)
+
+        fetcher = ImageFetcher(
+            options['cache_dir'] or settings.IMAGE_CACHE_DIR,
+            max_workers=max(1, options['workers']),
+            per_host=max(1, options['per_host']),
+            timeout=options['timeout'],
+            max_age=options['max_age'],
+        )
+        urls = fetcher.interleave(urls)
+        self.stdout.write(f'Fetching {len(urls)} image URLs into {fetcher.cache_dir}...')
+
+        timer = Throughput()
+        results = fetcher.fetch_all(urls)
+        report = summarize(results, timer.elapsed())
+
+        for status, count in sorted(report['statuses'].items()):
+            self.stdout.write(f'{status}: {count}')
+        for host, count in sorted(report['hosts'].items()):
+            self.stdout.write(f'{host}: {count} URLs')
+        for failure in report['failures'][:20]:
+            self.stdout.write(self.style.WARNING(f'{failure.status} {failure.url}: {failure.http_status or ""} {failure.error}'))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully checked {report["urls"]} image URLs '
+                f'({report["downloaded_bytes"] / 1024:,.0f} KiB downloaded) in {report["elapsed"]:.1f}s '
+                f'({report["urls_per_sec"]:,.1f} URLs/sec)!'
+            )
+        )
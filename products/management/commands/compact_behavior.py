@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from products.behavior import compact_behavior, retention_cutoff
+
+class Command(BaseCommand):
+    help = 'Compact raw UserBehavior events older than the retention window into daily rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retain-days',
+            type=int,
+            help='Days of raw events to keep (default: BEHAVIOR_RAW_RETENTION_DAYS)',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = retention_cutoff(options['retain_days'])
+        self.stdout.write(f'Compacting behavior events before {cutoff}...')
+
+        total = 0
+        for day, rows in compact_behavior(before=cutoff):
+            if rows:
+                self.stdout.write(f'{day}: compacted {rows} events')
+            total += rows
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully compacted {total} behavior events!')
+        )
@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from products.catalog_io import CHUNK_SIZE, Throughput, detect_format, export_rows, write_rows
+from products.models import Product
+
+class Command(BaseCommand):
+    help = 'Stream the Product table to a CSV or JSONL file that import_catalog can read back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, or '-' for stdout")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Default: from the file extension')
+        parser.add_argument('--active-only', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = detect_format(path, options['format'])
+        queryset = Product.objects.all()
+        if options['active_only']:
+            queryset = queryset.filter(is_active=True)
+
+        timer = Throughput()
+        rows = export_rows(queryset, chunk_size=options['chunk_size'])
+        if path == '-':
+            # Keep stdout clean for piping; no summary line.
+            write_rows(rows, sys.stdout, fmt)
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            count = write_rows(rows, f, fmt)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully exported {count} products to {path} in {timer.elapsed():.1f}s '
+                f'({timer.rate(count):,.0f} rows/sec)!'
+            )
+        )
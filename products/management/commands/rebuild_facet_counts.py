@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from products.facets import rebuild_facet_counts
+from products.models import ProductFacetCount
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed product facet counts from the Product table'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding facet counts...')
+        rebuild_facet_counts()
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt {ProductFacetCount.objects.count()} facet cells!')
+        )
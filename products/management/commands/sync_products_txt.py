@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.catalog_io import DEFAULT_CATEGORY, Throughput
+from products.txt_sync import default_path, sync_products_txt
+
+class Command(BaseCommand):
+    help = 'Apply only the inserts, updates and deactivations needed to match products.txt'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Catalog file (default: products.txt in BASE_DIR)')
+        parser.add_argument('--default-category', default=DEFAULT_CATEGORY,
+                            help='Category slug for newly created products')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without writing them')
+
+    def handle(self, *args, **options):
+        path = options['path'] or default_path()
+        self.stdout.write(f'Syncing products from {path}...')
+        timer = Throughput()
+        try:
+            stats = sync_products_txt(path, dry_run=options['dry_run'],
+                                      default_category=options['default_category'])
+        except OSError as exc:
+            raise CommandError(f'Cannot read {path}: {exc}')
+
+        for line_number, error in stats['errors'][:20]:
+            self.stdout.write(self.style.WARNING(f'line {line_number}: {error}'))
+        summary = (f'{stats["inserted"]} inserted, {stats["updated"]} updated, '
+                   f'{stats["deactivated"]} deactivated, {stats["unchanged"]} unchanged')
+        if options['dry_run']:
+            self.stdout.write(f'Dry run: {summary}')
+            return
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully synced {stats["rows"]} rows ({summary}) in {timer.elapsed():.1f}s!')
+        )
@@ -1,85 +1,79 @@
-import requests
-import time
-import json
 from django.conf import settings
-from decouple import config
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from products.catalog_io import Throughput
+from products.facets import rebuild_facet_counts
+from products.market_prices import MarketPriceClient, TTLCache
+from products.models import Product
 
-GEMINI_API_KEY = config('GEMINI_API_KEY', default='')
-GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
-HEADERS = {
-    "Content-Type": "application/json",
-    "X-goog-api-key": GEMINI_API_KEY
-}
+class Command(BaseCommand):
+    help = 'Refresh Product.price from Gemini market-price answers, in parallel within the rate limit'
 
-def fetch_market_price(product_name):
-    prompt = f"What is the current market price of {product_name} in India (INR)? Only give the number, no currency symbol or text."
-    data = {
-        "contents": [
-            {"parts": [{"text": prompt}]}
-        ]
-    }
-    response = requests.post(GEMINI_URL, headers=HEADERS, data=json.dumps(data))
-    if response.status_code == 200:
-        try:
-            result = response.json()
-            text = result["candidates"][0]["content"]["parts"][0]["text"]
-            price = int(''.join(filter(str.isdigit, text.split()[0])))
-            return price
-        except Exception as e:
-            print(f"Error parsing response for {product_name}: {e}")
-    else:
-        print(f"API error for {product_name}: {response.status_code}")
-    return None
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Only these product names (default: all active products)')
+        parser.add_argument('--base-url', help='generateContent endpoint (default: GEMINI_API_URL)')
+        parser.add_argument('--rate', type=float, help='Requests per second (default: MARKET_PRICE_REQUESTS_PER_SECOND)')
+        parser.add_argument('--burst', type=int, help='Requests allowed back to back (default: one second of quota)')
+        parser.add_argument('--workers', type=int, default=4, help='Requests in flight at once')
+        parser.add_argument('--retries', type=int, default=4, help='Retries per product on 429/5xx/network errors')
+        parser.add_argument('--cache-ttl', type=int, help='Seconds to reuse a cached answer (default: MARKET_PRICE_CACHE_TTL)')
+        parser.add_argument('--no-cache', action='store_true', help='Ignore and do not write the answer cache')
+        parser.add_argument('--dry-run', action='store_true', help='Show the new prices without saving them')
 
-import re
+    def handle(self, *args, **options):
+        rate = options['rate'] or settings.MARKET_PRICE_REQUESTS_PER_SECOND
+        if rate <= 0:
+            raise CommandError('--rate must be positive')
+        cache = TTLCache(
+            None if options['no_cache'] else settings.MARKET_PRICE_CACHE_FILE,
+            ttl=0 if options['no_cache'] else (options['cache_ttl'] or settings.MARKET_PRICE_CACHE_TTL),
+        )
+        client = MarketPriceClient(
+            options['base_url'] or settings.GEMINI_API_URL,
+            api_key=settings.GEMINI_API_KEY,
+            rate=rate,
+            burst=options['burst'],
+            workers=max(1, options['workers']),
+            max_retries=max(0, options['retries']),
+            cache=cache,
+        )
 
-def update_populate_data_py(updated_prices):
-    populate_path = "d:/PROJECTS/E-COMMERCE/products/management/commands/populate_data.py"
-    with open(populate_path, "r", encoding="utf-8") as f:
-        content = f.read()
-    def price_replacer(match):
-        name = match.group(1)
-        old_price = match.group(2)
-        new_price = updated_prices.get(name)
-        if new_price:
-            return f"{{'name': '{name}', 'price': {new_price}, 'category':"  # rest of line remains
-        return match.group(0)
-    # Replace prices in products_data
-    content = re.sub(r"\{'name': '([^']+)', 'price': (\d+), 'category':", price_replacer, content)
-    with open(populate_path, "w", encoding="utf-8") as f:
-        f.write(content)
+        products = Product.objects.filter(is_active=True).only('id', 'name', 'price')
+        if options['names']:
+            products = products.filter(name__in=options['names'])
+        products = list(products)
+        self.stdout.write(f'Fetching market prices for {len(products)} products at {rate:g} req/s...')
 
-if __name__ == "__main__":
-    products = [
-        "iPhone 15 Pro",
-        "Samsung Galaxy S24",
-        "MacBook Air M3",
-        "Dell XPS 13",
-        "Sony WH-1000XM5",
-        "Casual Cotton T-Shirt",
-        "Denim Jeans Classic",
-        "Winter Wool Sweater",
-        "Running Sneakers",
-        "Leather Jacket",
-        "Python Programming Guide",
-        "Machine Learning Basics",
-        "Web Development Handbook",
-        "Data Science Cookbook",
-        "Smart Home Speaker",
-        "Garden Tool Set",
-        "LED Desk Lamp",
-        "Yoga Mat Premium",
-        "Dumbbell Set",
-        "Fitness Tracker"
-    ]
-    updated_prices = {}
-    for product in products:
-        print(f"Fetching price for {product}...")
-        price = fetch_market_price(product)
-        updated_prices[product] = price
-        print(f"{product}: {price}")
-        time.sleep(2)  # Avoid hitting rate limits
-    print("\nUpdated prices:")
-    for k, v in updated_prices.items():
-        print(f"{k}: {v}")
-    update_populate_data_py(updated_prices)
+        timer = Throughput()
+        prices = client.fetch_many(product.name for product in products)
+        cache.save()
+
+        now = timezone.now()
+        changed = []
+        for product in products:
+            price = prices.get(product.name)
+            if price is None:
+                self.stdout.write(self.style.WARNING(f'No price for {product.name}'))
+            elif price != product.price:
+                self.stdout.write(f'{product.name}: ₹{product.price:,} -> ₹{price:,}')
+                product.price = price
+                # bulk_update skips auto_now, so stamp it for the search index.
+                product.updated_at = now
+                changed.append(product)
+
+        if options['dry_run']:
+            self.stdout.write(f'Dry run: {len(changed)} prices would change')
+            return
+        Product.objects.bulk_update(changed, ['price', 'updated_at'], batch_size=500)
+        if changed:
+            # bulk_update bypasses post_save, which keeps the price facets current.
+            rebuild_facet_counts()
+
+        stats = client.stats
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully updated {len(changed)} prices in {timer.elapsed():.1f}s '
+                f'({stats["requests"]} requests, {stats["retries"]} retries, '
+                f'{stats["cache_hits"]} cached, {stats["failed"]} failed)!'
+            )
+        )
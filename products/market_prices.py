@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+PROMPT = ('What is the current market price of {name} in India (INR)? '
+          'Only give the number, no currency symbol or text.')
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+_NUMBER = re.compile(r'\d[\d,]*(?:\.\d+)?')
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, bursts of ``capacity``"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class TTLCache:
+    """Product name -> price, persisted as JSON, entries expire after ``ttl`` seconds"""
+
+    def __init__(self, path=None, ttl=24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        if path:
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+
+    @staticmethod
+    def key(name):
+        return ' '.join(name.lower().split())
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(self.key(name))
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return None
+        return Decimal(entry[0])
+
+    def set(self, name, price):
+        with self._lock:
+            self._entries[self.key(name)] = [str(price), time.time()]
+
+    def save(self):
+        if not self.path:
+            return
+        now = time.time()
+        with self._lock:
+            live = {key: entry for key, entry in self._entries.items() if now - entry[1] <= self.ttl}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(live, f)
+        os.replace(tmp, self.path)
+
+
+def parse_price(text, max_digits=None, decimal_places=None):
+    """First number in a model reply, e.g. ``'₹85,999.00'`` -> ``Decimal('85999.00')``
+
+    The number is rounded to ``decimal_places`` and ``None`` is returned if
+    it does not fit in ``max_digits``; both default to ``Product.price``'s,
+    so a parsed price can always be saved.
+    """
+    if max_digits is None or decimal_places is None:
+        from .models import Product
+        field = Product._meta.get_field('price')
+        max_digits, decimal_places = field.max_digits, field.decimal_places
+    match = _NUMBER.search(text or '')
+    if not match:
+        return None
+    try:
+        price = Decimal(match.group().replace(',', '')).quantize(
+            Decimal(1).scaleb(-decimal_places), rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        return None
+    if len(price.as_tuple().digits) > max_digits:
+        return None
+    return price if price > 0 else None
+
+
+class MarketPriceClient:
+    """Gemini ``generateContent`` client for market prices
+
+    One pooled session is shared by all workers, a token bucket keeps the
+    request rate within quota while letting requests run in parallel, and
+    transient failures (connection errors, 429, 5xx) are retried with full
+    jitter exponential backoff, honouring ``Retry-After``. Successful
+    answers are cached by product name for ``cache.ttl`` seconds.
+    """
+
+    def __init__(self, url, api_key='', rate=1.0, burst=None, workers=4, max_retries=4,
+                 backoff=1.0, max_backoff=30.0, timeout=20.0, cache=None):
+        self.url = url
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.cache = cache or TTLCache()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json', 'X-goog-api-key': api_key})
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'cache_hits': 0, 'failed': 0}
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(self.max_backoff, float(retry_after))
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _request(self, name):
+        payload = {'contents': [{'parts': [{'text': PROMPT.format(name=name)}]}]}
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            self._count('requests')
+            response = None
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            except requests.RequestException as exc:
+                error = str(exc)
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                error = f'HTTP {response.status_code}'
+                if response.status_code not in RETRY_STATUSES:
+                    break
+            if attempt < self.max_retries:
+                self._count('retries')
+                time.sleep(self._delay(attempt, response))
+        raise requests.RequestException(f'{name}: {error}')
+
+    def fetch(self, name):
+        """Market price for one product name, or ``None``"""
+        cached = self.cache.get(name)
+        if cached is not None:
+            self._count('cache_hits')
+            return cached
+        try:
+            result = self._request(name)
+            text = result['candidates'][0]['content']['parts'][0]['text']
+        except (requests.RequestException, ValueError, KeyError, IndexError, TypeError) as exc:
+            self._count('failed')
+            logger.warning('No market price for %s: %s', name, exc)
+            return None
+        price = parse_price(text)
+        if price is None:
+            self._count('failed')
+            logger.warning('Unusable market price for %s: %r', name, text)
+            return None
+        self.cache.set(name, price)
+        return price
+
+    def fetch_many(self, names):
+        """``{name: price or None}`` for every distinct name, fetched in parallel"""
+        names = list(dict.fromkeys(names))
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='market-price') as pool:
+            return dict(zip(names, pool.map(self.fetch, names)))
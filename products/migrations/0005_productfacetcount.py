@@ -0,0 +1,56 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:25
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Value, When
+
+# Upper bounds of the price bands as of this migration (see products.facets).
+PRICE_BAND_LIMITS = (Decimal('1000'), Decimal('5000'), Decimal('20000'), Decimal('50000'))
+
+
+def populate_facet_counts(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductFacetCount = apps.get_model('products', 'ProductFacetCount')
+    rows = (Product.objects.filter(is_active=True)
+            .annotate(
+                band=Case(*[When(price__lt=limit, then=Value(band)) for band, limit in enumerate(PRICE_BAND_LIMITS)],
+                          default=Value(len(PRICE_BAND_LIMITS)), output_field=IntegerField()),
+                bucket=Case(*[When(rating_average__gte=stars, then=Value(stars)) for stars in (5, 4, 3, 2, 1)],
+                            default=Value(0), output_field=IntegerField()),
+                has_stock=Case(When(stock__gt=0, then=Value(1)), default=Value(0), output_field=IntegerField()),
+            )
+            .values('category_id', 'band', 'bucket', 'has_stock')
+            .annotate(total=Count('id'))
+            .order_by())
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(category_id=row['category_id'], price_band=row['band'], rating_bucket=row['bucket'],
+                          in_stock=bool(row['has_stock']), count=row['total'])
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_band', models.PositiveSmallIntegerField()),
+                ('rating_bucket', models.PositiveSmallIntegerField()),
+                ('in_stock', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+            ],
+            options={
+                'unique_together': {('category', 'price_band', 'rating_bucket', 'in_stock')},
+            },
+        ),
+        migrations.RunPython(populate_facet_counts, migrations.RunPython.noop),
+    ]
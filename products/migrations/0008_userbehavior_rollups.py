@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_userbehavior_event_timestamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBehaviorDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('behavior_type', models.CharField(choices=[('view', 'Product View'), ('cart_add', 'Add to Cart'), ('cart_remove', 'Remove from Cart'), ('purchase', 'Purchase'), ('review', 'Review'), ('search', 'Search')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='userbehavior',
+            index=models.Index(fields=['timestamp'], name='products_us_timesta_744b11_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userbehavior',
+            index=models.Index(fields=['user', 'timestamp'], name='products_us_user_id_9d1bb0_idx'),
+        ),
+        migrations.AddField(
+            model_name='userbehaviordaily',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='products.product'),
+        ),
+        migrations.AddField(
+            model_name='userbehaviordaily',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='userbehaviordaily',
+            index=models.Index(fields=['behavior_type', 'day'], name='products_us_behavio_2ca2d6_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='userbehaviordaily',
+            unique_together={('day', 'user', 'product', 'behavior_type')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_userbehavior_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='source_fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+    ]
@@ -1,7 +1,17 @@
 from django.db import models
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from django.utils.text import slugify
+from django.utils.functional import cached_property
+from .cart_store import get_cart_store
+from .search import get_search_index
+from . import facets
 
 
 class Category(models.Model):
@@ -10,6 +20,9 @@ class Category(models.Model):
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
     slug = models.SlugField(unique=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True, related_name='children')
+    # Materialized path of ancestor ids, e.g. "/1/4/9/"; maintained by save()
+    path = models.CharField(max_length=255, blank=True, editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -20,8 +33,49 @@ class Category(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        old_path, old_depth = self.path, self.depth
+        if old_path and self.parent_id and self.parent.path.startswith(old_path):
+            raise ValueError('A category cannot be moved under itself or one of its descendants')
         super().save(*args, **kwargs)
 
+        path = f"{self.parent.path if self.parent_id else '/'}{self.pk}/"
+        if path == old_path:
+            return
+        depth = path.count('/') - 2
+        Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+        if old_path:
+            # Re-root the whole subtree with one UPDATE
+            Category.objects.filter(self._path_prefix(old_path)).exclude(pk=self.pk).update(
+                path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (depth - old_depth),
+            )
+        self.path, self.depth = path, depth
+
+    @staticmethod
+    def _path_prefix(path, prefix=''):
+        # A plain prefix match, which is right under any collation. On
+        # PostgreSQL the varchar_pattern_ops "_like" index Django adds for
+        # db_index CharFields serves it; the table is small everywhere else.
+        return Q(**{f'{prefix}path__startswith': path})
+
+    def subtree_filter(self, prefix=''):
+        """Q matching this category and all of its descendants
+
+        Pass ``prefix='category__'`` to filter products by subtree.
+        """
+        return self._path_prefix(self.path, prefix)
+
+    def get_descendants(self, include_self=True):
+        categories = Category.objects.filter(self.subtree_filter())
+        return categories if include_self else categories.exclude(pk=self.pk)
+
+    def get_ancestors(self, include_self=True):
+        """Root-first ancestors, read with one primary-key lookup"""
+        ids = [int(pk) for pk in self.path.strip('/').split('/') if pk]
+        if not include_self:
+            ids = ids[:-1]
+        return Category.objects.filter(pk__in=ids).order_by('depth')
+
 
 class Product(models.Model):
     name = models.CharField(max_length=200)
@@ -44,10 +98,27 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
+    # Hash of the products.txt row this product was last synced from
+    source_fingerprint = models.CharField(max_length=40, blank=True, default='', editable=False)
+    # {"name", "digest", "width"} of ``image``, recorded by generate_thumbnails
+    image_meta = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Lets the search index catch up on writes from other processes.
+            models.Index(fields=['updated_at']),
+            # Keyset pagination: one index per listing sort key, with id as
+            # the tie-breaker (see products.listing.SORT_OPTIONS).
+            models.Index(fields=['is_active', 'created_at', 'id']),
+            models.Index(fields=['is_active', 'price', 'id']),
+            models.Index(fields=['is_active', 'popularity_score', 'id']),
+            models.Index(fields=['is_active', 'sales_count', 'id']),
+            models.Index(fields=['category', 'is_active', 'created_at', 'id']),
+        ]
 
     def __str__(self):
         return self.name
-    
+
     def get_discounted_price(self):
         """Return the AI recommended price if available and lower than regular price, otherwise return regular price"""
         if self.ai_recommended_price and self.ai_recommended_price < self.price:
@@ -55,11 +126,28 @@ class Product(models.Model):
         return self.price
 
 
+class ProductFacetCount(models.Model):
+    """Precomputed product counts per (category, price band, rating, stock) cell"""
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    price_band = models.PositiveSmallIntegerField()
+    rating_bucket = models.PositiveSmallIntegerField()
+    in_stock = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['category', 'price_band', 'rating_bucket', 'in_stock']
+
+    def __str__(self):
+        return f"{self.category_id}/{self.price_band}/{self.rating_bucket}/{self.in_stock}: {self.count}"
+
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products/')
     alt_text = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
+    # {"name", "digest", "width"} of ``image``, recorded by generate_thumbnails
+    image_meta = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.product.name} - {self.alt_text or 'Image'}"
@@ -96,13 +184,19 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart for {self.user.username}"
 
+    @cached_property
+    def summary(self):
+        """Line items with products and totals, loaded in one query (see products.carts)"""
+        from .carts import summarize_cart
+        return summarize_cart(self)
+
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.summary.subtotal
 
     @property
     def item_count(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.summary.item_count
 
 
 class CartItem(models.Model):
@@ -111,6 +205,10 @@ class CartItem(models.Model):
     quantity = models.IntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # One line per product, so cart writes can upsert (see products.cart_store).
+        unique_together = ['cart', 'product']
+
     def __str__(self):
         return f"{self.quantity}x {self.product.name} in {self.cart}"
 
@@ -132,9 +230,76 @@ class UserBehavior(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE, blank=True, null=True)
     behavior_type = models.CharField(max_length=20, choices=BEHAVIOR_CHOICES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set from the event time rather than auto_now_add, because events are
+    # written in batches some time after they happen (see products.events).
+    timestamp = models.DateTimeField(default=timezone.now)
     session_id = models.CharField(max_length=100, blank=True)
     metadata = models.JSONField(default=dict, blank=True)
 
+    class Meta:
+        indexes = [
+            # Raw events are read and compacted one day (time range) at a time.
+            models.Index(fields=['timestamp']),
+            models.Index(fields=['user', 'timestamp']),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.behavior_type} - {self.timestamp}"
+
+
+class UserBehaviorDaily(models.Model):
+    """Per-day event counts for UserBehavior rows past the retention window
+
+    Produced by ``products.behavior.compact_day``; see ``behavior_counts``
+    for reading rollups and the raw tail together.
+    """
+    day = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, blank=True, null=True)
+    behavior_type = models.CharField(max_length=20, choices=UserBehavior.BEHAVIOR_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['day', 'user', 'product', 'behavior_type']
+        indexes = [
+            models.Index(fields=['behavior_type', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.behavior_type} x{self.count} - {self.day}"
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_index().queue_products([instance.pk])
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_delete, sender=Product)
+def remember_facet_cell(sender, instance, raw=False, **kwargs):
+    if not raw:
+        facets.remember_facet_cell(instance)
+
+
+@receiver(post_save, sender=Product)
+def update_facet_counts(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        facets.record_product_change(instance, created)
+
+
+@receiver(post_delete, sender=Product)
+def remove_facet_counts(sender, instance, **kwargs):
+    facets.record_product_delete(instance)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    if not created:
+        get_search_index().queue_category(instance.pk)
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        get_cart_store().merge_session(request, user)
@@ -0,0 +1,501 @@
+import heapq
+import logging
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Field weights are folded into the term frequency so a hit in the name or
+# SKU outranks the same word buried in a long description.
+FIELD_WEIGHTS = (
+    ('name', 3.0),
+    ('sku', 3.0),
+    ('category', 2.0),
+    ('description', 1.0),
+)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz0123456789'
+
+
+def _edits1(token):
+    """Every string one insert, delete, substitution or adjacent
+    transposition away from ``token``"""
+    letters = set(ALPHABET) | set(token)
+    splits = [(token[:i], token[i:]) for i in range(len(token) + 1)]
+    edits = set()
+    for left, right in splits:
+        if right:
+            edits.add(left + right[1:])
+            for c in letters:
+                edits.add(left + c + right[1:])
+        if len(right) > 1:
+            edits.add(left + right[1] + right[0] + right[2:])
+        for c in letters:
+            edits.add(left + c + right)
+    edits.discard(token)
+    return edits
+
+
+class _IndexState:
+    """Mutable postings and document tables; only touched under the index lock"""
+
+    def __init__(self):
+        self.postings = {}
+        self.delta = {}
+        self.delta_docs = 0
+        self.terms = []
+        self.doc_ids = array('q')
+        self.doc_len = array('f')
+        self.alive = bytearray()
+        self.docno = {}
+        self.live_docs = 0
+        self.total_len = 0.0
+
+    def load(self, rows):
+        """Bulk-index ``rows`` straight into the main postings"""
+        builders = {}
+        for row in rows:
+            docno, frequencies = self.add_document(row)
+            for term, tf in frequencies.items():
+                postings = builders.get(term)
+                if postings is None:
+                    postings = builders[term] = (array('q'), array('f'))
+                postings[0].append(docno)
+                postings[1].append(tf)
+        for term, (docnos, tfs) in builders.items():
+            self.postings[term] = (np.frombuffer(docnos, dtype=np.int64).copy(),
+                                   np.frombuffer(tfs, dtype=np.float32).copy())
+        self.terms = sorted(builders)
+
+    def add_document(self, row):
+        product_id, name, sku, category, description = row
+        frequencies = {}
+        length = 0.0
+        for (_, weight), text in zip(FIELD_WEIGHTS, (name, sku, category, description)):
+            for token in tokenize(text):
+                frequencies[token] = frequencies.get(token, 0.0) + weight
+                length += weight
+        docno = len(self.doc_ids)
+        self.doc_ids.append(product_id)
+        self.doc_len.append(length)
+        self.alive.append(1)
+        self.docno[product_id] = docno
+        self.live_docs += 1
+        self.total_len += length
+        return docno, frequencies
+
+    def add_term(self, term):
+        index = bisect_left(self.terms, term)
+        if index == len(self.terms) or self.terms[index] != term:
+            self.terms.insert(index, term)
+
+    def remove(self, product_id):
+        docno = self.docno.pop(product_id, None)
+        if docno is not None:
+            self.alive[docno] = 0
+            self.live_docs -= 1
+            self.total_len -= self.doc_len[docno]
+
+    def index_rows(self, rows):
+        """Add ``rows`` to the delta segment, replacing older versions"""
+        for row in rows:
+            self.remove(row[0])
+            docno, frequencies = self.add_document(row)
+            for term, tf in frequencies.items():
+                self.delta.setdefault(term, []).append((docno, tf))
+                self.add_term(term)
+            self.delta_docs += 1
+
+    def merge_delta(self):
+        for term, docnos, tfs in _delta_arrays(self.delta):
+            base = self.postings.get(term)
+            if base is not None:
+                docnos = np.concatenate((base[0], docnos))
+                tfs = np.concatenate((base[1], tfs))
+            self.postings[term] = (docnos, tfs)
+        self.delta = {}
+        self.delta_docs = 0
+
+    def snapshot(self):
+        # Posting arrays are replaced, never written in place, so sharing
+        # them is safe; everything that is appended to gets copied.
+        return _Snapshot(
+            postings=dict(self.postings),
+            delta={term: (docnos, tfs) for term, docnos, tfs in _delta_arrays(self.delta)},
+            terms=tuple(self.terms),
+            doc_ids=np.frombuffer(self.doc_ids, dtype=np.int64).copy(),
+            doc_len=np.frombuffer(self.doc_len, dtype=np.float32).copy(),
+            alive=np.frombuffer(self.alive, dtype=np.uint8).astype(bool),
+            live_docs=self.live_docs,
+            total_len=self.total_len,
+        )
+
+
+def _delta_arrays(delta):
+    for term, entries in delta.items():
+        yield (term,
+               np.fromiter((d for d, _ in entries), dtype=np.int64, count=len(entries)),
+               np.fromiter((t for _, t in entries), dtype=np.float32, count=len(entries)))
+
+
+class _Snapshot:
+    """Read-only copy of the index that searches score against without locking"""
+
+    def __init__(self, postings, delta, terms, doc_ids, doc_len, alive, live_docs, total_len):
+        self.postings = postings
+        self.delta = delta
+        self.terms = terms
+        self.doc_ids = doc_ids
+        self.doc_len = doc_len
+        self.alive = alive
+        self.live_docs = live_docs
+        self.total_len = total_len
+
+    def __contains__(self, term):
+        return term in self.postings or term in self.delta
+
+    def document_frequency(self, term):
+        return sum(len(postings[0]) for postings in (self.postings.get(term), self.delta.get(term)) if postings)
+
+    def term_postings(self, term):
+        base = self.postings.get(term)
+        delta = self.delta.get(term)
+        if delta is None:
+            return base if base is not None else (np.empty(0, np.int64), np.empty(0, np.float32))
+        if base is None:
+            return delta
+        return np.concatenate((base[0], delta[0])), np.concatenate((base[1], delta[1]))
+
+
+class ProductSearchIndex:
+    """In-process BM25 inverted index over active products
+
+    Documents get dense internal numbers; postings are numpy arrays of
+    (docno, weighted tf) so scoring a term is a handful of vector operations
+    rather than a Python loop over every matching product.
+
+    ``Product`` and ``Category`` signals only queue the affected product ids,
+    and only once their transaction commits, so rolled-back writes never
+    reach the index and a bulk loop of saves costs a set insert each. The
+    next search (or background refresh) re-reads every queued product in
+    one query per chunk, folds them into a small delta segment, merged into
+    the main postings once it grows past ``merge_threshold`` documents, and
+    publishes a new snapshot once for the whole batch.
+
+    Writers change the index under a lock and then publish an immutable
+    snapshot of it; searches score against whichever snapshot is current
+    without taking the lock, so they run in parallel and never wait on an
+    update. Checking the database for writes made by other processes, and
+    any rebuild that turns up, happens on a background thread. Only the
+    very first search in a process waits, for the initial build.
+
+    Query tokens are ANDed. Each token matches exact terms, prefixes (for
+    tokens of two or more characters) and, when the token is not in the
+    vocabulary at all, terms one edit away (for tokens of four or more
+    characters). Typo candidates are generated from the query side, so the
+    index carries no extra per-term memory for them.
+    """
+
+    k1 = 1.2
+    b = 0.75
+    prefix_weight = 0.8
+    typo_weight = 0.6
+    max_expansions = 50
+    min_prefix_length = 2
+    min_typo_length = 4
+    merge_threshold = 1000
+    read_chunk_size = 500
+
+    def __init__(self, stale_check_seconds=30.0):
+        self.stale_check_seconds = stale_check_seconds
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.RLock()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._state = None
+        self._snapshot = None
+        self._dirty = None
+        self._checked_at = 0.0
+        self._stamp = None
+        self._refresher = None
+
+    # -- building -----------------------------------------------------------
+
+    @staticmethod
+    def _queryset():
+        from .models import Product
+        return (Product.objects.filter(is_active=True)
+                .values_list('id', 'name', 'sku', 'category__name', 'description'))
+
+    @staticmethod
+    def _db_stamp():
+        from .models import Product
+        return Product.objects.aggregate(
+            count=Count('id', filter=Q(is_active=True)),
+            latest=Max('updated_at'),
+        )
+
+    def _publish(self):
+        self._snapshot = self._state.snapshot()
+
+    def rebuild(self):
+        """Re-read every active product and rebuild the index from scratch
+
+        The new index is built off to the side while searches keep using
+        the old snapshot. Products saved in the meantime are re-read once
+        it is swapped in, so their changes are not lost.
+        """
+        with self._rebuild_lock:
+            with self._lock:
+                self._dirty = set()
+            try:
+                stamp = self._db_stamp()
+                state = _IndexState()
+                state.load(self._queryset().iterator(chunk_size=2000))
+            except Exception:
+                with self._lock:
+                    self._dirty = None
+                raise
+            with self._lock:
+                dirty, self._dirty = self._dirty, None
+                for product_id in dirty:
+                    state.remove(product_id)
+                if dirty:
+                    state.index_rows(self._queryset().filter(pk__in=dirty))
+                self._state = state
+                self._stamp = stamp
+                self._checked_at = time.monotonic()
+                self._publish()
+
+    def _ensure_built(self):
+        if self._snapshot is None:
+            with self._rebuild_lock:
+                if self._snapshot is None:
+                    self.rebuild()
+
+    def _schedule_refresh(self):
+        """Start a background check for other processes' writes when one is due"""
+        if time.monotonic() - self._checked_at < self.stale_check_seconds:
+            return
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._checked_at = time.monotonic()
+            self._refresher = threading.Thread(target=self._run_refresh, name='search-refresh', daemon=True)
+            self._refresher.start()
+
+    def _run_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('Refreshing the product search index failed')
+        finally:
+            connection.close()
+
+    def refresh(self):
+        """Pick up writes made by other processes since the last check"""
+        from .models import Product
+        self.flush()
+        stamp = self._db_stamp()
+        with self._lock:
+            self._checked_at = time.monotonic()
+            previous = self._stamp
+            if self._state is None or stamp == previous:
+                return
+            self._stamp = stamp
+            if previous is not None and previous['latest'] is not None:
+                changed = (Product.objects.filter(updated_at__gt=previous['latest'])
+                           .values_list('id', 'is_active'))
+                active_ids = []
+                for product_id, is_active in changed:
+                    self._state.remove(product_id)
+                    self._mark_dirty(product_id)
+                    if is_active:
+                        active_ids.append(product_id)
+                self._index_ids(active_ids)
+                # Hard deletes from another process leave no updated_at trail,
+                # so a count we cannot explain means the only safe option is
+                # a rebuild.
+                if stamp['count'] == self._state.live_docs:
+                    return
+        self.rebuild()
+
+    # -- incremental updates --------------------------------------------------
+
+    def _mark_dirty(self, product_id):
+        if self._dirty is not None:
+            self._dirty.add(product_id)
+
+    def _index_ids(self, product_ids):
+        product_ids = list(product_ids)
+        for start in range(0, len(product_ids), self.read_chunk_size):
+            self._state.index_rows(self._queryset().filter(pk__in=product_ids[start:start + self.read_chunk_size]))
+        if self._state.delta_docs >= self.merge_threshold:
+            self._state.merge_delta()
+            # Too many dead documents make every query pay for them; start
+            # over, off the request path.
+            if self._state.live_docs * 2 < len(self._state.doc_ids):
+                threading.Thread(target=self._run_rebuild, name='search-rebuild', daemon=True).start()
+        self._publish()
+
+    def _run_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Rebuilding the product search index failed')
+        finally:
+            connection.close()
+
+    def _enqueue(self, product_ids):
+        # Nothing to keep current until the index is built or being built.
+        if self._state is None and self._dirty is None:
+            return
+        with self._pending_lock:
+            self._pending.update(product_ids)
+
+    def queue_products(self, product_ids):
+        """Re-read these products once the current transaction commits (signal hook)"""
+        product_ids = list(product_ids)
+        transaction.on_commit(lambda: self._enqueue(product_ids))
+
+    def queue_category(self, category_id):
+        """Re-read every product of a renamed category once it commits (signal hook)"""
+        def enqueue():
+            if self._state is not None or self._dirty is not None:
+                from .models import Product
+                self._enqueue(Product.objects.filter(category_id=category_id).values_list('id', flat=True))
+        transaction.on_commit(enqueue)
+
+    def flush(self):
+        """Fold queued product changes into the index and publish them at once"""
+        if not self._pending:
+            return
+        with self._lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, set()
+            if self._state is None:
+                # The build in progress reads these, or replays them as dirty.
+                for product_id in pending:
+                    self._mark_dirty(product_id)
+                return
+            for product_id in pending:
+                self._mark_dirty(product_id)
+                self._state.remove(product_id)
+            # Deleted and deactivated products are simply not read back.
+            self._index_ids(pending)
+
+    # -- querying -------------------------------------------------------------
+
+    def _expand(self, snapshot, token):
+        """Return ``[(term, weight), ...]`` candidates for one query token"""
+        expansions = {}
+        if token in snapshot:
+            expansions[token] = 1.0
+        terms = snapshot.terms
+        if len(token) >= self.min_prefix_length:
+            index = bisect_left(terms, token)
+            prefixed = []
+            while index < len(terms) and terms[index].startswith(token):
+                if terms[index] != token:
+                    prefixed.append(terms[index])
+                index += 1
+            if len(prefixed) > self.max_expansions:
+                prefixed = heapq.nlargest(self.max_expansions, prefixed, key=snapshot.document_frequency)
+            for term in prefixed:
+                expansions.setdefault(term, self.prefix_weight)
+        if not expansions and len(token) >= self.min_typo_length:
+            for term in _edits1(token):
+                if term in snapshot:
+                    expansions[term] = self.typo_weight
+        return list(expansions.items())
+
+    def search(self, query, offset=0, limit=20):
+        """Return ``(product_ids, total)`` for one page of ranked results"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return [], 0
+        self._ensure_built()
+        self.flush()
+        self._schedule_refresh()
+        snapshot = self._snapshot
+        doc_count = len(snapshot.doc_ids)
+        if not snapshot.live_docs or not doc_count:
+            return [], 0
+        alive = snapshot.alive
+        avg_len = snapshot.total_len / snapshot.live_docs or 1.0
+        norm = self.k1 * (1 - self.b + self.b * snapshot.doc_len / avg_len)
+
+        scores = np.zeros(doc_count, dtype=np.float32)
+        matched = alive.copy()
+        for token in tokens:
+            token_scores = np.zeros(doc_count, dtype=np.float32)
+            for term, weight in self._expand(snapshot, token):
+                docnos, tfs = snapshot.term_postings(term)
+                if not len(docnos):
+                    continue
+                live = alive[docnos]
+                df = int(live.sum())
+                if not df:
+                    continue
+                idf = np.log(1 + (snapshot.live_docs - df + 0.5) / (df + 0.5))
+                term_scores = weight * idf * tfs * (self.k1 + 1) / (tfs + norm[docnos])
+                # A document appears at most once per term's postings.
+                token_scores[docnos] = np.maximum(token_scores[docnos], term_scores)
+            matched &= token_scores > 0
+            if not matched.any():
+                return [], 0
+            scores += token_scores
+
+        hits = np.flatnonzero(matched)
+        total = len(hits)
+        wanted = min(offset + limit, total)
+        if wanted <= 0 or offset >= total:
+            return [], total
+        hit_scores = scores[hits]
+        if wanted < total:
+            top = np.argpartition(-hit_scores, wanted - 1)[:wanted]
+        else:
+            top = np.arange(total)
+        # Stable tie-break on docno keeps pagination deterministic.
+        top = top[np.lexsort((hits[top], -hit_scores[top]))]
+        return snapshot.doc_ids[hits[top[offset:wanted]]].tolist(), total
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    """Return the process-wide product search index"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ProductSearchIndex(
+                    stale_check_seconds=getattr(settings, 'PRODUCT_SEARCH_STALE_SECONDS', 30.0),
+                )
+    return _index
+
+
+def search_products(query, page=1, per_page=20):
+    """Return ``(products, total)`` for one page of ranked search results"""
+    from .models import Product
+    page = max(int(page), 1)
+    product_ids, total = get_search_index().search(query, (page - 1) * per_page, per_page)
+    found = Product.objects.select_related('category').in_bulk(product_ids)
+    return [found[pk] for pk in product_ids if pk in found], total
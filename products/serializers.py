@@ -1,6 +1,19 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import Product, Category, ProductImage, ProductReview
 
+class SparseFieldsetMixin:
+    """Limit output to the comma-separated ``?fields=`` query parameter"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = request.query_params.get('fields') if request is not None else None
+        if requested:
+            wanted = {name.strip() for name in requested.split(',') if name.strip()}
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
@@ -9,15 +22,30 @@ class CategorySerializer(serializers.ModelSerializer):
 class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
-        fields = '__all__'
+        exclude = ['image_meta']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     category = CategorySerializer(read_only=True)
     
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ['image_meta']
+
+class ProductListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Flat, read-only product representation for list endpoints"""
+    category_name = serializers.CharField(source='category.name', read_only=True)
+    category_slug = serializers.CharField(source='category.slug', read_only=True)
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'name', 'sku', 'price', 'original_price', 'ai_recommended_price',
+            'image', 'image_url', 'stock', 'is_active', 'rating_average', 'rating_count',
+            'popularity_score', 'views_count', 'sales_count', 'category', 'category_name',
+            'category_slug', 'created_at', 'updated_at',
+        ]
+        read_only_fields = fields
 
 class ProductReviewSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField()
@@ -27,3 +55,38 @@ class ProductReviewSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+
+class CartProductSerializer(serializers.ModelSerializer):
+    category_name = serializers.CharField(source='category.name', read_only=True)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'sku', 'price', 'image', 'image_url', 'stock', 'category_name']
+        read_only_fields = fields
+
+class CartItemSerializer(serializers.Serializer):
+    product = CartProductSerializer(read_only=True)
+    quantity = serializers.IntegerField(read_only=True)
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    line_total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+class CartSummarySerializer(serializers.Serializer):
+    """A ``products.carts.CartSummary``"""
+    items = CartItemSerializer(many=True, read_only=True)
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+    line_count = serializers.IntegerField(read_only=True)
+
+class CartOperationSerializer(serializers.Serializer):
+    """One cart change: add ``quantity`` units, set the line to it, or remove the line"""
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'], default='add')
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add' and attrs['quantity'] < 1:
+            raise serializers.ValidationError({'quantity': 'Add at least one unit.'})
+        limit = getattr(settings, 'CART_MAX_QUANTITY', 99)
+        if attrs['quantity'] > limit:
+            raise serializers.ValidationError({'quantity': f'At most {limit} units.'})
+        return attrs
@@ -0,0 +1,386 @@
+import contextlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+# Event mix inside a browsing session, by behavior type
+EVENT_MIX = (
+    ('view', 0.78),
+    ('search', 0.08),
+    ('cart_add', 0.07),
+    ('cart_remove', 0.02),
+    ('purchase', 0.03),
+    ('review', 0.02),
+)
+ORDER_STATUS_MIX = (
+    ('delivered', 0.60),
+    ('shipped', 0.10),
+    ('processing', 0.10),
+    ('pending', 0.10),
+    ('cancelled', 0.08),
+    ('refunded', 0.02),
+)
+PAYMENT_FOR_STATUS = {
+    'delivered': 'paid', 'shipped': 'paid', 'processing': 'paid',
+    'pending': 'pending', 'cancelled': 'failed', 'refunded': 'refunded',
+}
+ROOT_CATEGORIES = ('Electronics', 'Fashion', 'Books', 'Home', 'Sports', 'Beauty', 'Toys', 'Grocery')
+SEARCH_TERMS = ('phone', 'laptop', 'shoes', 'shirt', 'book', 'lamp', 'watch', 'headphones', 'bag', 'gift')
+TAX_RATE = Decimal('0.18')
+
+
+def zipf_weights(n, alpha, rng):
+    """Power-law popularity over ``n`` items, randomly assigned to item positions"""
+    weights = 1.0 / np.arange(1, n + 1) ** alpha
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+@contextlib.contextmanager
+def historical_timestamps(*models):
+    """Let bulk_create keep explicit values for auto_now/auto_now_add fields"""
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class SyntheticDataGenerator:
+    """Seeded, deterministic bulk data for load tests and model training
+
+    Everything is derived from one ``numpy`` generator, so the same seed and
+    volumes always produce the same rows. Product popularity and user
+    activity follow Zipf-like power laws; behavior events come in sessions
+    (geometric length, exponential gaps) that browse mostly within one
+    category. Rows are written with ``bulk_create`` in ``batch_size`` chunks,
+    one transaction per chunk, and sampled in vectorized numpy blocks.
+    Generated rows are recognisable by their ``prefix`` (usernames, SKUs,
+    category slugs and order ids) so they can be removed with ``flush``.
+    """
+
+    def __init__(self, seed=42, days=180, batch_size=5000, popularity_alpha=1.1,
+                 activity_alpha=0.9, log=None):
+        self.seed = seed
+        self.prefix = f'syn{seed}'
+        self.days = days
+        self.batch_size = batch_size
+        self.popularity_alpha = popularity_alpha
+        self.activity_alpha = activity_alpha
+        self.rng = np.random.default_rng(seed)
+        self.log = log or (lambda message: None)
+        self.end = timezone.now().replace(microsecond=0)
+        self.start = self.end - timedelta(days=days)
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.user_weights = None
+        self.product_ids = np.empty(0, dtype=np.int64)
+        self.product_prices = np.empty(0)
+        self.product_categories = np.empty(0, dtype=np.int64)
+        self.product_weights = None
+
+    # -- helpers ----------------------------------------------------------
+
+    def _times(self, n):
+        """``n`` random datetimes in the generated window, as epoch seconds"""
+        span = (self.end - self.start).total_seconds()
+        return self.start.timestamp() + self.rng.random(n) * span
+
+    @staticmethod
+    def _datetime(epoch):
+        return datetime.fromtimestamp(float(epoch), tz=dt_timezone.utc)
+
+    def _write(self, model, rows, label):
+        """bulk_create ``rows`` (an iterable of instances) in batches"""
+        batch, written = [], 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                with transaction.atomic():
+                    model.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            written += len(batch)
+        self.log(f'{label}: {written}')
+        return written
+
+    # -- entities ---------------------------------------------------------
+
+    def exists(self):
+        from .models import Product
+        return (User.objects.filter(username__startswith=f'{self.prefix}_').exists()
+                or Product.objects.filter(sku__startswith=f'{self.prefix.upper()}-').exists())
+
+    def flush(self):
+        """Delete rows generated earlier with the same seed"""
+        from .models import Category, Product
+        from orders.models import Order
+        with transaction.atomic():
+            Order.objects.filter(order_id__startswith=f'{self.prefix.upper()}-').delete()
+            User.objects.filter(username__startswith=f'{self.prefix}_').delete()
+            Product.objects.filter(sku__startswith=f'{self.prefix.upper()}-').delete()
+            Category.objects.filter(slug__startswith=f'{self.prefix}-').delete()
+
+    def categories(self, children=4, grandchildren=3):
+        """A three-level tree; returns the leaf category ids"""
+        from .models import Category
+        leaves = []
+        for root_name in ROOT_CATEGORIES:
+            root = Category(name=f'{root_name}', slug=f'{self.prefix}-{root_name.lower()}')
+            root.save()  # save() maintains the materialized path
+            for c in range(children):
+                child = Category(name=f'{root_name} {c + 1}', slug=f'{root.slug}-{c + 1}', parent=root)
+                child.save()
+                for g in range(grandchildren):
+                    leaf = Category(name=f'{child.name}.{g + 1}', slug=f'{child.slug}-{g + 1}', parent=child)
+                    leaf.save()
+                    leaves.append(leaf.pk)
+        self.log(f'categories: {len(ROOT_CATEGORIES) * (1 + children * (1 + grandchildren))}')
+        return np.array(leaves, dtype=np.int64)
+
+    def users(self, count):
+        from accounts.models import UserProfile
+        # One hash for every account; hashing per user would dominate the run.
+        password = make_password('password123')
+        joined = np.sort(self._times(count))
+
+        def rows():
+            for i in range(count):
+                yield User(username=f'{self.prefix}_{i}', email=f'{self.prefix}_{i}@example.com',
+                           password=password, date_joined=self._datetime(joined[i]))
+        self._write(User, rows(), 'users')
+        ids = list(User.objects.filter(username__startswith=f'{self.prefix}_').order_by('pk')
+                   .values_list('pk', flat=True))
+        # bulk_create skips the post_save hook that normally creates profiles.
+        self._write(UserProfile, (UserProfile(user_id=pk) for pk in ids), 'profiles')
+        self.user_ids = np.array(ids, dtype=np.int64)
+        self.user_weights = zipf_weights(len(ids), self.activity_alpha, self.rng)
+
+    def products(self, count, leaf_ids):
+        from .models import Product
+        rng = self.rng
+        categories = rng.choice(leaf_ids, size=count)
+        # Log-normal prices centred around ₹2,000, rounded to the rupee.
+        prices = np.clip(np.round(rng.lognormal(np.log(2000), 1.1, size=count)), 49, 500000)
+        discounted = rng.random(count) < 0.25
+        discounts = rng.uniform(0.05, 0.3, size=count)
+        stock = rng.integers(0, 500, size=count)
+        created = self._times(count)
+        self.product_weights = zipf_weights(count, self.popularity_alpha, rng)
+        popularity = self.product_weights / self.product_weights.max() * 5
+        sku_prefix = self.prefix.upper()
+
+        def rows():
+            for i in range(count):
+                price = Decimal(int(prices[i]))
+                created_at = self._datetime(created[i])
+                yield Product(
+                    name=f'Product {i}', sku=f'{sku_prefix}-{i:08d}',
+                    description=f'Synthetic product {i} in category {categories[i]}.',
+                    price=price,
+                    ai_recommended_price=(price * Decimal(str(round(1 - discounts[i], 2))))
+                    .quantize(Decimal('1')) if discounted[i] else None,
+                    stock=int(stock[i]), category_id=int(categories[i]),
+                    popularity_score=float(popularity[i]), created_at=created_at, updated_at=created_at,
+                )
+        with historical_timestamps(Product):
+            self._write(Product, rows(), 'products')
+        self.product_ids = np.array(
+            Product.objects.filter(sku__startswith=f'{sku_prefix}-').order_by('sku').values_list('pk', flat=True),
+            dtype=np.int64,
+        )
+        self.product_prices = prices
+        self.product_categories = categories
+
+    def _sample_users(self, n):
+        return self.rng.choice(len(self.user_ids), size=n, p=self.user_weights)
+
+    def _sample_products(self, n):
+        return self.rng.choice(len(self.product_ids), size=n, p=self.product_weights)
+
+    def carts(self, count):
+        from .models import Cart, CartItem
+        count = min(count, len(self.user_ids))
+        owners = self.rng.choice(len(self.user_ids), size=count, replace=False)
+        self._write(Cart, (Cart(user_id=int(self.user_ids[u])) for u in owners), 'carts')
+        cart_ids = list(Cart.objects.filter(user_id__in=self.user_ids[owners].tolist())
+                        .order_by('pk').values_list('pk', flat=True))
+        sizes = self.rng.integers(1, 6, size=len(cart_ids))
+        products = self._sample_products(int(sizes.sum()))
+        quantities = self.rng.integers(1, 4, size=len(products))
+        owner = np.repeat(np.arange(len(cart_ids)), sizes)
+
+        def rows():
+            seen = set()
+            for i in range(len(products)):
+                key = (owner[i], products[i])
+                if key not in seen:
+                    seen.add(key)
+                    yield CartItem(cart_id=cart_ids[owner[i]], product_id=int(self.product_ids[products[i]]),
+                                   quantity=int(quantities[i]))
+        self._write(CartItem, rows(), 'cart items')
+
+    def orders(self, count):
+        from orders.history import product_thumbnail
+        from orders.models import Order, OrderItem
+        from .models import Product
+        rng = self.rng
+        users = self._sample_users(count)
+        created = np.sort(self._times(count))
+        statuses = rng.choice([s for s, _ in ORDER_STATUS_MIX], size=count, p=[p for _, p in ORDER_STATUS_MIX])
+        sizes = rng.geometric(0.55, size=count).clip(1, 8)
+        products = self._sample_products(int(sizes.sum()))
+        quantities = rng.geometric(0.7, size=len(products)).clip(1, 5)
+        line_totals = self.product_prices[products] * quantities
+        owner = np.repeat(np.arange(count), sizes)
+        subtotals = np.bincount(owner, weights=line_totals, minlength=count)
+        order_prefix = self.prefix.upper()
+        # The history list reads these denormalized columns instead of the items.
+        first_products = self.product_ids[products[np.cumsum(sizes) - sizes]]
+        thumbnails = {pk: product_thumbnail(product) for pk, product in Product.objects.only(
+            'image', 'image_url').in_bulk(set(first_products.tolist())).items()}
+
+        def order_rows():
+            for i in range(count):
+                subtotal = Decimal(int(subtotals[i]))
+                tax = (subtotal * TAX_RATE).quantize(Decimal('0.01'))
+                shipping = Decimal('0.00') if subtotal >= 500 else Decimal('49.00')
+                created_at = self._datetime(created[i])
+                status = str(statuses[i])
+                payment_status = PAYMENT_FOR_STATUS[status]
+                yield Order(
+                    order_id=f'{order_prefix}-{i:09d}', user_id=int(self.user_ids[users[i]]),
+                    status=status, payment_status=payment_status,
+                    shipping_address=f'{i % 999 + 1} Synthetic Street', billing_address=f'{i % 999 + 1} Synthetic Street',
+                    phone_number='9000000000', subtotal=subtotal, tax=tax, shipping_cost=shipping,
+                    total=subtotal + tax + shipping, payment_method='stripe' if payment_status != 'pending' else '',
+                    item_count=int(sizes[i]), thumbnail=thumbnails.get(int(first_products[i]), ''),
+                    created_at=created_at, updated_at=created_at,
+                    paid_at=created_at + timedelta(minutes=5) if payment_status in ('paid', 'refunded') else None,
+                    shipped_at=created_at + timedelta(days=1) if status in ('shipped', 'delivered') else None,
+                    delivered_at=created_at + timedelta(days=4) if status == 'delivered' else None,
+                )
+        with historical_timestamps(Order):
+            self._write(Order, order_rows(), 'orders')
+        order_ids = np.array(Order.objects.filter(order_id__startswith=f'{order_prefix}-')
+                             .order_by('order_id').values_list('pk', flat=True), dtype=np.int64)
+
+        def item_rows():
+            for i in range(len(products)):
+                price = Decimal(int(self.product_prices[products[i]]))
+                yield OrderItem(order_id=int(order_ids[owner[i]]), product_id=int(self.product_ids[products[i]]),
+                                quantity=int(quantities[i]), price=price, total=price * int(quantities[i]))
+        self._write(OrderItem, item_rows(), 'order items')
+
+        sold = np.bincount(products, weights=quantities * np.isin(statuses[owner], ['cancelled', 'refunded'],
+                                                                  invert=True), minlength=len(self.product_ids))
+        return sold.astype(np.int64)
+
+    def reviews(self, count):
+        from .models import ProductReview
+        rng = self.rng
+        # Sample extra pairs, then keep the first occurrence of each (user, product).
+        users = self._sample_users(int(count * 1.3) + 10)
+        products = self._sample_products(len(users))
+        pairs = users.astype(np.int64) * len(self.product_ids) + products
+        _, first = np.unique(pairs, return_index=True)
+        first = np.sort(first)[:count]
+        ratings = rng.choice([1, 2, 3, 4, 5], size=len(first), p=[0.05, 0.07, 0.13, 0.35, 0.40])
+        created = self._times(len(first))
+
+        def rows():
+            for n, i in enumerate(first):
+                created_at = self._datetime(created[n])
+                yield ProductReview(user_id=int(self.user_ids[users[i]]), product_id=int(self.product_ids[products[i]]),
+                                    rating=int(ratings[n]), comment='', created_at=created_at, updated_at=created_at)
+        with historical_timestamps(ProductReview):
+            self._write(ProductReview, rows(), 'reviews')
+
+        totals = np.bincount(products[first], weights=ratings, minlength=len(self.product_ids))
+        counts = np.bincount(products[first], minlength=len(self.product_ids))
+        return totals, counts
+
+    def behavior(self, count, mean_session_length=8, block=200000):
+        """``count`` UserBehavior events in sessions; returns views per product"""
+        from .models import UserBehavior
+        rng = self.rng
+        types = np.array([t for t, _ in EVENT_MIX])
+        type_p = [p for _, p in EVENT_MIX]
+        # Products grouped by category, so a session can stay on one shelf.
+        order = np.argsort(self.product_categories, kind='stable')
+        sorted_categories = self.product_categories[order]
+        views = np.zeros(len(self.product_ids), dtype=np.int64)
+        written = session_no = 0
+
+        while written < count:
+            n = min(block, count - written)
+            # n sessions always cover n events; keep the ones that start in the block.
+            lengths = rng.geometric(1 / mean_session_length, size=n)
+            lengths = lengths[np.cumsum(lengths) - lengths < n]
+            session = np.repeat(np.arange(len(lengths)), lengths)[:n]
+            first_index = np.cumsum(lengths) - lengths
+            users = self._sample_users(len(lengths))[session]
+            # Session start plus exponential think time between events.
+            gaps = rng.exponential(40.0, size=n)
+            gaps[first_index] = 0
+            elapsed = np.cumsum(gaps)
+            elapsed -= np.repeat(elapsed[first_index], lengths)[:n]
+            times = self._times(len(lengths))[session] + elapsed
+            # 70% of a session's events stay in the category of its first product.
+            anchor = self._sample_products(len(lengths))
+            products = self._sample_products(n)
+            stay = rng.random(n) < 0.7
+            anchor_category = self.product_categories[anchor][session]
+            low = np.searchsorted(sorted_categories, anchor_category, side='left')
+            high = np.searchsorted(sorted_categories, anchor_category, side='right')
+            same_shelf = order[low + (rng.random(n) * (high - low)).astype(np.int64)]
+            products = np.where(stay, same_shelf, products)
+            kinds = rng.choice(types, size=n, p=type_p)
+            terms = rng.integers(0, len(SEARCH_TERMS), size=n)
+            views += np.bincount(products[kinds == 'view'], minlength=len(self.product_ids))
+
+            def rows():
+                for i in range(n):
+                    kind = str(kinds[i])
+                    search = kind == 'search'
+                    yield UserBehavior(
+                        user_id=int(self.user_ids[users[i]]),
+                        product_id=None if search else int(self.product_ids[products[i]]),
+                        behavior_type=kind,
+                        timestamp=self._datetime(min(times[i], self.end.timestamp())),
+                        session_id=f'{self.prefix}-{session_no + session[i]}',
+                        metadata={'query': SEARCH_TERMS[terms[i]]} if search else {},
+                    )
+            written += self._write(UserBehavior, rows(), f'behavior events {written + n}/{count}')
+            session_no += len(lengths)
+        return views
+
+    def update_product_stats(self, sold, views, ratings):
+        """Write sales, views and rating aggregates back to the products"""
+        from .models import Product
+        rating_totals, rating_counts = ratings
+        with np.errstate(invalid='ignore', divide='ignore'):
+            averages = np.where(rating_counts > 0, rating_totals / np.maximum(rating_counts, 1), 0.0)
+        products = [
+            Product(pk=pk, sales_count=int(sold[i]), views_count=int(views[i]),
+                    rating_count=int(rating_counts[i]), rating_average=round(float(averages[i]), 2))
+            for i, pk in enumerate(self.product_ids.tolist())
+        ]
+        fields = ['sales_count', 'views_count', 'rating_count', 'rating_average']
+        for start in range(0, len(products), self.batch_size):
+            with transaction.atomic():
+                Product.objects.bulk_update(products[start:start + self.batch_size], fields, batch_size=500)
+        self.log('product statistics updated')
@@ -0,0 +1,49 @@
+from django import template
+
+from products import thumbnails
+
+register = template.Library()
+
+
+def _stored_entries(image, fmt):
+    instance = getattr(image, 'instance', None)
+    # A deferred column would cost a query per image; go without instead.
+    if instance is None or 'image_meta' in instance.get_deferred_fields():
+        return []
+    return thumbnails.srcset_entries(image.name, getattr(instance, 'image_meta', None), fmt)
+
+
+@register.filter
+def srcset(image, fmt='jpeg'):
+    """``srcset`` value for an ImageField file or an external image URL
+
+    Stored images list the content-addressed thumbnails in ``fmt`` that
+    generate_thumbnails recorded on their row; external URLs are only
+    expanded for hosts that resize on request.
+    Returns an empty string when there is nothing better than ``src``.
+    """
+    if isinstance(image, str):
+        entries = thumbnails.url_srcset_entries(image)
+    elif image:
+        entries = _stored_entries(image, fmt)
+    else:
+        entries = []
+    return ', '.join(f'{url} {width}w' for url, width in entries)
+
+
+@register.filter
+def thumbnail(image, width=320):
+    """URL of the JPEG thumbnail closest to ``width``, falling back to the original"""
+    width = int(width)
+    if isinstance(image, str):
+        entries = thumbnails.url_srcset_entries(image)
+        fallback = image
+    elif image:
+        entries = _stored_entries(image, 'jpeg')
+        fallback = image.url
+    else:
+        return ''
+    for url, entry_width in entries:
+        if entry_width >= width:
+            return url
+    return entries[-1][0] if entries else fallback
@@ -1,3 +1,1133 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import Count, F, Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from analytics.models import ProductAnalytics
+from orders.models import Order, OrderItem
+from . import search
+from .behavior import behavior_counts, compact_behavior, day_bounds
+from .cart_store import get_cart_store
+from .carts import cart_item_count, get_cart_summary, invalidate_cart_summary, summarize_quantities
+from .catalog import TxtCatalog
+from .catalog_io import CatalogImporter, iter_rows
+from .context_processors import cart as cart_context
+from .counters import ViewCounter
+from .events import BehaviorEventQueue
+from .facets import rebuild_facet_counts
+from .image_fetcher import ImageFetcher, summarize
+from .listing import encode_cursor, keyset_page
+from .market_prices import TokenBucket, parse_price
+from .search import ProductSearchIndex
+from .txt_sync import sync_products_txt
+from .models import (
+    CartItem, Category, Product, ProductFacetCount, ProductImage, ProductReview, UserBehavior, UserBehaviorDaily,
+)
+
+
+class StubServer:
+    """A local HTTP server run on a thread for the duration of a test"""
+
+    def __init__(self, handler):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def raw_cursor(value, pk):
+    raw = json.dumps([value, pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+class KeysetPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        for i in range(5):
+            Product.objects.create(
+                name=f'Product {i}', description='', price=Decimal(i) + Decimal('0.50'),
+                sku=f'SKU{i}', category=category,
+            )
+
+    def test_pages_cover_every_product_once(self):
+        for sort in ('newest', 'price_asc', 'price_desc', 'popular', 'bestselling'):
+            seen, cursor = [], None
+            while True:
+                items, cursor = keyset_page(Product.objects.all(), sort, cursor, page_size=2)
+                seen += [product.pk for product in items]
+                if cursor is None:
+                    break
+            self.assertEqual(sorted(seen), sorted(Product.objects.values_list('pk', flat=True)), sort)
+
+    def test_malformed_cursor_starts_over(self):
+        first, _ = keyset_page(Product.objects.all(), 'price_asc', page_size=2)
+        for cursor in ('!!garbage', raw_cursor('abc', 1), raw_cursor({'a': 1}, 1), raw_cursor([1], 1),
+                       raw_cursor(None, 1), raw_cursor('NaN', 1)):
+            items, _ = keyset_page(Product.objects.all(), 'price_asc', cursor, page_size=2)
+            self.assertEqual(items, first, cursor)
+
+    def test_cursor_value_is_coerced_to_the_field(self):
+        items, _ = keyset_page(Product.objects.all(), 'newest', raw_cursor('not a date', 1), page_size=2)
+        self.assertEqual(len(items), 2)
+        cheapest = Product.objects.order_by('price').first()
+        items, _ = keyset_page(Product.objects.all(), 'price_asc', encode_cursor(cheapest.price, cheapest.pk))
+        self.assertEqual(len(items), 4)
+        self.assertNotIn(cheapest, items)
+
+    def test_listing_view_ignores_bad_cursor(self):
+        response = self.client.get('/', {'sort': 'price_asc', 'after': raw_cursor('abc', 1)})
+        self.assertEqual(response.status_code, 200)
+
+
+def facet_cube():
+    return sorted(ProductFacetCount.objects.filter(count__gt=0).values_list(
+        'category_id', 'price_band', 'rating_bucket', 'in_stock', 'count'))
+
+
+class FacetCountTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Electronics', slug='electronics')
+        self.products = [
+            Product.objects.create(name=f'Product {i}', description='', price=Decimal(500 + 2000 * i),
+                                   sku=f'SKU{i}', category=self.category, stock=i % 2, rating_average=i)
+            for i in range(4)
+        ]
+
+    def assertCubeMatchesRebuild(self):
+        incremental = facet_cube()
+        rebuild_facet_counts()
+        self.assertEqual(incremental, facet_cube())
+
+    def test_loaded_products_move_between_cells(self):
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.price, product.stock = Decimal('60000'), 5
+        product.save()
+        self.products[1].is_active = False
+        self.products[1].save()
+        Product.objects.get(pk=self.products[2].pk).delete()
+        self.assertCubeMatchesRebuild()
+
+    def test_cell_is_read_when_saving_not_when_loading(self):
+        product = Product.objects.get(pk=self.products[0].pk)
+        self.assertFalse(hasattr(product, '_facet_cell'))
+        product.stock = 5
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('SELECT')
+                              and 'products_product' in q['sql']]), 1)
+        product.price = Decimal('60000')
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('SELECT')
+                          and 'products_product' in q['sql']])
+        self.assertCubeMatchesRebuild()
+
+    def test_unloaded_product_reads_only_its_own_row(self):
+        product = Product.objects.only('id', 'name').get(pk=self.products[0].pk)
+        product.price = Decimal('30000')
+        with CaptureQueriesContext(connection) as queries:
+            Product(pk=self.products[3].pk, name='Rebuilt', description='', price=Decimal('100'), sku='SKU3',
+                    category=self.category, stock=0, created_at=self.products[3].created_at).save()
+            product.save(update_fields=['price'])
+            Product(pk=self.products[2].pk).delete()
+        self.assertFalse([q for q in queries.captured_queries if 'GROUP BY' in q['sql']])
+        self.assertCubeMatchesRebuild()
+
+
+class ProductBatchApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        cls.products = [
+            Product.objects.create(name=f'Product {i}', description='', price=Decimal('10.00'),
+                                   sku=f'SKU{i}', category=category)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('shopper', password='secret'))
+
+    def test_keeps_requested_order_and_lists_missing(self):
+        first, _, third = self.products
+        response = self.client.get('/api/products/batch/', {'ids': f'{third.pk},{first.pk},99999', 'skus': 'SKU1,NOPE'})
+        data = response.json()
+        self.assertEqual([product['id'] for product in data['results']], [third.pk, first.pk, self.products[1].pk])
+        self.assertEqual(data['missing'], {'ids': [99999], 'skus': ['NOPE']})
+
+    def test_post_body_must_be_an_object(self):
+        response = self.client.post('/api/products/batch/', {'skus': ['SKU0', 'SKU1']}, content_type='application/json')
+        self.assertEqual(len(response.json()['results']), 2)
+        for body in (['SKU0'], 'SKU0', 5):
+            response = self.client.post('/api/products/batch/', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+
+
+class CartApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        cls.phone, cls.case, cls.retired = [
+            Product.objects.create(name=name, description='', price=Decimal('10.00'), sku=f'SKU{i}',
+                                   category=category, is_active=i < 2)
+            for i, name in enumerate(['Phone', 'Case', 'Retired'])
+        ]
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(self.user)
+
+    def post(self, path, body):
+        return self.client.post(f'/api/cart/{path}/', body, content_type='application/json')
+
+    def lines(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return {line['product']['id']: line['quantity'] for line in response.json()['items']}
+
+    def test_add_set_and_remove(self):
+        self.assertEqual(self.lines(self.post('add', {'product_id': self.phone.pk, 'quantity': 2})), {self.phone.pk: 2})
+        self.assertEqual(self.lines(self.post('add', {'product_id': self.phone.pk})), {self.phone.pk: 3})
+        self.assertEqual(self.lines(self.post('set', {'product_id': self.phone.pk, 'quantity': 5})), {self.phone.pk: 5})
+        self.assertEqual(self.lines(self.post('remove', {'product_id': self.phone.pk})), {})
+
+    def test_batch_applies_all_operations(self):
+        response = self.post('batch', {'operations': [
+            {'op': 'add', 'product_id': self.phone.pk, 'quantity': 2},
+            {'op': 'add', 'product_id': self.case.pk},
+            {'op': 'set', 'product_id': self.phone.pk, 'quantity': 4},
+            {'op': 'remove', 'product_id': self.case.pk},
+        ]})
+        self.assertEqual(self.lines(response), {self.phone.pk: 4})
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 4)
+
+    def test_bad_requests_change_nothing(self):
+        for path, body in (
+            ('add', [{'product_id': self.phone.pk}]),
+            ('set', 'text'),
+            ('batch', [{'op': 'add', 'product_id': self.phone.pk}]),
+            ('batch', {'operations': {'op': 'add'}}),
+            ('add', {'product_id': self.phone.pk, 'quantity': 100}),
+            ('batch', {'operations': [{'op': 'set', 'product_id': self.phone.pk, 'quantity': 1000}]}),
+            ('add', {'product_id': self.retired.pk}),
+            ('batch', {'operations': [{'op': 'add', 'product_id': self.phone.pk},
+                                      {'op': 'add', 'product_id': 99999}]}),
+        ):
+            self.assertEqual(self.post(path, body).status_code, 400, (path, body))
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_retired_products_can_still_be_removed(self):
+        get_cart_store().add(get_cart_store().user_key(self.user.pk), self.retired.pk, 1)
+        self.assertEqual(self.lines(self.post('remove', {'product_id': self.retired.pk})), {})
+
+
+class ConditionalApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Electronics', slug='electronics')
+        cls.products = [
+            Product.objects.create(name=f'Product {i}', description='', price=Decimal('10.00'),
+                                   sku=f'SKU{i}', category=cls.category)
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('shopper', password='secret'))
+
+    def assertRevalidates(self, url, change):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_reads_only_the_page(self):
+        url = '/api/products/?page_size=2'
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        product_queries = [q['sql'] for q in queries.captured_queries if 'products_product' in q['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertIn('LIMIT 3', product_queries[0])
+        # A change beyond the page leaves it valid.
+        Product.objects.filter(pk=self.products[0].pk).update(views_count=7)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_list_invalidates_on_writes_that_skip_updated_at(self):
+        newest = self.products[-1]
+        url = '/api/products/?page_size=2'
+        self.assertRevalidates(url, lambda: Product.objects.filter(pk=newest.pk).update(views_count=F('views_count') + 1))
+        self.assertRevalidates(url, lambda: Category.objects.filter(pk=self.category.pk).update(name='Gadgets'))
+        self.assertRevalidates(url, lambda: self.products[-2].delete())
+
+    def test_detail_invalidates_on_new_images(self):
+        product = self.products[0]
+        self.assertRevalidates(f'/api/products/{product.pk}/',
+                               lambda: ProductImage.objects.create(product=product, image='products/a.jpg'))
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Phones', slug='phones')
+        self.pixel = self.product('Pixel 8', 'PX8', 'Android camera phone')
+        self.case = self.product('Leather case', 'CASE1', 'Fits the Pixel 8 and others')
+        self.index = search._index = ProductSearchIndex(stale_check_seconds=3600)
+        self.addCleanup(setattr, search, '_index', None)
+        self.index.rebuild()
+
+    def product(self, name, sku, description):
+        return Product.objects.create(name=name, sku=sku, description=description, price=Decimal('10.00'),
+                                      category=self.category)
+
+    def test_ranking_prefixes_and_typos(self):
+        # A name hit outranks the same word in a description.
+        self.assertEqual(self.index.search('pixel'), ([self.pixel.pk, self.case.pk], 2))
+        self.assertEqual(self.index.search('pix')[1], 2)
+        self.assertEqual(self.index.search('pxiel')[1], 2)
+        self.assertEqual(self.index.search('px8')[0], [self.pixel.pk])
+        self.assertEqual(self.index.search('phones camera')[0], [self.pixel.pk])
+        self.assertEqual(self.index.search('pixel', offset=1, limit=1), ([self.case.pk], 2))
+
+    def test_changes_apply_on_commit_in_one_batch(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            for i in range(20):
+                self.product(f'Galaxy {i}', f'GAL{i}', '')
+            self.pixel.delete()
+        # Nothing uncommitted is visible.
+        self.assertEqual(self.index.search('galaxy')[1], 0)
+        self.assertEqual(self.index.search('android')[1], 1)
+        for callback in callbacks:
+            callback()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.index.search('galaxy')[1], 20)
+        self.assertEqual(self.index.search('android')[1], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Handsets'
+            self.category.save()
+        self.assertEqual(self.index.search('handsets')[1], 21)
+
+    def test_refresh_picks_up_other_processes(self):
+        # Writes from elsewhere fire no signals here.
+        Product.objects.filter(pk=self.case.pk).update(name='Silicone sleeve', updated_at=timezone.now())
+        self.index.refresh()
+        self.assertEqual(self.index.search('sleeve')[0], [self.case.pk])
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM products_product WHERE id = %s', [self.pixel.pk])
+        self.index.refresh()
+        self.assertEqual(self.index.search('android')[1], 0)
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        self.electronics = Category.objects.create(name='Electronics', slug='electronics')
+        self.phones = Category.objects.create(name='Phones', slug='phones', parent=self.electronics)
+        self.smart = Category.objects.create(name='Smart', slug='smart', parent=self.phones)
+        self.books = Category.objects.create(name='Books', slug='books')
+
+    def test_subtree_queries(self):
+        self.assertEqual(self.smart.path, f'/{self.electronics.pk}/{self.phones.pk}/{self.smart.pk}/')
+        self.assertEqual(self.smart.depth, 2)
+        # "/<id>/" must not match the path of "/<id>0/".
+        lookalike = Category.objects.create(pk=self.electronics.pk * 10, name='Lookalike', slug='lookalike')
+        phone = Product.objects.create(name='Phone', description='', price=Decimal('1'), sku='P', category=self.smart)
+        Product.objects.create(name='Other', description='', price=Decimal('1'), sku='O', category=lookalike)
+        self.assertEqual(list(Product.objects.filter(self.electronics.subtree_filter('category__'))), [phone])
+        self.assertEqual(set(self.electronics.get_descendants()), {self.electronics, self.phones, self.smart})
+        self.assertEqual(list(self.phones.get_descendants(include_self=False)), [self.smart])
+        with self.assertNumQueries(1):
+            self.assertEqual([c.name for c in self.smart.get_ancestors()], ['Electronics', 'Phones', 'Smart'])
+
+    def test_moving_a_parent_re_roots_its_subtree(self):
+        self.phones.parent = self.books
+        self.phones.save()
+        self.smart.refresh_from_db()
+        self.assertEqual((self.smart.path, self.smart.depth), (f'/{self.books.pk}/{self.phones.pk}/{self.smart.pk}/', 2))
+        self.assertEqual(list(self.electronics.get_descendants(include_self=False)), [])
+
+        self.phones.parent = None
+        self.phones.save()
+        self.smart.refresh_from_db()
+        self.assertEqual((self.smart.path, self.smart.depth), (f'/{self.phones.pk}/{self.smart.pk}/', 1))
+
+        self.phones.parent = self.smart
+        with self.assertRaises(ValueError):
+            self.phones.save()
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        from PIL import Image
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings = override_settings(MEDIA_ROOT=self.media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        os.makedirs(os.path.join(self.media.name, 'products'))
+        os.makedirs(os.path.join(self.media.name, 'private'))
+        Image.new('RGB', (1200, 800), 'red').save(os.path.join(self.media.name, 'products', 'a.jpg'))
+        Image.new('RGB', (500, 500), 'blue').save(os.path.join(self.media.name, 'private', 'b.jpg'))
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        self.product = Product.objects.create(name='Phone', description='', price=Decimal('10.00'), sku='SKU0',
+                                              category=category, image='products/a.jpg')
+
+    def test_command_records_metadata_for_templates(self):
+        call_command('generate_thumbnails', '--workers', '1', stdout=io.StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.image_meta['name'], self.product.image_meta['width']), ('products/a.jpg', 1200))
+        from .templatetags.product_images import srcset, thumbnail
+        # Rendering needs only the row: no query and no file.
+        os.remove(os.path.join(self.media.name, 'products', 'a.jpg'))
+        with self.assertNumQueries(0):
+            entries = srcset(self.product.image, 'webp')
+        self.assertEqual([entry.rsplit(' ', 1)[1] for entry in entries.split(', ')], ['160w', '320w', '640w'])
+        self.assertTrue(thumbnail(self.product.image, 320).endswith('-320.jpg'))
+        for url in entries.split(', '):
+            self.assertTrue(os.path.exists(os.path.join(self.media.name, url.split()[0][len('/media/'):])))
+
+    def test_unrecorded_images_keep_their_original(self):
+        from .templatetags.product_images import srcset, thumbnail
+        self.assertEqual(srcset(self.product.image), '')
+        self.assertEqual(thumbnail(self.product.image), '/media/products/a.jpg')
+        self.product.image_meta = {'name': 'products/old.jpg', 'digest': 'ab' * 20, 'width': 800}
+        self.assertEqual(srcset(self.product.image), '')
+
+    def test_lazy_view_only_serves_product_images(self):
+        response = self.client.get('/thumb/320.jpeg/products/a.jpg')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(os.path.exists(os.path.join(self.media.name, response['Location'][len('/media/'):])))
+        for path in ('/thumb/320.jpeg/private/b.jpg', '/thumb/320.jpeg/products/../private/b.jpg',
+                     '/thumb/999.jpeg/products/a.jpg', '/thumb/320.gif/products/a.jpg'):
+            self.assertEqual(self.client.get(path).status_code, 404, path)
+
+    def test_decompression_bombs_are_refused(self):
+        from PIL import Image
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+        Image.MAX_IMAGE_PIXELS = 1000
+        self.assertEqual(self.client.get('/thumb/160.jpeg/products/a.jpg').status_code, 404)
+
+
+class BehaviorRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        category = Category.objects.create(name='Home', slug='home')
+        self.product = Product.objects.create(name='Lamp', description='', price=Decimal('1'), sku='L',
+                                              category=category)
+        self.today = timezone.localdate()
+
+    def log(self, days_ago, behavior_type, product=None, count=1, hour=12):
+        start = day_bounds(self.today - timedelta(days=days_ago))[0]
+        UserBehavior.objects.bulk_create(
+            UserBehavior(user=self.user, product=product, behavior_type=behavior_type,
+                         timestamp=start + timedelta(hours=hour))
+            for _ in range(count)
+        )
+
+    def rollups(self):
+        return {
+            (row.day, row.product_id, row.behavior_type): row.count
+            for row in UserBehaviorDaily.objects.all()
+        }
+
+    def test_compaction_preserves_counts(self):
+        self.log(40, 'view', self.product, count=3)
+        self.log(40, 'view', self.product, hour=23)
+        self.log(40, 'search', count=2)  # no product
+        self.log(35, 'purchase', self.product)
+        self.log(1, 'view', self.product, count=2)  # inside the retention window
+        before = behavior_counts()
+
+        cutoff = self.today - timedelta(days=30)
+        done = list(compact_behavior(before=cutoff))
+
+        # Only days with events are visited.
+        self.assertEqual([day for day, _ in done], [self.today - timedelta(days=40),
+                                                    self.today - timedelta(days=35)])
+        self.assertEqual(sum(rows for _, rows in done), 7)
+        day40, day35 = (self.today - timedelta(days=n) for n in (40, 35))
+        self.assertEqual(self.rollups(), {
+            (day40, self.product.pk, 'view'): 4,
+            (day40, None, 'search'): 2,
+            (day35, self.product.pk, 'purchase'): 1,
+        })
+        self.assertEqual(UserBehavior.objects.count(), 2)
+        self.assertEqual(behavior_counts(), before)
+        self.assertEqual(behavior_counts(behavior_types=['view'], since=self.today - timedelta(days=2)),
+                         {(self.user.pk, self.product.pk, 'view'): 2})
+
+    def test_late_events_merge_into_existing_rollups(self):
+        cutoff = self.today - timedelta(days=30)
+        self.log(40, 'search')
+        list(compact_behavior(before=cutoff))
+        self.log(40, 'search', count=2)
+        self.log(40, 'view', self.product)
+
+        # A second run only visits the day that got new events.
+        with self.assertNumQueries(9):
+            self.assertEqual([rows for _, rows in compact_behavior(before=cutoff)], [3])
+        day = self.today - timedelta(days=40)
+        self.assertEqual(self.rollups(), {(day, None, 'search'): 3, (day, self.product.pk, 'view'): 1})
+        self.assertFalse(UserBehavior.objects.exists())
+        with self.assertNumQueries(1):
+            self.assertEqual(list(compact_behavior(before=cutoff)), [])
+
+
+class RecordingEventQueue(BehaviorEventQueue):
+    """Collects batch sizes instead of inserting; the first ``failures`` writes fail"""
+
+    def __init__(self, failures=0, error=OperationalError, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        self.failures = failures
+        self.error = error
+
+    def _insert(self, events):
+        if self.failures:
+            self.failures -= 1
+            raise self.error('database is locked')
+        self.batches.append(len(events))
+
+    def wait_for(self, key, count, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while self.stats()[key] < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.stats()[key]
+
+
+class BehaviorEventQueueTests(TestCase):
+    def test_events_are_written_in_batches(self):
+        events = RecordingEventQueue(batch_size=3, flush_interval=0.2)
+        self.addCleanup(events.stop)
+        for _ in range(7):
+            self.assertTrue(events.record(1, 'view'))
+        self.assertEqual(events.wait_for('written', 7), 7)
+        self.assertEqual(events.batches, [3, 3, 1])
+
+    def test_stop_flushes_queued_events(self):
+        events = RecordingEventQueue(batch_size=100, flush_interval=60)
+        for _ in range(5):
+            events.record(1, 'view')
+        started = time.monotonic()
+        events.stop()
+        # The writer is woken instead of waiting out the flush interval.
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertFalse(events._thread.is_alive())
+        self.assertEqual(sum(events.batches), 5)
+        self.assertEqual(events.stats()['queued'], 0)
+
+    def test_transient_errors_are_retried(self):
+        events = RecordingEventQueue(failures=2, flush_interval=0, retry_backoff=0)
+        with self.assertLogs('products.events', 'WARNING'):
+            events.record(1, 'view')
+        stats = events.stats()
+        self.assertEqual((stats['written'], stats['retried'], stats['failed']), (1, 2, 0))
+        self.assertEqual(events.batches, [1])
+
+    def test_batch_is_requeued_after_the_last_attempt(self):
+        events = RecordingEventQueue(failures=3, max_attempts=3, retry_backoff=0, flush_interval=0.05)
+        self.addCleanup(events.stop)
+        with self.assertLogs('products.events', 'WARNING'):
+            for _ in range(4):
+                events.record(1, 'view')
+            self.assertEqual(events.wait_for('written', 4), 4)
+        stats = events.stats()
+        self.assertEqual((stats['requeued'], stats['failed']), (4, 0))
+
+    def test_requeue_keeps_what_fits(self):
+        events = RecordingEventQueue(max_queue=2)
+        with self.assertLogs('products.events', 'ERROR'):
+            events._requeue([(1, None, 'view', timezone.now(), '', {})] * 3)
+        stats = events.stats()
+        self.assertEqual((stats['queued'], stats['requeued'], stats['failed']), (2, 2, 1))
+
+    def test_bad_batches_fail_without_retrying(self):
+        events = RecordingEventQueue(failures=1, error=ValueError, flush_interval=0, retry_backoff=0)
+        with self.assertLogs('products.events', 'ERROR'):
+            events.record(1, 'view')
+        stats = events.stats()
+        self.assertEqual((stats['written'], stats['retried'], stats['failed']), (0, 0, 1))
+
+    def test_events_for_deleted_products_keep_the_event(self):
+        user = User.objects.create_user('shopper')
+        category = Category.objects.create(name='Home', slug='home')
+        product = Product.objects.create(name='Lamp', description='', price=Decimal('1'), sku='L',
+                                         category=category)
+        events = BehaviorEventQueue(flush_interval=0)
+        events.record(user.pk, 'view', product_id=product.pk)
+        events.record(user.pk, 'view', product_id=product.pk + 1)
+        self.assertEqual(UserBehavior.objects.count(), 2)
+        self.assertEqual(set(UserBehavior.objects.values_list('product_id', flat=True)), {product.pk, None})
+
+
+class CountingCatalog(TxtCatalog):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = self.loads = 0
+
+    def _stat_signature(self):
+        self.stats += 1
+        return super()._stat_signature()
+
+    def _load(self):
+        self.loads += 1
+        super()._load()
+
+
+class TxtCatalogTests(SimpleTestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'products.txt')
+        self.write('Red Phone', '100')
+        self.catalog = CountingCatalog(self.path, recheck_interval=0)
+
+    def write(self, name, price, path=None, mtime_ns=None):
+        with open(path or self.path, 'w', encoding='utf-8') as f:
+            f.write(f'Item Name,Price (INR),Image URL\n{name},{price},\n')
+        if mtime_ns is not None:
+            os.utime(path or self.path, ns=(mtime_ns, mtime_ns))
+
+    def names(self):
+        return [row['name'] for row in self.catalog.all()]
+
+    def test_search(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('Blue Phone,200,\nRed Lamp,300,\n')
+        self.assertEqual([row['name'] for row in self.catalog.search('RED')], ['Red Phone', 'Red Lamp'])
+        self.assertEqual([row['name'] for row in self.catalog.search('phone')], ['Red Phone', 'Blue Phone'])
+        self.assertEqual(self.catalog.search('phone\nred'), [])
+
+    def test_reloads_when_the_file_changes(self):
+        self.assertEqual(self.names(), ['Red Phone'])
+        self.assertEqual(self.names(), ['Red Phone'])
+        self.assertEqual(self.catalog.loads, 1)
+        mtime_ns = os.stat(self.path).st_mtime_ns
+
+        # Same inode and size, new mtime.
+        self.write('Tan Phone', '100', mtime_ns=mtime_ns + 10**9)
+        self.assertEqual(self.names(), ['Tan Phone'])
+
+        # Same inode and mtime, new size.
+        self.write('Tan Phones', '100', mtime_ns=mtime_ns + 10**9)
+        self.assertEqual(self.names(), ['Tan Phones'])
+
+        # Same size and mtime, new inode (the file was replaced).
+        replacement = f'{self.path}.new'
+        self.write('Tin Phones', '100', path=replacement, mtime_ns=mtime_ns + 10**9)
+        os.replace(replacement, self.path)
+        self.assertEqual(self.names(), ['Tin Phones'])
+        self.assertEqual(self.catalog.loads, 4)
+
+    def test_checks_are_throttled(self):
+        catalog = CountingCatalog(self.path, recheck_interval=60)
+        self.assertEqual(len(catalog), 1)
+        self.write('Red Phones', '100')
+        self.assertEqual(catalog.names, ('Red Phone',))
+        self.assertEqual((catalog.stats, catalog.loads), (1, 1))
+
+    def test_missing_file_is_throttled_too(self):
+        catalog = CountingCatalog(f'{self.path}.missing', recheck_interval=60)
+        for _ in range(3):
+            self.assertEqual(catalog.all(), [])
+        self.assertEqual((catalog.stats, catalog.loads), (1, 0))
+
+
+class ViewCounterTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Home', slug='home')
+        self.products = [
+            Product.objects.create(name=f'Lamp {i}', description='', price=Decimal('1'), sku=f'L{i}',
+                                   category=category)
+            for i in range(3)
+        ]
+        self.counter = ViewCounter(flush_interval=60, shards=2)
+        self.addCleanup(self.counter.stop)
+
+    def views(self):
+        return {
+            'product': dict(Product.objects.values_list('pk', 'views_count')),
+            'daily': dict(ProductAnalytics.objects.filter(date=timezone.localdate())
+                          .values_list('product_id', 'views')),
+        }
+
+    def test_concurrent_increments_are_summed_per_shard(self):
+        def view():
+            for _ in range(100):
+                for product in self.products:
+                    self.counter.increment(product.pk)
+
+        threads = [threading.Thread(target=view) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for product in self.products:
+            self.assertEqual(self.counter.pending(product.pk), 400)
+            lock, counts = self.counter._shards[product.pk % 2]
+            self.assertIn(product.pk, counts)
+
+        self.assertEqual(self.counter.flush(), 1200)
+        self.assertEqual(self.counter.pending(self.products[0].pk), 0)
+        expected = {product.pk: 400 for product in self.products}
+        self.assertEqual(self.views(), {'product': expected, 'daily': expected})
+
+    def test_flush_adds_to_todays_row(self):
+        first, second, third = self.products
+        ProductAnalytics.objects.create(product=first, date=timezone.localdate(), views=5)
+        for pk, n in ((first.pk, 1), (second.pk, 1), (third.pk, 2)):
+            self.counter.increment(pk, n)
+        # Existence check, insert of missing rows, and one pair of UPDATEs
+        # per distinct delta, in a transaction.
+        with self.assertNumQueries(8):
+            self.assertEqual(self.counter.flush(), 4)
+        self.assertEqual(self.views(), {
+            'product': {first.pk: 1, second.pk: 1, third.pk: 2},
+            'daily': {first.pk: 6, second.pk: 1, third.pk: 2},
+        })
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counter.flush(), 0)
+
+    def test_deleted_products_are_skipped(self):
+        pk = self.products[0].pk
+        self.counter.increment(pk)
+        self.counter.increment(self.products[1].pk)
+        self.products[0].delete()
+        self.assertEqual(self.counter.flush(), 1)
+        self.assertEqual(self.views()['daily'], {self.products[1].pk: 1})
+
+    def test_synchronous_mode_writes_each_view(self):
+        counter = ViewCounter(flush_interval=0)
+        counter.increment(self.products[0].pk)
+        self.assertEqual(self.views()['product'][self.products[0].pk], 1)
+        self.assertIsNone(counter._thread)
+
+
+class CatalogImportTests(TestCase):
+    def test_bad_prices_skip_only_their_row(self):
+        rows = [
+            {'sku': 'GOOD', 'name': 'Good', 'price': '1,499.999'},
+            {'sku': 'NAN', 'name': 'Not a number', 'price': 'NaN'},
+            {'sku': 'INF', 'name': 'Infinite', 'price': '-Infinity'},
+            {'sku': 'HUGE', 'name': 'Too large', 'price': '100000000'},
+            {'sku': 'FAR', 'name': 'Far too large', 'price': '1e40'},
+            {'sku': 'BAD', 'name': 'Bad original', 'price': '5', 'original_price': 'sNaN'},
+        ]
+        importer = CatalogImporter(chunk_size=10)
+        stats = importer.run(enumerate(rows, 1))
+        self.assertEqual((stats['upserted'], stats['skipped']), (1, 5))
+        self.assertEqual([line for line, _ in importer.errors], [2, 3, 4, 5, 6])
+        self.assertEqual(Product.objects.get().price, Decimal('1500.00'))
+
+    def test_bad_rows_are_reported_not_raised(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.jsonl')
+            with open(path, 'w') as f:
+                f.write('{"sku": "GOOD", "name": "Good", "price": "5"}\n[1, 2]\n7\n"text"\nnull\n')
+                f.write(json.dumps({'sku': 'S' * 51, 'name': 'Long', 'price': '5'}) + '\n')
+                f.write(json.dumps({'sku': 'URL', 'name': 'Url', 'price': '5', 'image_url': 'x' * 501}) + '\n')
+            importer = CatalogImporter(chunk_size=10)
+            stats = importer.run(iter_rows(path))
+        self.assertEqual((stats['upserted'], stats['skipped']), (1, 6))
+        self.assertEqual([line for line, _ in importer.errors], [2, 3, 4, 5, 6, 7])
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['GOOD'])
+
+
+class TxtSyncTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'products.txt')
+        self.rows = {'Desk Lamp': ('1,299', ''), 'Floor Lamp': ('4999', 'https://img.example/floor.jpg'),
+                     'Night Lamp': ('499', '')}
+
+    def sync(self, **kwargs):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('Item Name,Price (INR),Image URL\n')
+            for name, (price, image_url) in self.rows.items():
+                f.write(f'{name},"{price}",{image_url}\n')
+        return sync_products_txt(self.path, **kwargs)
+
+    def counts(self, stats):
+        return {key: stats[key] for key in ('inserted', 'updated', 'deactivated', 'unchanged')}
+
+    def products(self):
+        return {name: (price, image_url, is_active) for name, price, image_url, is_active
+                in Product.objects.values_list('name', 'price', 'image_url', 'is_active')}
+
+    def test_only_changed_rows_are_written(self):
+        stats = self.sync()
+        self.assertEqual(self.counts(stats), {'inserted': 3, 'updated': 0, 'deactivated': 0, 'unchanged': 0})
+        self.assertEqual(self.products()['Desk Lamp'], (Decimal('1299.00'), None, True))
+        fingerprints = dict(Product.objects.values_list('name', 'source_fingerprint'))
+
+        # Nothing changed: one scan of the fingerprints and no writes.
+        with self.assertNumQueries(1):
+            stats = self.sync()
+        self.assertEqual(self.counts(stats), {'inserted': 0, 'updated': 0, 'deactivated': 0, 'unchanged': 3})
+
+        self.rows['Desk Lamp'] = ('1,399', '')
+        self.rows['Night Lamp'] = ('499', 'https://img.example/night.jpg')
+        stats = self.sync()
+        self.assertEqual(self.counts(stats), {'inserted': 0, 'updated': 2, 'deactivated': 0, 'unchanged': 1})
+        products = self.products()
+        self.assertEqual(products['Desk Lamp'][0], Decimal('1399.00'))
+        self.assertEqual(products['Night Lamp'][1], 'https://img.example/night.jpg')
+        changed = {name for name, value in Product.objects.values_list('name', 'source_fingerprint')
+                   if value != fingerprints[name]}
+        self.assertEqual(changed, {'Desk Lamp', 'Night Lamp'})
+
+    def test_removed_rows_are_deactivated_and_come_back(self):
+        self.sync()
+        category = Category.objects.get()
+        Product.objects.create(name='Manual', description='', price=Decimal('1'), sku='MANUAL', category=category)
+
+        removed = self.rows.pop('Floor Lamp')
+        stats = self.sync(dry_run=True)
+        self.assertEqual(stats['deactivated'], 1)
+        self.assertTrue(Product.objects.get(name='Floor Lamp').is_active)
+
+        stats = self.sync()
+        self.assertEqual(self.counts(stats), {'inserted': 0, 'updated': 0, 'deactivated': 1, 'unchanged': 2})
+        self.assertEqual({name for name, (_, _, active) in self.products().items() if not active}, {'Floor Lamp'})
+        # Products the file does not own are left alone.
+        self.assertTrue(Product.objects.get(sku='MANUAL').is_active)
+        self.assertEqual(sum(ProductFacetCount.objects.values_list('count', flat=True)), 3)
+
+        self.rows['Floor Lamp'] = removed
+        stats = self.sync()
+        self.assertEqual(self.counts(stats), {'inserted': 0, 'updated': 1, 'deactivated': 0, 'unchanged': 2})
+        self.assertTrue(Product.objects.get(name='Floor Lamp').is_active)
+
+
+class SyntheticDataTests(TestCase):
+    volumes = ('--users', '20', '--products', '50', '--carts', '5', '--orders', '30', '--reviews', '40',
+               '--events', '500', '--batch-size', '64')
+
+    def generate(self, *args):
+        call_command('generate_synthetic_data', '--seed', '7', *self.volumes, *args, stdout=io.StringIO())
+
+    def snapshot(self):
+        """Generated content, independent of primary keys and the current time"""
+        return {
+            'products': list(Product.objects.order_by('sku').values_list(
+                'sku', 'price', 'stock', 'category__slug', 'sales_count', 'views_count', 'rating_count')),
+            'orders': list(Order.objects.order_by('order_id').values_list(
+                'order_id', 'user__username', 'status', 'total', 'item_count')),
+            'events': list(UserBehavior.objects.order_by('pk').values_list(
+                'user__username', 'product__sku', 'behavior_type', 'session_id')),
+        }
+
+    def test_volumes_and_aggregates_are_consistent(self):
+        self.generate()
+        self.assertEqual(User.objects.filter(username__startswith='syn7_').count(), 20)
+        self.assertEqual(Product.objects.count(), 50)
+        self.assertEqual(Category.objects.count(), 8 * (1 + 4 * (1 + 3)))
+        self.assertEqual(Order.objects.count(), 30)
+        self.assertEqual(UserBehavior.objects.count(), 500)
+        reviews = ProductReview.objects.count()
+        self.assertLessEqual(reviews, 40)
+        self.assertFalse(UserBehavior.objects.filter(behavior_type='search', product__isnull=False).exists())
+        self.assertFalse(Product.objects.exclude(category__depth=2).exists())
+
+        for order in Order.objects.annotate(lines=Count('items')):
+            self.assertEqual(order.total, order.subtotal + order.tax + order.shipping_cost)
+            self.assertEqual(order.item_count, order.lines)
+        totals = Product.objects.aggregate(sold=Sum('sales_count'), views=Sum('views_count'),
+                                           ratings=Sum('rating_count'))
+        sold = OrderItem.objects.exclude(order__status__in=['cancelled', 'refunded']).aggregate(n=Sum('quantity'))['n']
+        self.assertEqual(totals, {
+            'sold': sold,
+            'views': UserBehavior.objects.filter(behavior_type='view').count(),
+            'ratings': reviews,
+        })
+        self.assertEqual(sum(ProductFacetCount.objects.values_list('count', flat=True)), 50)
+
+    def test_same_seed_gives_the_same_data(self):
+        self.generate()
+        first = self.snapshot()
+        with self.assertRaises(CommandError):
+            self.generate()
+        self.generate('--flush')
+        self.assertEqual(self.snapshot(), first)
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Slow image host with ETags that records concurrency and requests"""
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+            cls.requests.append((self.path, self.headers.get('If-None-Match')))
+        try:
+            time.sleep(0.05)
+            if self.path.startswith('/missing'):
+                self.send_response(404)
+                self.end_headers()
+                return
+            if self.path.startswith('/page'):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.end_headers()
+                self.wfile.write(b'<html></html>')
+                return
+            etag = f'"{self.path}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = b'\x89PNG' + self.path.encode() * 100
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+
+class ImageFetcherTests(SimpleTestCase):
+    def setUp(self):
+        ImageHandler.peak = 0
+        ImageHandler.requests = []
+        self.server = StubServer(ImageHandler)
+        self.addCleanup(self.server.close)
+        self.fetcher = ImageFetcher(tempfile.mkdtemp(), max_workers=8, per_host=3, timeout=2)
+        self.images = [f'{self.server.url}/image{i}.png' for i in range(12)]
+
+    def test_fetches_in_parallel_within_the_host_limit(self):
+        urls = self.images + [f'{self.server.url}/missing.png', f'{self.server.url}/page',
+                              'http://127.0.0.1:1/refused.png', self.images[0]]
+        started = time.monotonic()
+        summary = summarize(self.fetcher.fetch_all(urls), time.monotonic() - started)
+        self.assertEqual(summary['statuses'], {'fetched': 12, 'error': 2, 'invalid': 1})
+        self.assertLessEqual(ImageHandler.peak, 3)
+        # One at a time would take 13 x 50ms.
+        self.assertLess(summary['elapsed'], 0.5)
+
+    def test_revalidates_and_honours_max_age(self):
+        self.fetcher.fetch_all(self.images)
+        ImageHandler.requests = []
+        summary = summarize(self.fetcher.fetch_all(self.images), 1)
+        self.assertEqual(summary['statuses'], {'not_modified': 12})
+        self.assertTrue(all(etag for _, etag in ImageHandler.requests))
+
+        self.fetcher.max_age = 60
+        ImageHandler.requests = []
+        summary = summarize(self.fetcher.fetch_all(self.images), 1)
+        self.assertEqual(summary['statuses'], {'fresh': 12})
+        self.assertEqual(ImageHandler.requests, [])
+
+
+class GeminiHandler(BaseHTTPRequestHandler):
+    """generateContent stand-in: 'Flaky' fails once with a 503, 'Bad' always gets a 400,
+    'Huge' gets a price too large to store"""
+    lock = threading.Lock()
+    calls = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['contents'][0]['parts'][0]['text']
+        name = prompt.split(' of ')[1].split(' in India')[0]
+        cls = type(self)
+        with cls.lock:
+            first = name not in cls.calls
+            cls.calls.append(name)
+        if name == 'Flaky' and first:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        if name == 'Bad':
+            self.send_response(400)
+            self.end_headers()
+            return
+        text = '₹123,456,789,012' if name == 'Huge' else '₹85,999.50 approximately'
+        answer = {'candidates': [{'content': {'parts': [{'text': text}]}}]}
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(answer).encode())
+
+
+class MarketPriceTests(TestCase):
+    def setUp(self):
+        GeminiHandler.calls = []
+        self.server = StubServer(GeminiHandler)
+        self.addCleanup(self.server.close)
+        cache_file = os.path.join(tempfile.mkdtemp(), 'market_prices.json')
+        settings = override_settings(MARKET_PRICE_CACHE_FILE=cache_file)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        for i, name in enumerate(['Phone', 'Laptop', 'Tablet', 'Flaky', 'Bad', 'Huge']):
+            Product.objects.create(name=name, description='', price=Decimal('100'), sku=f'SKU{i}', category=category)
+
+    def update_prices(self, *args):
+        call_command('update_prices_with_gemini', '--base-url', f'{self.server.url}/', '--rate', '20', *args,
+                     stdout=io.StringIO())
+
+    def test_parse_price(self):
+        self.assertEqual(parse_price('₹85,999.50 approximately'), Decimal('85999.50'))
+        self.assertEqual(parse_price('85000'), Decimal('85000'))
+        self.assertIsNone(parse_price('no idea'))
+        # Rounded to Product.price's two places; rejected if it cannot be stored.
+        self.assertEqual(str(parse_price('about 85,999.456')), '85999.46')
+        self.assertIsNone(parse_price('0.004'))
+        self.assertIsNone(parse_price('₹123,456,789,012'))
+        self.assertEqual(parse_price('999', max_digits=3, decimal_places=0), Decimal('999'))
+        self.assertIsNone(parse_price('1000', max_digits=3, decimal_places=0))
+
+    def test_retries_transient_errors_and_caches_answers(self):
+        self.update_prices('--burst', '3')
+        self.assertEqual(Product.objects.filter(price=Decimal('85999.50')).count(), 4)
+        self.assertEqual(Product.objects.get(name='Bad').price, Decimal('100'))
+        self.assertEqual(Product.objects.get(name='Huge').price, Decimal('100'))
+        self.assertEqual(GeminiHandler.calls.count('Flaky'), 2)
+
+        GeminiHandler.calls = []
+        self.update_prices()
+        self.assertEqual(sorted(GeminiHandler.calls), ['Bad', 'Huge'])
+
+    def test_token_bucket_paces_requests(self):
+        bucket = TokenBucket(20, 1)
+        started = time.monotonic()
+        for _ in range(11):
+            bucket.acquire()
+        self.assertGreater(time.monotonic() - started, 0.45)
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret')
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        self.phone = Product.objects.create(name='Phone', description='', price=Decimal('10.00'), sku='P',
+                                            category=category, ai_recommended_price=Decimal('8.00'))
+        self.case = Product.objects.create(name='Case', description='', price=Decimal('2.50'), sku='C',
+                                           category=category, ai_recommended_price=Decimal('3.00'))
+        self.store = get_cart_store()
+        self.store.cache.clear()
+        self.addCleanup(self.store.cache.clear)
+
+    def request(self, user=None, session=None):
+        request = RequestFactory().get('/')
+        request.user = user or self.user
+        request.session = session if session is not None else {}
+        return request
+
+    def test_summary_is_one_query(self):
+        with self.assertNumQueries(1):
+            summary = summarize_quantities({self.case.pk: 2, self.phone.pk + 100: 1, self.phone.pk: 3})
+        with self.assertNumQueries(0):
+            self.assertEqual([(item.product.name, item.product.category.name, item.unit_price, item.line_total)
+                              for item in summary],
+                             [('Case', 'Electronics', Decimal('2.50'), Decimal('5.00')),
+                              ('Phone', 'Electronics', Decimal('8.00'), Decimal('24.00'))])
+        self.assertEqual((summary.subtotal, summary.item_count, len(summary)), (Decimal('29.00'), 5, 2))
+        with self.assertNumQueries(0):
+            self.assertFalse(summarize_quantities({}))
+
+    def test_summary_is_built_once_per_request(self):
+        self.store.add(self.store.user_key(self.user.pk), self.phone.pk, 2)
+        request = self.request()
+        # The cart lines, then the products.
+        with self.assertNumQueries(2):
+            summary = get_cart_summary(request)
+        with self.assertNumQueries(0):
+            self.assertIs(get_cart_summary(request), summary)
+            self.assertEqual(cart_item_count(request), 2)
+            self.assertEqual(cart_context(request)['cart_count'], 2)
+
+        self.store.add(self.store.user_key(self.user.pk), self.phone.pk, 1)
+        invalidate_cart_summary(request)
+        with self.assertNumQueries(2):
+            self.assertEqual(get_cart_summary(request).item_count, 3)
+
+    def test_badge_count_skips_the_products(self):
+        self.store.add(self.store.user_key(self.user.pk), self.phone.pk, 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart_item_count(self.request()), 2)
+
+        anonymous = self.request(AnonymousUser(), {'cart_token': 'visitor'})
+        self.store.add(self.store.anonymous_key('visitor'), self.case.pk, 4)
+        with self.assertNumQueries(0):
+            context = cart_context(anonymous)
+            self.assertEqual(context['cart_count'], 4)
+            self.assertEqual(cart_context(self.request(AnonymousUser()))['cart_count'], 0)
+
+    def test_cart_page_queries(self):
+        self.client.force_login(self.user)
+        self.store.add(self.store.user_key(self.user.pk), self.phone.pk, 2)
+        self.store.add(self.store.user_key(self.user.pk), self.case.pk, 1)
+        # Session, user, cart lines and products; the navbar badge reuses the summary.
+        with self.assertNumQueries(4):
+            response = self.client.get('/cart/')
+        self.assertEqual(response.context['summary'].subtotal, Decimal('18.50'))
+
+
+class CartStoreTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret')
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        self.product = Product.objects.create(name='Phone', description='', price=Decimal('10.00'),
+                                              sku='SKU0', category=category)
+        self.store = get_cart_store()
+        self.key = self.store.user_key(self.user.pk)
+
+    def test_user_cart_lives_in_the_database(self):
+        self.assertEqual(self.store.add(self.key, self.product.pk, 2), 2)
+        self.assertEqual(self.store.add(self.key, self.product.pk, 3), 5)
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 5)
+        self.store.cache.clear()
+        self.assertEqual(self.store.items(self.key), {self.product.pk: 5})
+        self.assertEqual(self.store.apply(self.key, [('set', self.product.pk, 1), ('add', self.product.pk, -1)]),
+                         [(5, 1), (1, 0)])
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_add_to_cart_is_one_upsert(self):
+        self.client.force_login(self.user)
+        self.store.add(self.key, self.product.pk, 1)
+        # Session, user, product and the upsert; before the store this was
+        # six queries (eight for a new line) and the cache-backed store
+        # needed over thirty.
+        with self.assertNumQueries(4):
+            self.client.post(f'/cart/add/{self.product.pk}/', {'quantity': 2})
+        self.assertEqual(self.store.items(self.key), {self.product.pk: 3})
+
+    def test_anonymous_cart_merges_at_login(self):
+        anonymous = self.store.anonymous_key('visitor')
+        self.store.add(anonymous, self.product.pk, 1)
+        self.store.add(self.key, self.product.pk, 2)
+        self.assertEqual(self.store.merge(anonymous, self.user.pk), 1)
+        self.assertEqual(self.store.items(anonymous), {})
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 3)
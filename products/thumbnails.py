@@ -0,0 +1,175 @@
+import hashlib
+import os
+import threading
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.conf import settings
+
+# Derivative widths in CSS pixels; cards render at ~320px, detail at ~640px.
+WIDTHS = (160, 320, 640)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+THUMB_DIR = 'thumbs'
+
+# Hosts that resize on the fly through ``w``/``h`` query parameters
+RESIZING_HOSTS = ('images.unsplash.com',)
+
+
+def _media_root():
+    return str(settings.MEDIA_ROOT)
+
+
+def source_path(name, media_root=None):
+    """Absolute path of a stored image, or ``None`` if it escapes MEDIA_ROOT"""
+    root = os.path.realpath(media_root or _media_root())
+    path = os.path.realpath(os.path.join(root, name))
+    if not path.startswith(root + os.sep):
+        return None
+    return path
+
+
+def _open(path):
+    from PIL import Image
+    try:
+        return Image.open(path)
+    except Image.DecompressionBombError as exc:
+        raise ValueError(f'Refusing to decode {os.path.basename(path)}: {exc}')
+
+
+def is_product_image(name):
+    """Whether ``name`` lives where product images are uploaded"""
+    from .models import Product, ProductImage
+    return any(name.startswith(field.upload_to) for field in (
+        Product._meta.get_field('image'), ProductImage._meta.get_field('image'),
+    ))
+
+
+@lru_cache(maxsize=4096)
+def _describe(path, size, mtime_ns):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    with _open(path) as image:
+        width = image.width
+    return digest.hexdigest(), width
+
+
+def describe(path):
+    """Return ``(content digest, pixel width)`` of an image file, memoized by stat"""
+    st = os.stat(path)
+    return _describe(path, st.st_size, st.st_mtime_ns)
+
+
+def widths_for(source_width):
+    """Derivative widths for a source, never upscaling"""
+    return sorted({min(width, source_width) for width in WIDTHS})
+
+
+def derivative_name(digest, width, fmt):
+    """Content-addressed path of a derivative, relative to MEDIA_ROOT"""
+    ext = 'jpg' if fmt == 'jpeg' else fmt
+    return f'{THUMB_DIR}/{digest[:2]}/{digest}-{width}.{ext}'
+
+
+def render(path, width, fmt, target):
+    """Write one derivative of ``path`` to ``target`` atomically"""
+    from PIL import Image, ImageOps
+    pil_format, options = FORMATS[fmt]
+    with _open(path) as image:
+        image.draft('RGB', (width, width))  # cheap JPEG downscale while decoding
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        if fmt == 'jpeg' or not has_alpha:
+            image = image.convert('RGB')
+        elif image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+        image.save(tmp, pil_format, **options)
+    os.replace(tmp, target)
+
+
+def ensure_derivative(name, width, fmt, media_root=None):
+    """Return the derivative's MEDIA_ROOT-relative name, generating it if missing"""
+    media_root = media_root or _media_root()
+    path = source_path(name, media_root)
+    if path is None or fmt not in FORMATS or not is_product_image(
+        os.path.relpath(path, os.path.realpath(media_root)).replace(os.sep, '/')
+    ):
+        raise ValueError(f'Not a thumbnailable image: {name}')
+    digest, source_width = describe(path)
+    if width not in widths_for(source_width):
+        raise ValueError(f'Unsupported width {width} for {name}')
+    relative = derivative_name(digest, width, fmt)
+    target = os.path.join(media_root, relative)
+    if not os.path.exists(target):
+        render(path, width, fmt, target)
+    return relative
+
+
+def generate_all(name, media_root=None):
+    """Eagerly create every derivative of one image
+
+    Returns ``(new derivatives, image_meta)``, where ``image_meta`` is
+    ``None`` for a missing file. Takes only plain strings so it can run in
+    a worker process.
+    """
+    media_root = media_root or _media_root()
+    path = source_path(name, media_root)
+    if path is None or not os.path.exists(path):
+        return 0, None
+    digest, source_width = describe(path)
+    created = 0
+    for fmt in FORMATS:
+        for width in widths_for(source_width):
+            target = os.path.join(media_root, derivative_name(digest, width, fmt))
+            if not os.path.exists(target):
+                render(path, width, fmt, target)
+                created += 1
+    return created, {'name': name, 'digest': digest, 'width': source_width}
+
+
+def srcset_entries(name, meta, fmt):
+    """``[(url, width)]`` for a stored image, from its recorded ``image_meta``
+
+    Touches neither the file system nor the database; the derivatives
+    generate_thumbnails rendered are linked directly under MEDIA_URL.
+    Images it has not described yet, or described under another file
+    name, get ``[]`` and keep their original ``src``.
+    """
+    if not meta or meta.get('name') != name:
+        return []
+    return [(settings.MEDIA_URL + derivative_name(meta['digest'], width, fmt), width)
+            for width in widths_for(meta['width'])]
+
+
+def resized_url(url, width):
+    """Ask a resizing image host for ``width`` pixels, keeping the aspect ratio"""
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    try:
+        old_width = int(query.get('w', 0))
+    except ValueError:
+        old_width = 0
+    if old_width and 'h' in query:
+        try:
+            query['h'] = str(max(1, round(int(query['h']) * width / old_width)))
+        except ValueError:
+            pass
+    query['w'] = str(width)
+    query.setdefault('auto', 'format')  # lets the host negotiate WebP/AVIF
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def url_srcset_entries(url):
+    """``[(url, width)]`` for an external image, when its host can resize"""
+    if urlsplit(url).hostname not in RESIZING_HOSTS:
+        return []
+    return [(resized_url(url, width), width) for width in WIDTHS]
@@ -0,0 +1,95 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .catalog_io import (
+    CHUNK_SIZE, DEFAULT_CATEGORY, DERIVED_SKU_PREFIX, CatalogImporter, RowError, clean_row, iter_rows,
+)
+
+
+def default_path():
+    return os.path.join(settings.BASE_DIR, 'products.txt')
+
+
+def fingerprint(name, price, image_url):
+    """Hash of the columns products.txt owns"""
+    raw = '\x1f'.join([name, f'{price:.2f}', image_url or ''])
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def read_rows(path):
+    """Return ``({sku: values}, errors)`` for every valid products.txt row"""
+    rows, errors = {}, []
+    for line_number, row in iter_rows(path, 'csv'):
+        try:
+            values = clean_row(row)
+        except RowError as exc:
+            errors.append((line_number, str(exc)))
+            continue
+        values = {key: values.get(key) for key in ('sku', 'name', 'price', 'image_url')}
+        values['source_fingerprint'] = fingerprint(values['name'], values['price'], values['image_url'])
+        rows[values['sku']] = values  # later duplicates win, as in the importer
+    return rows, errors
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def sync_products_txt(path=None, dry_run=False, default_category=DEFAULT_CATEGORY, chunk_size=CHUNK_SIZE):
+    """Bring the Product table in line with products.txt, touching only changes
+
+    Every row is fingerprinted and compared with ``Product.source_fingerprint``
+    in memory; only new or changed rows are upserted and only products that
+    disappeared from the file are deactivated, so a sync with few changes
+    costs one read of the file, one narrow scan of the table and a handful of
+    bulk statements. Returns a stats dict; ``errors`` lists skipped lines.
+    """
+    from .facets import rebuild_facet_counts
+    from .models import Product
+
+    rows, errors = read_rows(path or default_path())
+
+    # Products owned by the file: ones it created (derived SKUs) and ones a
+    # previous sync has fingerprinted.
+    existing = {
+        sku: (stored, is_active)
+        for sku, stored, is_active in Product.objects.filter(
+            Q(sku__startswith=DERIVED_SKU_PREFIX) | ~Q(source_fingerprint='')
+        ).values_list('sku', 'source_fingerprint', 'is_active').iterator(chunk_size=chunk_size)
+    }
+
+    inserts, updates = [], []
+    for sku, values in rows.items():
+        current = existing.get(sku)
+        if current is None:
+            inserts.append(values)
+        elif current != (values['source_fingerprint'], True):
+            updates.append(values)
+    deactivate = [sku for sku, (_, is_active) in existing.items() if is_active and sku not in rows]
+
+    stats = {
+        'rows': len(rows), 'inserted': len(inserts), 'updated': len(updates),
+        'deactivated': len(deactivate), 'unchanged': len(rows) - len(inserts) - len(updates),
+        'errors': errors,
+    }
+    if dry_run or not (inserts or updates or deactivate):
+        return stats
+
+    # Both inserts and updates go through the importer's upsert; rows carry
+    # is_active so a product that reappears in the file is reactivated.
+    importer = CatalogImporter(default_category=default_category, chunk_size=chunk_size)
+    for chunk in _chunks(inserts + updates, chunk_size):
+        importer.write_chunk([dict(values, is_active=True) for values in chunk])
+    now = timezone.now()
+    for chunk in _chunks(deactivate, chunk_size):
+        Product.objects.filter(sku__in=chunk).update(is_active=False, updated_at=now)
+
+    # Bulk writes bypass post_save, so refresh the facet cube once.
+    rebuild_facet_counts()
+    return stats
@@ -6,12 +6,13 @@ app_name = 'products'
 urlpatterns = [
     path('', views.product_list, name='product_list'),
     path('product/<int:pk>/', views.product_detail, name='product_detail'),
+    path('thumb/<int:width>.<slug:fmt>/<path:name>', views.product_thumbnail, name='thumbnail'),
     path('category/<slug:slug>/', views.category_products, name='category_products'),
     path('search/', views.search_products, name='search_products'),
     path('cart/', views.cart_view, name='cart_view'),
     path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('cart/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
-    path('cart/update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
+    path('cart/remove/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/update/<int:product_id>/', views.update_cart_item, name='update_cart_item'),
     path('dynamic-products/', views.dynamic_products_txt, name='dynamic_products_txt'),
 ]
 
@@ -1,174 +1,145 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db.models import Q
-from django.http import JsonResponse
-from .models import Product, Category, Cart, CartItem, UserBehavior
-import uuid
+from django.http import Http404, JsonResponse
+from django.conf import settings
+from .models import Product, Category
+from . import facets, listing, search, thumbnails
+from .cart_store import get_cart_store
+from .carts import get_cart_summary
+from .counters import get_view_counter
+from .events import track_behavior
+from urllib.parse import urlencode
+
+def _listing_context(request, queryset, filter_params=None):
+    sort = request.GET.get('sort', listing.DEFAULT_SORT)
+    if sort not in listing.SORT_OPTIONS:
+        sort = listing.DEFAULT_SORT
+    products, next_cursor = listing.keyset_page(
+        listing.card_queryset(queryset), sort, request.GET.get('after')
+    )
+    return {
+        'products': products,
+        'sort': sort,
+        'sort_choices': listing.sort_choices(),
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('after'),
+        'filter_params': filter_params or {},
+        'filter_query': urlencode(filter_params or {}),
+    }
 
 def product_list(request):
-    products = Product.objects.filter(is_active=True)
-    categories = Category.objects.all()
+    categories = list(Category.objects.all())
+    filters = facets.FacetFilters(request.GET, facets.CategoryTree.from_categories(categories))
     
     # Track user behavior if logged in
-    if request.user.is_authenticated:
-        session_id = request.session.session_key or str(uuid.uuid4())
-        UserBehavior.objects.create(
-            user=request.user,
-            behavior_type='view',
-            session_id=session_id,
-            metadata={'page': 'product_list'}
-        )
+    track_behavior(request, 'view', metadata={'page': 'product_list'})
     
-    return render(request, 'products/product_list.html', {
-        'products': products,
-        'categories': categories
-    })
+    context = _listing_context(
+        request, filters.apply(Product.objects.filter(is_active=True)), filters.params()
+    )
+    context['categories'] = categories
+    context['facets'] = filters.counts()
+    return render(request, 'products/product_list.html', context)
 
 # --- Dynamic products from products.txt ---
-import os
-import csv
-from django.conf import settings
+from .catalog import get_catalog
 
 def dynamic_products_txt(request):
-    products = []
-    file_path = os.path.join(settings.BASE_DIR, 'products.txt')
-    try:
-        with open(file_path, encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                # Normalize keys for template
-                products.append({
-                    'name': row.get('Item Name', '').strip(),
-                    'price': row.get('Price (INR)', '').strip(),
-                    'image_url': row.get('Image URL', '').strip(),
-                })
-    except Exception as e:
-        products = []
+    products = get_catalog().all()
     return render(request, 'products/dynamic_products_txt.html', {'products': products})
 
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk, is_active=True)
+    product = get_object_or_404(Product.objects.select_related('category'), pk=pk, is_active=True)
     
-    # Update view count
+    # Count the view; the counter writes it back in batches
+    get_view_counter().increment(product.pk)
     product.views_count += 1
-    product.save()
     
     # Track user behavior
-    if request.user.is_authenticated:
-        session_id = request.session.session_key or str(uuid.uuid4())
-        UserBehavior.objects.create(
-            user=request.user,
-            product=product,
-            behavior_type='view',
-            session_id=session_id
-        )
+    track_behavior(request, 'view', product)
     
-    return render(request, 'products/product_detail.html', {'product': product})
+    return render(request, 'products/product_detail.html', {
+        'product': product,
+        'breadcrumbs': product.category.get_ancestors(),
+    })
+
+def product_thumbnail(request, width, fmt, name):
+    """Render a missing thumbnail on first request, then hand off to MEDIA_URL"""
+    try:
+        relative = thumbnails.ensure_derivative(name, width, fmt)
+    except (ValueError, OSError):
+        raise Http404('No such image')
+    return redirect(settings.MEDIA_URL + relative)
 
 def category_products(request, slug):
     category = get_object_or_404(Category, slug=slug)
-    products = Product.objects.filter(category=category, is_active=True)
-    return render(request, 'products/category_products.html', {
-        'category': category,
-        'products': products
-    })
+    queryset = Product.objects.filter(category.subtree_filter('category__'), is_active=True)
+    context = _listing_context(request, queryset)
+    context['category'] = category
+    context['breadcrumbs'] = category.get_ancestors(include_self=False)
+    context['product_count'] = queryset.count()
+    return render(request, 'products/category_products.html', context)
+
+SEARCH_PAGE_SIZE = 20
 
 def search_products(request):
     query = request.GET.get('q', '')
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    products = []
+    total = 0
     txt_products = []
     if query:
-        import os, csv
-        from django.conf import settings
-        file_path = os.path.join(settings.BASE_DIR, 'products.txt')
-        try:
-            with open(file_path, encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    name = row.get('Item Name', '').strip()
-                    price = row.get('Price (INR)', '').strip()
-                    image_url = row.get('Image URL', '').strip()
-                    if query.lower() in name.lower():
-                        txt_products.append({
-                            'name': name, 
-                            'price': price, 
-                            'image_url': image_url
-                        })
-        except Exception:
-            pass
+        products, total = search.search_products(query, page, SEARCH_PAGE_SIZE)
+        # products.txt rows are unranked extras, so only show them once
+        if page == 1:
+            txt_products = get_catalog().search(query)
         # Track search behavior
-        if request.user.is_authenticated:
-            session_id = request.session.session_key or str(uuid.uuid4())
-            UserBehavior.objects.create(
-                user=request.user,
-                behavior_type='search',
-                session_id=session_id,
-                metadata={'query': query}
-            )
+        track_behavior(request, 'search', metadata={'query': query})
     return render(request, 'products/search_results.html', {
+        'products': products,
         'txt_products': txt_products,
-        'query': query
+        'query': query,
+        'total': total,
+        'page': page,
+        'previous_page': page - 1 if page > 1 else None,
+        'next_page': page + 1 if page * SEARCH_PAGE_SIZE < total else None,
     })
 
-@login_required
+def _posted_quantity(request, default=1):
+    try:
+        return int(request.POST.get('quantity', default))
+    except (TypeError, ValueError):
+        return default
+
 def cart_view(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    return render(request, 'products/cart.html', {'cart': cart})
+    return render(request, 'products/cart.html', {'summary': get_cart_summary(request)})
 
-@login_required
 def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, pk=product_id)
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': 1}
-    )
-    
-    if not created:
-        cart_item.quantity += 1
-        cart_item.save()
+    product = get_object_or_404(Product.objects.only('id', 'name'), pk=product_id)
+    store = get_cart_store()
+    store.add(store.key_for(request, create=True), product.pk, max(1, _posted_quantity(request)))
     
     # Track behavior
-    session_id = request.session.session_key or str(uuid.uuid4())
-    UserBehavior.objects.create(
-        user=request.user,
-        product=product,
-        behavior_type='cart_add',
-        session_id=session_id
-    )
+    track_behavior(request, 'cart_add', product)
     
     messages.success(request, f'{product.name} added to cart!')
     return redirect('products:cart_view')
 
-@login_required
-def remove_from_cart(request, item_id):
-    cart_item = get_object_or_404(CartItem, pk=item_id, cart__user=request.user)
-    product = cart_item.product
-    cart_item.delete()
-    
-    # Track behavior
-    session_id = request.session.session_key or str(uuid.uuid4())
-    UserBehavior.objects.create(
-        user=request.user,
-        product=product,
-        behavior_type='cart_remove',
-        session_id=session_id
-    )
-    
-    messages.success(request, 'Item removed from cart!')
+def remove_from_cart(request, product_id):
+    store = get_cart_store()
+    if store.remove(store.key_for(request, create=True), product_id):
+        # Track behavior
+        track_behavior(request, 'cart_remove', Product(pk=product_id))
+        messages.success(request, 'Item removed from cart!')
     return redirect('products:cart_view')
 
-@login_required
-def update_cart_item(request, item_id):
+def update_cart_item(request, product_id):
     if request.method == 'POST':
-        cart_item = get_object_or_404(CartItem, pk=item_id, cart__user=request.user)
-        quantity = int(request.POST.get('quantity', 1))
-        
-        if quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
-        else:
-            cart_item.delete()
+        store = get_cart_store()
+        store.set(store.key_for(request, create=True), product_id, _posted_quantity(request))
     
     return redirect('products:cart_view')
\ No newline at end of file